@@ -0,0 +1,86 @@
+import bot_info
+import discord
+import asyncio
+
+# Intent and cache profiles, picked with "cache_profile" in bot_info.json and tweaked with "cache_overrides".
+# Features that need guild members fetch them on demand when the profile doesn't keep them cached.
+
+PROFILES = {
+    # Everything cached, the old behaviour
+    "full": {"intents": {}, "member_cache": "all", "chunk_guilds_at_startup": True, "max_messages": 1000},
+    # All intents, but members are only cached while in voice and requested on demand
+    "balanced": {"intents": {}, "member_cache": "voice", "chunk_guilds_at_startup": False, "max_messages": 100},
+    # No member or presence intents and no message cache
+    "minimal": {"intents": {"members": False, "presences": False}, "member_cache": "voice", "chunk_guilds_at_startup": False, "max_messages": None}
+}
+
+def profile_name() -> str:
+    return bot_info.data.get('cache_profile', 'full')
+
+def build_options() -> dict:
+    profile = dict(PROFILES[profile_name()])
+    overrides = bot_info.data.get('cache_overrides', {})
+    intent_overrides = {**profile["intents"], **overrides.get('intents', {})}
+    profile.update({key: value for key, value in overrides.items() if key != 'intents'})
+
+    intents = discord.Intents.all()
+    for name, enabled in intent_overrides.items():
+        setattr(intents, name, enabled)
+
+    if profile["member_cache"] == "all":
+        member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+    else:
+        member_cache_flags = discord.MemberCacheFlags.none()
+        if profile["member_cache"] == "voice" and intents.voice_states:
+            member_cache_flags.voice = True
+
+    return {
+        "intents": intents,
+        "member_cache_flags": member_cache_flags,
+        "chunk_guilds_at_startup": profile["chunk_guilds_at_startup"] and intents.members,
+        "max_messages": profile["max_messages"]
+    }
+
+def _caches_members(guild: discord.Guild) -> bool:
+    return guild._state.member_cache_flags.joined and guild.chunked
+
+# Full member list of a guild, chunked without caching when the profile doesn't keep members around
+async def get_members(guild: discord.Guild) -> list[discord.Member]:
+    if _caches_members(guild) or not guild._state._intents.members:
+        return guild.members
+    try:
+        return await guild.chunk(cache=guild._state.member_cache_flags.joined)
+    except asyncio.TimeoutError:
+        return guild.members
+
+# Member whose username or display name matches exactly, asking the gateway if it's not cached
+async def find_member(guild: discord.Guild, name: str):
+    name = name.lower()
+    member = discord.utils.find(lambda m: m.name.lower() == name or m.display_name.lower() == name, guild.members)
+    if member or _caches_members(guild) or not guild._state._intents.members:
+        return member
+    try:
+        candidates = await guild.query_members(query=name, limit=100, cache=False)
+    except asyncio.TimeoutError:
+        return None
+    return discord.utils.find(lambda m: m.name.lower() == name or m.display_name.lower() == name, candidates)
+
+# Member with up to date presence data (status, activities)
+async def get_member_with_presence(guild: discord.Guild, user_id: int):
+    member = guild.get_member(user_id)
+    if (member and _caches_members(guild)) or not guild._state._intents.presences:
+        return member
+    try:
+        members = await guild.query_members(user_ids=[user_id], presences=True, cache=False)
+    except asyncio.TimeoutError:
+        return member
+    return members[0] if members else member
+
+async def get_member(guild: discord.Guild, user_id: int):
+    member = guild.get_member(user_id)
+    if member is not None:
+        return member
+    try:
+        return await guild.fetch_member(user_id)
+    except discord.HTTPException:
+        return None
@@ -6,6 +6,8 @@ import asyncio
 import time
 import asyncpg
 import bot_info
+import metrics
+import memory
 import json
 import io
 import re
@@ -18,6 +20,7 @@ class AI(commands.Cog):
         self.bot = bot
         self.conversations = {}
         self.db: Optional[asyncpg.Pool] = None
+        memory.register("ai.conversations", self, "conversations")
     
     def get_conversation(self, ctx) -> tuple:
         return (ctx.guild.id, ctx.channel.id, ctx.author.id) if ctx.guild else (ctx.author.id, ctx.channel.id)
@@ -331,5 +334,5 @@ Example response format:
 
 async def setup(bot):
     cog = AI(bot)
-    cog.db = await asyncpg.create_pool(bot_info.data['database'])
+    cog.db = getattr(bot, 'db', None) or await asyncpg.create_pool(bot_info.data['database'], init=metrics.instrument_connection)
     await bot.add_cog(cog)
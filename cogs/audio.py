@@ -1,7 +1,6 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-import yt_dlp
 import spotipy
 import bot_info
 import os
@@ -12,6 +11,10 @@ from collections import deque
 from datetime import datetime
 from typing import Optional
 from concurrent.futures import ThreadPoolExecutor
+import lazy_imports
+import memory
+
+yt_dlp = lazy_imports.module("yt_dlp")
 
 YDL_OPTIONS = {
     'format': 'bestaudio/best',
@@ -36,6 +39,9 @@ class Audio(commands.Cog):
         self.original_queues = {}
         self.metadata_cache = {}
         self.executor = ThreadPoolExecutor(max_workers=4)
+        memory.register("audio.queues", self, "queues")
+        memory.register("audio.original_queues", self, "original_queues")
+        memory.register("audio.metadata_cache", self, "metadata_cache")
 
     def get_queue(self, guild_id):
         if guild_id not in self.queues:
@@ -2,9 +2,12 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import os
-import aiohttp
 from urllib.parse import urlparse
 import asyncio
+import metrics
+import scheduler
+import io_pool
+from workspace import workspaces
 
 DEFAULTS = {
     "font": "Futura Condensed Extra Bold.otf",
@@ -23,13 +26,7 @@ class Caption(commands.Cog):
         self.bot = bot
     
     async def download_file(self, url: str, save_path: str):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    with open(save_path, 'wb') as f:
-                        f.write(await resp.read())
-                else:
-                    raise ValueError("Failed to download the file.")
+        await self.bot.download_cache.fetch(url, save_path)
     
     def construct_filter_graph(self, text: str, font: str, font_color: str, font_size: int, padding_color: str, padding_size: int, border_width: int, border_color: str, position: str = "center"):
         horizontal, vertical = "center", "center"
@@ -71,8 +68,10 @@ class Caption(commands.Cog):
             "-vf", filter_graph,
             output_path
         ]
-        result = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        stdout, stderr = await result.communicate()
+        async with scheduler.slot("caption"):
+            with metrics.phase("subprocess"):
+                result = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                stdout, stderr = await result.communicate()
         if result.returncode != 0:
             raise ValueError(f"Failed to apply caption: {stderr}")
     
@@ -82,11 +81,12 @@ class Caption(commands.Cog):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def caption(self, ctx: commands.Context, url: str, text: str, font: str = DEFAULTS["font"], font_color: str = DEFAULTS["font_color"], font_size: int = DEFAULTS["font_size"], padding_color: str = DEFAULTS["padding_color"], padding_size: int = DEFAULTS["padding_size"], border_width: int = DEFAULTS["border_width"], border_color: str = DEFAULTS["border_color"], position: str = DEFAULTS["position"]):
         await ctx.typing()
+        workspace = await workspaces.acquire("caption")
         
         try:
             file_name = os.path.basename(urlparse(url).path)
-            input_path = f"vids/{file_name}"
-            output_path = f"vids/caption-{file_name}"
+            input_path = workspace.file(file_name)
+            output_path = workspace.file(f"caption-{file_name}")
 
             await self.download_file(url, input_path)
 
@@ -102,18 +102,14 @@ class Caption(commands.Cog):
         except Exception as e:
             error_message = str(e)
             if len(error_message) > 2000:
-                with open("vids/error.txt", "w") as f:
-                    f.write(error_message)
-                await ctx.send("Error:", file=discord.File("vids/error.txt"))
-                os.remove("vids/error.txt")
+                error_path = workspace.file("error.txt")
+                await io_pool.write_text(error_path, error_message)
+                await ctx.send("Error:", file=discord.File(error_path))
             else:
                 await ctx.send(f"Error: {error_message}")
 
         finally:
-            if os.path.exists(input_path):
-                os.remove(input_path)
-            if os.path.exists(output_path):
-                os.remove(output_path)
+            await workspace.release()
 
 async def setup(bot):
     await bot.add_cog(Caption(bot))
\ No newline at end of file
@@ -2,12 +2,13 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import os
-import aiohttp
 import json
 import mimetypes
 from urllib.parse import urlparse
 from typing import Optional
 import asyncio
+import metrics
+from workspace import workspaces
 
 class Exif(commands.Cog):
     def __init__(self, bot):
@@ -19,13 +20,14 @@ class Exif(commands.Cog):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def exif(self, ctx: commands.Context, url: str = None, attachment: Optional[discord.Attachment] = None):
         await ctx.typing()
+        workspace = await workspaces.acquire("exif")
         
         try:
             if not url and not (ctx.message.attachments or attachment):
                 await ctx.send("Please provide an URL or attach a media file.")
                 return
             
-            file_path = await self.download_media(ctx, url)
+            file_path = await self.download_media(ctx, url, workspace)
 
             metadata = await self.get_metadata(file_path)
 
@@ -95,27 +97,20 @@ class Exif(commands.Cog):
             raise commands.CommandError(f"An error occurred: `{e}`")
 
         finally:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            await workspace.release()
     
 
-    async def download_media(self, ctx: commands.Context, url: str) -> str:
+    async def download_media(self, ctx: commands.Context, url: str, workspace) -> str:
         if self.is_valid_url(url):
             file_name = os.path.basename(urlparse(url).path)
-            file_path = f"vids/{file_name}"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        with open(file_path, 'wb') as f:
-                            f.write(await resp.read())
-                    else:
-                        raise ValueError("Failed to download the file.")
+            file_path = workspace.file(file_name)
+            await self.bot.download_cache.fetch(url, file_path)
             
         elif ctx.message.attachments or ctx.interaction.message.attachments:
             attachment = ctx.message.attachments[0] or ctx.interaction.message.attachments[0]
             file_name = attachment.filename
-            file_path = f"vids/{file_name}"
-            await attachment.save(file_path)
+            file_path = workspace.file(file_name)
+            await self.bot.download_cache.fetch(attachment.url, file_path)
         else:
             raise ValueError("Invalid input: Malformed URL")
         return file_path
@@ -134,8 +129,9 @@ class Exif(commands.Cog):
                 "-print_format", "json",
                 file_path
             ]
-            result = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-            stdout, stderr = await result.communicate()
+            with metrics.phase("subprocess"):
+                result = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                stdout, stderr = await result.communicate()
 
             if result.returncode != 0:
                 raise ValueError(f"FFprobe error: {stderr}")
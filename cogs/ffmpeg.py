@@ -3,11 +3,14 @@ from discord.ext import commands
 from discord import app_commands
 import time
 import os
-import aiohttp
 import shlex
 from urllib.parse import urlparse
 from pathlib import Path
 import asyncio
+import metrics
+import scheduler
+import io_pool
+from workspace import workspaces
 
 
 class FFmpeg(commands.Cog):
@@ -22,11 +25,13 @@ class FFmpeg(commands.Cog):
     async def ffmpeg_command(self, ctx: commands.Context, *, args: str):
         
         await ctx.typing()
+        workspace = await workspaces.acquire("ffmpeg")
 
         try:
             start_time = time.time()
 
-            processing_dir = 'vids'
+            # Relative output names end up in the job's workspace since ffmpeg runs from there
+            processing_dir = str(workspace.path)
             
             input_files = []
 
@@ -59,14 +64,16 @@ class FFmpeg(commands.Cog):
 
             
 
-            process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-            
-            output_task = asyncio.create_task(self.read_output(process.stdout))
-            error_task = asyncio.create_task(self.read_stderr(process.stderr))
+            async with scheduler.slot("ffmpeg"):
+                with metrics.phase("subprocess"):
+                    process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=processing_dir)
+                    
+                    output_task = asyncio.create_task(self.read_output(process.stdout))
+                    error_task = asyncio.create_task(self.read_stderr(process.stderr))
 
 
-            await asyncio.gather(output_task, error_task)
-            await process.wait()
+                    await asyncio.gather(output_task, error_task)
+                    await process.wait()
 
             output = await output_task
             error_output = await error_task
@@ -75,16 +82,15 @@ class FFmpeg(commands.Cog):
                 error_message = error_output
                 if len(error_message) > 2000:
                     error_file_path = os.path.join(processing_dir, "ffmpeg_error.txt")
-                    with open(error_file_path, 'w') as f:
-                        f.write(error_message)
+                    await io_pool.write_text(error_file_path, error_message)
                     await ctx.send("FFmpeg encountered an error.", file=discord.File(error_file_path))
-                    os.remove(error_file_path)
+                    await io_pool.remove(error_file_path)
                 else:
                     await ctx.send(f"FFmpeg encountered an error: ```{error_message}```")
                 return
 
 
-            output_file = [arg for arg in split_args if not arg.startswith("-")][-1]
+            output_file = os.path.join(processing_dir, [arg for arg in split_args if not arg.startswith("-")][-1])
             file_size = os.path.getsize(output_file)
             boost_count = ctx.guild.premium_subscription_count if ctx.guild else 0
             max_size = self.get_max_file_size(boost_count)
@@ -100,12 +106,7 @@ class FFmpeg(commands.Cog):
         except Exception as e:
             raise commands.CommandError(f"Error: `{e}`")
         finally:
-            for file in input_files:
-                if os.path.exists(file):
-                    os.remove(file)
-            output_file = [arg for arg in split_args if not arg.startswith("-")][-1]
-            if os.path.exists(output_file):
-                os.remove(output_file)
+            await workspace.release()
 
 
     async def read_output(self, stream):
@@ -132,14 +133,8 @@ class FFmpeg(commands.Cog):
 
     async def download_file(self, url: str, file_path: str) -> bool:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        with open(file_path, 'wb') as f:
-                            f.write(await resp.read())
-                        return True
-                    else:
-                        return False
+            await self.bot.download_cache.fetch(url, file_path)
+            return True
         except Exception as e:
             print(f"Error downloading the media from {url}: {e}")
             return False
@@ -5,10 +5,12 @@ import os
 import time
 import subprocess
 import shlex
-import aiohttp
 from urllib.parse import urlparse
 from pathlib import Path
 import asyncio
+import metrics
+import scheduler
+from workspace import workspaces
 
 class ImageMagick(commands.Cog):
     def __init__(self, bot):
@@ -20,12 +22,13 @@ class ImageMagick(commands.Cog):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def imagemagick(self, ctx: commands.Context, *, args: str):
         await ctx.typing()
-        
+        workspace = await workspaces.acquire("imagemagick")
 
         try:
             start_time = time.time()
 
-            processing_dir = 'vids'
+            # Relative output names end up in the job's workspace since magick runs from there
+            processing_dir = str(workspace.path)
 
             split_args = shlex.split(args)
 
@@ -33,7 +36,7 @@ class ImageMagick(commands.Cog):
                 await ctx.send("You must provide at least an input file and an output file.")
                 return
             input_file = split_args[0]
-            output_file = split_args[-1]
+            output_file = os.path.join(processing_dir, split_args[-1])
 
             if self.is_valid_url(input_file):
                 filename = self.get_filename(input_file)
@@ -46,7 +49,7 @@ class ImageMagick(commands.Cog):
             
             cmd = ["magick"] + split_args
 
-            result = await self.run_imagemagick(cmd)
+            result = await self.run_imagemagick(cmd, cwd=processing_dir)
 
             if result.returncode != 0:
                 error_message = result.stderr
@@ -67,28 +70,21 @@ class ImageMagick(commands.Cog):
         except Exception as e:
             raise commands.CommandError(f"An error occurred: `{e}`")
         finally:
-            if "local_input_file" in locals() and os.path.exists(local_input_file):
-                os.remove(local_input_file)
-            if os.path.exists(output_file):
-                os.remove(output_file)
+            await workspace.release()
 
 
-    async def run_imagemagick(self, args: list):
-        process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        stdout, stderr = await process.communicate()
+    async def run_imagemagick(self, args: list, cwd: str = None):
+        async with scheduler.slot("imagemagick"):
+            with metrics.phase("subprocess"):
+                process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=cwd)
+                stdout, stderr = await process.communicate()
         result = subprocess.CompletedProcess(args, process.returncode, stdout.decode('utf-8'), stderr.decode('utf-8'))
         return result
 
     async def download_file(self, url: str, file_path: str) -> bool:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        with open(file_path, 'wb') as f:
-                            f.write(await resp.read())
-                        return True
-                    else:
-                        return False
+            await self.bot.download_cache.fetch(url, file_path)
+            return True
         except Exception as e:
             print(f"Error downloading the media from {url}: {e}")
             return False
@@ -1,15 +1,18 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import aiohttp
 import bot_info
+import cache_policy
 from datetime import datetime
 from webcolors import hex_to_name, name_to_hex
-from PIL import Image, ImageDraw
 import io
 import re
 import random
 from math import fmod
+import lazy_imports
+
+Image = lazy_imports.module("PIL.Image")
+ImageDraw = lazy_imports.module("PIL.ImageDraw")
 
 class Info(commands.Cog):
     def __init__(self, bot):
@@ -207,12 +210,8 @@ class Info(commands.Cog):
                     await ctx.send("Could not find user. Please use an user ID instead.")
                     return
         if isinstance(member, discord.Member) and ctx.guild:
-            guild = ctx.guild
-            if guild:
-                try:
-                    member = guild.get_member(member.id)
-                except discord.NotFound:
-                    pass
+            # For the presence fields, the member cache may be off in this profile
+            member = await cache_policy.get_member_with_presence(ctx.guild, member.id) or member
 
         user = await self.bot.fetch_user(member.id)
         embed = discord.Embed(
@@ -332,7 +331,8 @@ class Info(commands.Cog):
         )
         embed.set_thumbnail(url=guild.icon.url if guild.icon else "")
         embed.add_field(name="ID", value=guild.id, inline=True)
-        embed.add_field(name="Owner", value=guild.owner.mention if guild.owner else "Unknown", inline=True)
+        owner = guild.owner or await cache_policy.get_member(guild, guild.owner_id)
+        embed.add_field(name="Owner", value=owner.mention if owner else "Unknown", inline=True)
         embed.add_field(name="Owner ID", value=guild.owner_id, inline=True)
         embed.add_field(name="Description", value=guild.description, inline=False)
         embed.add_field(name="Verification Level", value=str(guild.verification_level).capitalize(), inline=True)
@@ -586,6 +586,13 @@ class Info(commands.Cog):
         embed.add_field(name="Users", value=len(set(self.bot.get_all_members())), inline=True)
         embed.add_field(name="Developers", value="[nkrasn](https://github.com/nkrasn 'Original Developer.'), [MiniatureEge2006](https://github.com/MiniatureEge2006 'Current Developer.')", inline=True)
         embed.add_field(name="Source Code", value="https://github.com/MiniatureEge2006/g-man", inline=True)
+        if isinstance(self.bot, commands.AutoShardedBot):
+            shard_guilds = {}
+            for guild in self.bot.guilds:
+                shard_guilds[guild.shard_id] = shard_guilds.get(guild.shard_id, 0) + 1
+            shard_lines = "\n".join(f"Shard {shard_id}: {round(latency * 1000)}ms, {shard_guilds.get(shard_id, 0)} servers" for shard_id, latency in self.bot.latencies)
+            cluster_id = getattr(self.bot, 'cluster_id', None)
+            embed.add_field(name=f"Shards ({self.bot.shard_count} total{f', cluster {cluster_id}' if cluster_id is not None else ''})", value=shard_lines[:1024] or "None", inline=False)
         embed.set_thumbnail(url=self.bot.user.avatar.url)
         embed.set_author(name=f"{self.bot.user.name}#{self.bot.user.discriminator}", icon_url=self.bot.user.avatar.url, url=f"https://discord.com/users/{self.bot.user.id}")
         embed.set_footer(text=f"Requested by {ctx.author}", icon_url=ctx.author.display_avatar.url)
@@ -603,54 +610,54 @@ class Info(commands.Cog):
         params = {"q": location, "appid": api_key, "units": "metric"}
         geo_params = {"q": location, "appid": api_key, "limit": 1}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(geocode_url, params=geo_params) as geo_response:
-                geo_data = await geo_response.json()
-                if geo_response.status == 200 and geo_data:
-                    coordinates_lat = geo_data[0]["lat"]
-                    coordinates_lon = geo_data[0]["lon"]
-                    formatted_location = geo_data[0]["name"]
+        session = self.bot.http_client
+        async with session.get(geocode_url, params=geo_params) as geo_response:
+            geo_data = await geo_response.json()
+            if geo_response.status == 200 and geo_data:
+                coordinates_lat = geo_data[0]["lat"]
+                coordinates_lon = geo_data[0]["lon"]
+                formatted_location = geo_data[0]["name"]
 
-                    async with session.get(base_url, params=params) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            city = data["name"]
-                            country = data["sys"]["country"]
-                            weather = data["weather"][0]["main"]
-                            description = data["weather"][0]["description"].capitalize()
-                            temperature = data["main"]["temp"]
-                            pressure = data["main"]["pressure"]
-                            feels_like = data["main"]["feels_like"]
-                            humidity = data["main"]["humidity"]
-                            visibility = data["visibility"]
-                            wind_speed = data["wind"]["speed"]
-                            wind_direction = data["wind"]["deg"]
-                            clouds = data["clouds"]["all"]
-                            timestamp = datetime.fromtimestamp(data["dt"]).strftime("%Y-%m-%d %H:%M:%S (%B %d, %Y at %I:%M:%S %p)")
-                            icon = data["weather"][0]["icon"]
-                            icon_url = f"http://openweathermap.org/img/wn/{icon}.png"
-                            sunrise = datetime.fromtimestamp(data["sys"]["sunrise"]).strftime("%Y-%m-%d %H:%M:%S (%B %d, %Y at %I:%M:%S %p)")
-                            sunset = datetime.fromtimestamp(data["sys"]["sunset"]).strftime("%Y-%m-%d %H:%M:%S (%B %d, %Y at %I:%M:%S %p)")
-                            map_image_url = f"https://static-maps.yandex.ru/1.x/?ll={coordinates_lon},{coordinates_lat}&spn=0.1,0.1&l=map&size=600,430&pt={coordinates_lat},{coordinates_lon},pm2rdm"
-                            maps_link = f"https://google.com/maps/search/?api=1&query={coordinates_lat},{coordinates_lon}"
+                async with session.get(base_url, params=params) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        city = data["name"]
+                        country = data["sys"]["country"]
+                        weather = data["weather"][0]["main"]
+                        description = data["weather"][0]["description"].capitalize()
+                        temperature = data["main"]["temp"]
+                        pressure = data["main"]["pressure"]
+                        feels_like = data["main"]["feels_like"]
+                        humidity = data["main"]["humidity"]
+                        visibility = data["visibility"]
+                        wind_speed = data["wind"]["speed"]
+                        wind_direction = data["wind"]["deg"]
+                        clouds = data["clouds"]["all"]
+                        timestamp = datetime.fromtimestamp(data["dt"]).strftime("%Y-%m-%d %H:%M:%S (%B %d, %Y at %I:%M:%S %p)")
+                        icon = data["weather"][0]["icon"]
+                        icon_url = f"http://openweathermap.org/img/wn/{icon}.png"
+                        sunrise = datetime.fromtimestamp(data["sys"]["sunrise"]).strftime("%Y-%m-%d %H:%M:%S (%B %d, %Y at %I:%M:%S %p)")
+                        sunset = datetime.fromtimestamp(data["sys"]["sunset"]).strftime("%Y-%m-%d %H:%M:%S (%B %d, %Y at %I:%M:%S %p)")
+                        map_image_url = f"https://static-maps.yandex.ru/1.x/?ll={coordinates_lon},{coordinates_lat}&spn=0.1,0.1&l=map&size=600,430&pt={coordinates_lat},{coordinates_lon},pm2rdm"
+                        maps_link = f"https://google.com/maps/search/?api=1&query={coordinates_lat},{coordinates_lon}"
 
-                            embed = discord.Embed(
-                                title=f"Weather Info - {city}, {country}",
-                                url=f"https://openweathermap.org/city/{data['id']}",
-                                description=f"Currently {temperature}°C with {description}. (feels like {feels_like}°C)\n\nSunrise: {sunrise}\nSunset: {sunset}\n\n**Pressure:** {pressure} hPa\n**Humidity:** {humidity}%\n**Visibility:** {visibility} m\n**Wind:** {wind_speed} m/s from {wind_direction}°\n**Clouds:** {clouds}%\n**Coordinates:** [{coordinates_lat}, {coordinates_lon}]({maps_link})\n**Location:** {formatted_location}\n**Timestamp:** {timestamp}",
-                                color=discord.Color.blue(),
-                                timestamp=discord.utils.utcnow()
-                            )
-                            embed.set_author(name=f"{ctx.author.name}#{ctx.author.discriminator}", icon_url=ctx.author.display_avatar.url, url=f"https://discord.com/users/{ctx.author.id}")
-                            embed.set_thumbnail(url=icon_url)
-                            embed.set_image(url=map_image_url)
-                            embed.set_footer(text="OpenWeatherMap API", icon_url="https://openweathermap.org/themes/openweathermap/assets/img/mobile_app/android-app-top-banner.png")
+                        embed = discord.Embed(
+                            title=f"Weather Info - {city}, {country}",
+                            url=f"https://openweathermap.org/city/{data['id']}",
+                            description=f"Currently {temperature}°C with {description}. (feels like {feels_like}°C)\n\nSunrise: {sunrise}\nSunset: {sunset}\n\n**Pressure:** {pressure} hPa\n**Humidity:** {humidity}%\n**Visibility:** {visibility} m\n**Wind:** {wind_speed} m/s from {wind_direction}°\n**Clouds:** {clouds}%\n**Coordinates:** [{coordinates_lat}, {coordinates_lon}]({maps_link})\n**Location:** {formatted_location}\n**Timestamp:** {timestamp}",
+                            color=discord.Color.blue(),
+                            timestamp=discord.utils.utcnow()
+                        )
+                        embed.set_author(name=f"{ctx.author.name}#{ctx.author.discriminator}", icon_url=ctx.author.display_avatar.url, url=f"https://discord.com/users/{ctx.author.id}")
+                        embed.set_thumbnail(url=icon_url)
+                        embed.set_image(url=map_image_url)
+                        embed.set_footer(text="OpenWeatherMap API", icon_url="https://openweathermap.org/themes/openweathermap/assets/img/mobile_app/android-app-top-banner.png")
 
-                            await ctx.send(embed=embed)
-                        else:
-                            await ctx.send(f"Error: Could not fetch weather data for {location}: Weather status: {response.status} - {response.reason} - Location status: {geo_response.status} - {geo_response.reason}")
-                else:
-                    await ctx.send(f"Error: Could not find location: {location} - Location status: {geo_response.status} - {geo_response.reason}")
+                        await ctx.send(embed=embed)
+                    else:
+                        await ctx.send(f"Error: Could not fetch weather data for {location}: Weather status: {response.status} - {response.reason} - Location status: {geo_response.status} - {geo_response.reason}")
+            else:
+                await ctx.send(f"Error: Could not find location: {location} - Location status: {geo_response.status} - {geo_response.reason}")
     
     @commands.hybrid_command(name="colorinfo", description="Displays information about a color. Defaults to a random color.", aliases=["color"])
     @app_commands.describe(color="The color name or color code (HEX, RGB/A, HSL/A, HSV/A or CMYK)")
@@ -7,11 +7,15 @@ import mimetypes
 from urllib.parse import urlparse
 import re
 from pathlib import Path
+from io import BytesIO
+import job_queue
+import io_pool
 
 class Media(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.tags_cog = bot.get_cog('Tags')
+        self.pending_loads = {}
     
     async def process_media_input(self, ctx: commands.Context, input_value: str = None, attachment: discord.Attachment = None):
         if not input_value and not attachment:
@@ -61,46 +65,44 @@ class Media(commands.Cog):
 
         return None, None, "Invalid input format."
     
-    async def run_gscript_command(self, ctx, command_name, input_key, output_key=None, **kwargs):
-        output_key = output_key or f"{command_name}_{ctx.message.id}"
-
-        try:
-            func = self.tags_cog.processor.gscript_commands.get(command_name)
-            if not func:
-                raise commands.CommandError(f"Unknown command: {command_name}")
-
-            if input_key not in self.tags_cog.processor.media_cache:
-                raise commands.CommandError(f"{input_key} not found in media cache")
+    # With the job queue enabled the download happens on the worker, so only the URL is kept until the command runs
+    async def load_media(self, ctx: commands.Context, url: str, media_key: str):
+        if job_queue.enabled():
+            self.pending_loads.setdefault(ctx, {})[media_key] = url
+            return
+        await self.tags_cog.processor._load_media(url=url, media_key=media_key)
 
-            result = await func(input_key=input_key, output_key=output_key, **kwargs)
+    async def send_output(self, ctx, output_path: Path, command_name: str, custom_name: str = None):
+        ext = output_path.suffix[1:]
+        final_name = f"{custom_name}.{ext}" if custom_name else f"{command_name}.{ext}"
+        final_path = output_path.with_name(final_name)
+        await io_pool.replace(output_path, final_path)
 
-            if not isinstance(result, str) or not result.startswith("media://"):
-                raise commands.CommandError(f"{command_name} failed: {result}")
+        file = discord.File(BytesIO(await io_pool.read_bytes(final_path)), filename=final_name)
+        await ctx.send(file=file)
 
+    # Runs after every command in the cog, even one that failed between load_media and run_gscript_command
+    async def cog_after_invoke(self, ctx: commands.Context):
+        self.pending_loads.pop(ctx, None)
 
-            render_result = await self.tags_cog.processor._render_media(
-                media_key=output_key,
-                extra_args=[Path(result[8:]).suffix[1:]]
-            )
-            if not isinstance(render_result, str) or not render_result.startswith("media://"):
-                raise commands.CommandError(f"Rendering failed: {render_result}")
-
-            output_path = Path(render_result[8:])
-            if not output_path.exists():
-                raise commands.CommandError(f"Output file not found at {output_path}")
-
+    async def run_gscript_command(self, ctx, command_name, input_key, output_key=None, **kwargs):
+        output_key = output_key or f"{command_name}_{ctx.message.id}"
 
-            ext = output_path.suffix[1:]
-            custom_name = kwargs.pop("name", None)
-            final_name = f"{custom_name}.{ext}" if custom_name else f"{command_name}.{ext}"
-            final_path = output_path.with_name(final_name)
-            if final_path.exists():
-                final_path.unlink()
-            output_path.rename(final_path)
+        if job_queue.enabled():
+            loads = self.pending_loads.pop(ctx, {})
+            payload = {"loads": loads, "command": command_name, "input_key": input_key, "output_key": output_key, "kwargs": kwargs}
+            async with self.bot.job_queue.run("media", payload) as (paths, errors):
+                if errors:
+                    raise commands.CommandError(errors[0])
+                await self.send_output(ctx, Path(paths[0]), command_name, kwargs.get("name"))
+            return
 
-            with open(final_path, 'rb') as f:
-                file = discord.File(f, filename=final_name)
-                await ctx.send(file=file)
+        try:
+            try:
+                output_path = await self.tags_cog.processor.run_command(command_name, input_key, output_key, **kwargs)
+            except ValueError as e:
+                raise commands.CommandError(str(e))
+            await self.send_output(ctx, output_path, command_name, kwargs.get("name"))
 
         finally:
             for key in [input_key, output_key]:
@@ -143,7 +145,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "convert", input_key, format=format)
     
     @media.command(name="audioputreplace", description="Replace a video/audio/image's audio with another audio.")
@@ -178,8 +180,8 @@ class Media(commands.Cog):
             raise commands.CommandError(audio_parsed[2])
         audio_url = audio_parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
-        await self.tags_cog.processor._load_media(url=audio_url, media_key=audio_key)
+        await self.load_media(ctx, input_url, input_key)
+        await self.load_media(ctx, audio_url, audio_key)
         
         await self.run_gscript_command(
             ctx, 
@@ -226,8 +228,8 @@ class Media(commands.Cog):
             raise commands.CommandError(audio_parsed[2])
         audio_url = audio_parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
-        await self.tags_cog.processor._load_media(url=audio_url, media_key=audio_key)
+        await self.load_media(ctx, input_url, input_key)
+        await self.load_media(ctx, audio_url, audio_key)
         
         await self.run_gscript_command(
             ctx, 
@@ -255,7 +257,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "trim", input_key, start_time=start, end_time=end)
     
     @media.command(name="speed", description="Change a video/audio/image's speed.")
@@ -272,7 +274,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "speed", input_key, speed=speed)
     
     @media.command(name="reverse", description="Reverse a video/audio/image.")
@@ -285,7 +287,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "reverse", input_key)
     
     @image.command(name="text", description="Add text to an image.")
@@ -312,7 +314,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "text", input_key, text=text, x=x, y=y, color=color, font_size=font_size, font=font, outline_color=outline_color, outline_width=outline_width, shadow_color=shadow_color, shadow_offset=shadow_offset, shadow_blur=shadow_blur, wrap_width=wrap_width, line_spacing=line_spacing)
     
     @iv.command(name="fps", description="Change a video or image's frame rate.")
@@ -329,7 +331,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "fps", input_key, fps_value=fps)
     
     @iv.command(name="contrast", description="Adjust an image or video's contrast.")
@@ -342,7 +344,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "contrast", input_key, contrast_level=contrast_level)
     
     @iv.command(name="opacity", description="Adjust an image or video's opacity.")
@@ -355,7 +357,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "opacity", input_key, opacity_level=opacity_level)
     
     @iv.command(name="brightness", description="Adjust an image or video's brightness.")
@@ -368,7 +370,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "brightness", input_key, brightness_level=brightness_level)
     
     @iv.command(name="gamma", description="Adjust an image or video's gamma.")
@@ -381,7 +383,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "gamma", input_key, gamma_level=gamma_level)
     
     @iv.command(name="saturate", description="Adjust an image or video's saturation.")
@@ -394,7 +396,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "saturate", input_key, saturation_level=saturation_level)
     
     @iv.command(name="hue", description="Adjust an image or video's hue shift.")
@@ -407,7 +409,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "hue", input_key, hue_shift=hue_shift)
     
     @iv.command(name="grayscale", description="Convert an image or video to grayscale.")
@@ -420,7 +422,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "grayscale", input_key)
     
     @iv.command(name="sepia", description="Convert an image or video to sepia.")
@@ -433,7 +435,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "sepia", input_key)
     
     @iv.command(name="resize", description="Resize an image or video.")
@@ -446,7 +448,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "resize", input_key, width=width, height=height)
     
     @iv.command(name="rotate", description="Rotate an image or video.")
@@ -459,7 +461,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "rotate", input_key, angle=angle)
     
     @iv.command(name="crop", description="Crop an image or video.")
@@ -472,7 +474,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "crop", input_key, x=x, y=y, width=width, height=height)
     
     @iv.command(name="invert", description="Invert the colors of a video or image.")
@@ -485,7 +487,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "invert", input_key)
     
     @iv.command(name="fadein", description="Apply fade-in effect to a video or image.")
@@ -498,7 +500,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "fadein", input_key, duration=duration, color=color, audio=audio)
     
     @iv.command(name="fadeout", description="Apply fade-out effect to a video or image.")
@@ -518,7 +520,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "fadeout", input_key, start_time=start_time, duration=duration, color=color, audio=audio)
     
     @iv.command(name="overlay", description="Overlay one image/video on another.")
@@ -551,8 +553,8 @@ class Media(commands.Cog):
             raise commands.CommandError(overlay_parsed[2])
         overlay_url = overlay_parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=base_url, media_key=base_key)
-        await self.tags_cog.processor._load_media(url=overlay_url, media_key=overlay_key)
+        await self.load_media(ctx, base_url, base_key)
+        await self.load_media(ctx, overlay_url, overlay_key)
         
         await self.run_gscript_command(
             ctx, 
@@ -573,7 +575,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "colorkey", input_key, color=color, similarity=similarity, blend=blend)
     
     @iv.command(name="chromakey", description="YUV colorspace key an image or video.")
@@ -586,7 +588,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "chromakey", input_key, color=color, similarity=similarity, blend=blend)
     
     @av.command(name="volume", description="Adjust a video or audio's volume.")
@@ -603,7 +605,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "volume", input_key, volume_level=volume_level)
     
     @av.command(name="tremolo", description="Apply tremolo effect to an audio or video.")
@@ -621,7 +623,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "tremolo", input_key, frequency=frequency, depth=depth)
 
     @av.command(name="vibrato", description="Apply vibrato effect to an audio or video.")
@@ -639,7 +641,7 @@ class Media(commands.Cog):
             raise commands.CommandError(parsed[2])
         input_url = parsed[0][8:]
 
-        await self.tags_cog.processor._load_media(url=input_url, media_key=input_key)
+        await self.load_media(ctx, input_url, input_key)
         await self.run_gscript_command(ctx, "vibrato", input_key, frequency=frequency, depth=depth)
 
 
@@ -3,6 +3,7 @@ from discord.ext import commands
 from discord import app_commands
 from typing import Optional
 from datetime import datetime, timezone
+import cache_policy
 
 class Moderation(commands.Cog):
     def __init__(self, bot):
@@ -31,7 +32,8 @@ class Moderation(commands.Cog):
                 continue
 
 
-            member = guild.get_member(user.id)
+            # Fetched when not cached, the role checks below must never be skipped
+            member = await cache_policy.get_member(guild, user.id)
 
 
             if member is not None:
@@ -67,7 +69,7 @@ class Moderation(commands.Cog):
                 await ctx.send("You cannot ban yourself via reply.")
                 return
 
-            replied_member = guild.get_member(replied_user.id)
+            replied_member = await cache_policy.get_member(guild, replied_user.id)
 
             if replied_member:
                 if replied_member.top_role >= ctx.author.top_role:
@@ -135,7 +137,7 @@ class Moderation(commands.Cog):
             replied_member = replied_msg.author
 
             if not isinstance(replied_member, discord.Member):
-                replied_member = guild.get_member(replied_member.id)
+                replied_member = await cache_policy.get_member(guild, replied_member.id)
                 if replied_member is None:
                     await ctx.send("Replied user is not in this server.")
                     return
@@ -4,9 +4,12 @@ from discord.ext import commands
 from discord import app_commands
 import asyncpg
 from datetime import datetime, timezone
-import dateparser
 import bot_info
+import metrics
 import random
+import lazy_imports
+
+dateparser = lazy_imports.module("dateparser")
 
 class Reminder(commands.Cog):
     def __init__(self, bot):
@@ -16,7 +19,7 @@ class Reminder(commands.Cog):
     
     async def cog_load(self):
         if not self.db_pool:
-            self.db_pool = await asyncpg.create_pool(bot_info.data['database'])
+            self.db_pool = getattr(self.bot, 'db', None) or await asyncpg.create_pool(bot_info.data['database'], init=metrics.instrument_connection)
         if self.reminder_task is not None:
             self.reminder_task.cancel()
             await asyncio.sleep(1)
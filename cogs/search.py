@@ -3,9 +3,11 @@ from discord.ext import commands
 from discord import app_commands
 import random
 import asyncio
-import yt_dlp
 import re
 from datetime import datetime
+import lazy_imports
+
+yt_dlp = lazy_imports.module("yt_dlp")
 
 class Search(commands.Cog):
     def __init__(self, bot):
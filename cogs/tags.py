@@ -6,10 +6,11 @@ import re
 import bot_info
 import operator
 import asyncio
+import contextlib
+import time
 import ast
 from typing import Any, Callable, Dict, List, Set, Union
 import aiohttp
-import yt_dlp
 import os
 import uuid
 import platform
@@ -23,16 +24,34 @@ from io import BytesIO
 from urllib.parse import quote, unquote, urlparse
 import base64
 import json
-from jsonschema import validate, ValidationError
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
 import math
-import matplotlib.font_manager
 import hashlib
+import logging
+from collections import Counter, OrderedDict, defaultdict
 from zoneinfo import ZoneInfo
-import dateparser
-from wand.image import Image as Img
-from wand.color import Color
+import metrics
+import cache_policy
+import db
+import scheduler
+import job_queue
+import lazy_imports
+import io_pool
+import memory
+import tagscript
+from download_cache import DownloadFailed
+
+# Only a few tag functions need these, so they're imported on first use
+yt_dlp = lazy_imports.module("yt_dlp")
+jsonschema = lazy_imports.module("jsonschema")
+np = lazy_imports.module("numpy")
+Image = lazy_imports.module("PIL.Image")
+ImageDraw = lazy_imports.module("PIL.ImageDraw")
+ImageFont = lazy_imports.module("PIL.ImageFont")
+ImageFilter = lazy_imports.module("PIL.ImageFilter")
+font_manager = lazy_imports.module("matplotlib.font_manager")
+dateparser = lazy_imports.module("dateparser")
+wand_image = lazy_imports.module("wand.image")
+wand_color = lazy_imports.module("wand.color")
 
 IMAGE_TYPES = ('image/png', 'image/jpeg', 'image/jpg', 'image/webp', 'image/gif')
 VIDEO_TYPES = ('video/mp4', 'video/webm', 'video/quicktime', 'video/x-matroska', 'video/x-msvideo', 'video/x-ms-wmv')
@@ -298,7 +317,8 @@ class DiscordGenerator:
 
 
 class MediaProcessor:
-    def __init__(self):
+    def __init__(self, download_cache=None):
+        self.download_cache = download_cache
         self.media_cache: Dict[str, str] = {}
         self.active_processes: Set[asyncio.subprocess.Process] = set()
         self.temp_dir = Path(os.getenv('TEMP', '/tmp')) / 'gscript'
@@ -575,38 +595,19 @@ class MediaProcessor:
                 await asyncio.sleep(self.cleanup_interval)
             except Exception:
                 await asyncio.sleep(60)
-    async def _cleanup_old_files(self):
-        now = datetime.now().timestamp()
-        cleaned_files = 0
-        cleaned_dirs = 0
-
-
-        for key, path in list(self.media_cache.items()):
+    # Runs in the I/O pool: deletes the tracked paths that are too old and returns them along with the ones already gone
+    def _remove_old_files(self, paths: set, now: float) -> set:
+        removed = set()
+        for path in paths:
             try:
                 if not os.path.exists(path):
-                    del self.media_cache[key]
+                    removed.add(path)
                     continue
                 
                 file_age = now - os.path.getmtime(path)
                 if file_age > self.file_max_age:
                     os.unlink(path)
-                    del self.media_cache[key]
-                    cleaned_files += 1
-            except Exception:
-                pass
-
-        
-        for path in list(self.temp_files):
-            try:
-                if not os.path.exists(path):
-                    self.temp_files.discard(path)
-                    continue
-                
-                file_age = now - os.path.getmtime(path)
-                if file_age > self.file_max_age:
-                    os.unlink(path)
-                    self.temp_files.discard(path)
-                    cleaned_files += 1
+                    removed.add(path)
             except Exception:
                 pass
 
@@ -618,14 +619,21 @@ class MediaProcessor:
                     if item_age > self.file_max_age:
                         if item.is_file():
                             item.unlink()
-                            cleaned_files += 1
                         elif item.is_dir():
                             shutil.rmtree(item)
-                            cleaned_dirs += 1
                 except Exception:
                     pass
         except Exception:
             pass
+        return removed
+
+    async def _cleanup_old_files(self):
+        now = datetime.now().timestamp()
+        removed = await io_pool.run(self._remove_old_files, set(self.media_cache.values()) | self.temp_files, now)
+        for key, path in list(self.media_cache.items()):
+            if path in removed:
+                del self.media_cache[key]
+        self.temp_files -= removed
 
     
     async def cleanup(self):
@@ -641,13 +649,21 @@ class MediaProcessor:
                         proc.kill()
                 except ProcessLookupError:
                     pass
-        for file_path in self.media_cache.values():
+        await io_pool.run(self._remove_all_files, list(self.media_cache.values()), list(self.temp_files))
+        
+        self.media_cache.clear()
+        self.active_processes.clear()
+        self.temp_files.clear()
+    
+    
+    def _remove_all_files(self, cached: list, temp_files: list):
+        for file_path in cached:
             try:
                 if file_path and os.path.exists(file_path):
                     os.unlink(file_path)
             except Exception:
                 pass
-        for file_path in self.temp_files:
+        for file_path in temp_files:
             try:
                 if os.path.exists(file_path):
                     os.unlink(file_path)
@@ -665,11 +681,6 @@ class MediaProcessor:
                     pass
         except Exception:
             pass
-        
-        self.media_cache.clear()
-        self.active_processes.clear()
-        self.temp_files.clear()
-    
     
     def _get_temp_path(self, extension: str = '') -> Path:
         path = self.temp_dir / f"{uuid.uuid4()}{f'.{extension}' if extension else ''}"
@@ -801,7 +812,7 @@ class MediaProcessor:
 
 
     
-    def _parse_color(self, color_str: str, size: tuple = None) -> Union[tuple, Image.Image]:
+    def _parse_color(self, color_str: str, size: tuple = None) -> Union[tuple, 'Image.Image']:
         if color_str.lower() in ('random', 'rand'):
             if size is None:
                 return self._generate_random_color()
@@ -1106,34 +1117,44 @@ class MediaProcessor:
         if platform.system() == 'Windows':
             cmd[0] = 'ffmpeg.exe'
         
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            creationflags=(
-                subprocess.CREATE_NO_WINDOW
-                if platform.system() == 'Windows'
-                else 0
+        # Every GScript ffmpeg step takes a slot in the shared job scheduler
+        async with scheduler.slot("gscript"):
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                creationflags=(
+                    subprocess.CREATE_NO_WINDOW
+                    if platform.system() == 'Windows'
+                    else 0
+                )
             )
-        )
 
-        self.active_processes.add(proc)
+            self.active_processes.add(proc)
 
-        try:
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=120)
-            if proc.returncode != 0:
-                error_msg = stderr.decode('utf-8', errors='replace').strip()
-                if platform.system() == 'Windows':
-                    error_msg = error_msg.replace('\r\n', '\n')
-                return False, f"FFmpeg error: {error_msg}"
-            return True, stdout.decode('utf-8', errors='replace').strip()
-        except asyncio.TimeoutError:
-            proc.kill()
-            return False, "FFmpeg processing took longer than 120 seconds."
-        except Exception as e:
-            return False, f"Unexpected error: {str(e)}"
-        finally:
-            self.active_processes.discard(proc)
+            try:
+                with metrics.phase("subprocess"):
+                    stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=120)
+                if proc.returncode != 0:
+                    error_msg = stderr.decode('utf-8', errors='replace').strip()
+                    if platform.system() == 'Windows':
+                        error_msg = error_msg.replace('\r\n', '\n')
+                    return False, f"FFmpeg error: {error_msg}"
+                return True, stdout.decode('utf-8', errors='replace').strip()
+            except asyncio.TimeoutError:
+                return False, "FFmpeg processing took longer than 120 seconds."
+            except Exception as e:
+                return False, f"Unexpected error: {str(e)}"
+            finally:
+                # Also when the tag's time budget cancels the step, so ffmpeg never outlives its slot
+                await self._kill_process(proc)
+                self.active_processes.discard(proc)
+    
+    async def _kill_process(self, proc):
+        if proc.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                proc.kill()
+            await proc.wait()
     
     async def _run_ffprobe(self, cmd: list) -> tuple:
         if platform.system() == 'Windows':
@@ -1147,13 +1168,16 @@ class MediaProcessor:
         )
 
         try:
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=20)
+            with metrics.phase("subprocess"):
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=20)
             if proc.returncode != 0:
                 error_msg = stderr.decode('utf-8', errors='replace').strip()
                 return False, f"FFprobe error: {error_msg}"
             return True, stdout.decode('utf-8', errors='replace').strip()
         except Exception as e:
             return False, f"FFprobe error: {str(e)}"
+        finally:
+            await self._kill_process(proc)
     
     async def _probe_media_info(self, path: Path) -> tuple:
         try:
@@ -1268,6 +1292,32 @@ class MediaProcessor:
 
         return errors if errors else output_files or ["Processing complete"]
     
+    # Runs one command on an already loaded key and renders the result, for the media cog and media workers
+    async def run_command(self, command_name: str, input_key: str, output_key: str, **kwargs) -> Path:
+        func = self.gscript_commands.get(command_name)
+        if not func:
+            raise ValueError(f"Unknown command: {command_name}")
+
+        if input_key not in self.media_cache:
+            raise ValueError(f"{input_key} not found in media cache")
+
+        result = await func(input_key=input_key, output_key=output_key, **kwargs)
+
+        if not isinstance(result, str) or not result.startswith("media://"):
+            raise ValueError(f"{command_name} failed: {result}")
+
+        render_result = await self._render_media(
+            media_key=output_key,
+            extra_args=[Path(result[8:]).suffix[1:]]
+        )
+        if not isinstance(render_result, str) or not render_result.startswith("media://"):
+            raise ValueError(f"Rendering failed: {render_result}")
+
+        output_path = Path(render_result[8:])
+        if not output_path.exists():
+            raise ValueError(f"Output file not found at {output_path}")
+        return output_path
+
     async def _load_media(self, **kwargs) -> str:
         try:
             return await self._load_media_impl(**kwargs)
@@ -1278,6 +1328,14 @@ class MediaProcessor:
     async def _load_media_impl(self, **kwargs) -> str:
         url = kwargs['url']
         media_key = kwargs['media_key']
+        if self.download_cache is not None:
+            temp_file = self._get_temp_path()
+            entry = await self.download_cache.fetch(url, temp_file, cached_only=True)
+            if entry is not None:
+                final_temp_file = self._get_temp_path(entry.suffix or 'tmp')
+                await io_pool.replace(temp_file, final_temp_file)
+                self.media_cache[media_key] = str(final_temp_file)
+                return f"Loaded {media_key} from cache"
         try:
             temp_file = self._get_temp_path()
             ydl_opts = {
@@ -1303,14 +1361,25 @@ class MediaProcessor:
             final_temp_file = self._get_temp_path(ext)
             
 
-            shutil.move(str(downloaded_path), final_temp_file)
-            downloaded_path.unlink(missing_ok=True)
+            await io_pool.move(downloaded_path, final_temp_file)
+            if self.download_cache is not None:
+                await self.download_cache.put(url, final_temp_file)
 
             self.media_cache[media_key] = str(final_temp_file)
             return f"Loaded {media_key} via yt-dlp"
         
         except Exception as e:
             try:
+                if self.download_cache is not None:
+                    temp_file = self._get_temp_path()
+                    try:
+                        entry = await self.download_cache.fetch(url, temp_file)
+                    except DownloadFailed as e:
+                        return f"HTTP Error {e.status}"
+                    final_temp_file = self._get_temp_path(entry.suffix or 'tmp')
+                    await io_pool.replace(temp_file, final_temp_file)
+                    self.media_cache[media_key] = str(final_temp_file)
+                    return f"Loaded {media_key}"
                 await self.ensure_session()
                 async with self.session.get(url) as resp:
                     if resp.status != 200:
@@ -1348,13 +1417,13 @@ class MediaProcessor:
         
         try:
             def convert_svg():
-                with Img(blob=svg_content.encode('utf-8'), format='svg') as img:
+                with wand_image.Image(blob=svg_content.encode('utf-8'), format='svg') as img:
                     img.resize(width, height)
                     
 
                     if background.lower() != 'transparent':
-                        bg = Color(self._parse_single_color(background))
-                        with Img(width=width, height=height, background=bg) as bg_img:
+                        bg = wand_color.Color(self._parse_single_color(background))
+                        with wand_image.Image(width=width, height=height, background=bg) as bg_img:
                             bg_img.composite(img, 0, 0)
                             bg_img.save(filename=str(output_file))
                     else:
@@ -1577,7 +1646,7 @@ class MediaProcessor:
             final_path = final_path.with_name(output_filename)
             if not final_path.suffix:
                 final_path = final_path.with_suffix(path.suffix)
-            path.rename(final_path)
+            await io_pool.replace(path, final_path)
             path = final_path
         
         self.media_cache[media_key] = str(path)
@@ -2245,7 +2314,7 @@ class MediaProcessor:
 
             try:
                 matches = []
-                for f in matplotlib.font_manager.fontManager.ttflist:
+                for f in font_manager.fontManager.ttflist:
                     if f.name.lower() == font_name.lower():
                         matches.append(f.fname)
                         try:
@@ -2974,28 +3043,127 @@ class MediaProcessor:
 
 
 
+# Arguments of a lazy function: split on | but not rendered, value(i) renders one when it's needed
+class LazyArgs:
+    def __init__(self, formatter: "TagFormatter", block: tagscript.Block, ctx: commands.Context, kwargs: dict):
+        self.formatter = formatter
+        self.text = block.args
+        self.programs = block.arg_programs
+        self.ctx = ctx
+        self.kwargs = kwargs
+        self._values = {}
+
+    def __len__(self) -> int:
+        return len(self.programs)
+
+    async def value(self, index: int) -> str:
+        if index not in self._values:
+            text, _, _, _ = await self.formatter.render(self.programs[index], self.ctx, **self.kwargs)
+            self._values[index] = text.strip()
+        return self._values[index]
+
+# How a block can be scheduled next to its siblings
+INLINE = 0      # No I/O and no shared state, runs in place
+CONCURRENT = 1  # I/O without shared state, runs alongside other CONCURRENT siblings
+ORDERED = 2     # Reads or writes shared state ({set}, {get}, components, ...), waits for earlier siblings
+
 class TagFormatter:
     def __init__(self):
         self.functions: Dict[str, Callable] = {}
         self._component_tags = {'embed', 'button', 'view', 'select'}
+        self._lazy_functions = set()
+        self._io_functions = set()
+        self._ordered_functions = {'set', 'get', 'eval', 'gscript', 'gmanscript'}
     
-    def register(self, name: str):
+    # Lazy functions get LazyArgs instead of their rendered arguments, so branches that aren't taken never run.
+    # io marks functions that mostly wait on the network or another process, they run concurrently when they can.
+    def register(self, name: str, lazy: bool = False, io: bool = False):
         def decorator(func: Callable):
             if any(comp in func.__name__ for comp in self._component_tags):
                 self._component_tags.add(name)
+            if lazy:
+                self._lazy_functions.add(name)
+            if io:
+                self._io_functions.add(name)
             self.functions[name] = func
             return func
         return decorator
     
+    # Nested calls (from {choose}, {eval}, ...) render inside the run that's already going
     async def format(self, content: str, ctx: commands.Context, **kwargs) -> tuple[str, list[discord.Embed], discord.ui.View | None, list[discord.File]]:
+        program = tagscript.cache.get(content)
+        if tagscript.current_run.get() is not None:
+            return await self.render(program, ctx, **kwargs)
+        return await self.run(program, ctx, **kwargs)
+
+    # A top level run of a tag with its own budget, I/O limit and optionally a profile. When the budget runs
+    # out the run is cancelled (including blocks still running concurrently) and only the error is returned.
+    async def run(self, program: tagscript.Program, ctx: commands.Context, profile: tagscript.Profile = None, **kwargs) -> tuple[str, list[discord.Embed], discord.ui.View | None, list[discord.File]]:
+        run = tagscript.Run(profile)
+        token = tagscript.current_run.set(run)
+        try:
+            return await asyncio.wait_for(self.render(program, ctx, **kwargs), run.budget.max_seconds)
+        except asyncio.TimeoutError:
+            return (f"[Tag Error: took longer than {run.budget.max_seconds:g}s]", [], None, [])
+        except tagscript.BudgetExceeded as e:
+            return (f"[Tag Error: {e}]", [], None, [])
+        finally:
+            tagscript.current_run.reset(token)
+
+    # Worked out once per compiled block from the functions in it and in the arguments it renders
+    def _schedule(self, block: tagscript.Block) -> int:
+        if block.schedule is not None:
+            return block.schedule
+        name = block.name
+        if name not in self.functions or name in ('note', 'comment', 'ignore'):
+            schedule = INLINE
+        elif name in self._ordered_functions or name in self._component_tags:
+            schedule = ORDERED
+        else:
+            programs = block.arg_programs if name in self._lazy_functions else [block.program]
+            nested = [self._schedule(node) for program in programs for node in program.nodes if isinstance(node, tagscript.Block)]
+            schedule = max(nested, default=INLINE)
+            if name in self._io_functions:
+                schedule = max(schedule, CONCURRENT)
+        block.schedule = schedule
+        return schedule
+
+    async def _run_blocks(self, program: tagscript.Program, ctx: commands.Context, kwargs: dict) -> list:
+        blocks = [node for node in program.nodes if isinstance(node, tagscript.Block)]
+        run = tagscript.current_run.get()
+        if run is None or run.io_limit is None or sum(self._schedule(block) == CONCURRENT for block in blocks) < 2:
+            return [await self._process_block(block, ctx, **kwargs) for block in blocks]
+        results = [None] * len(blocks)
+        pending = {}
+        try:
+            for i, block in enumerate(blocks):
+                schedule = self._schedule(block)
+                if schedule == CONCURRENT:
+                    pending[i] = asyncio.ensure_future(self._process_block(block, ctx, **kwargs))
+                    continue
+                if schedule == ORDERED and pending:
+                    for j, result in zip(pending, await asyncio.gather(*pending.values())):
+                        results[j] = result
+                    pending.clear()
+                results[i] = await self._process_block(block, ctx, **kwargs)
+            for j, result in zip(pending, await asyncio.gather(*pending.values())):
+                results[j] = result
+            pending.clear()
+        finally:
+            for task in pending.values():
+                task.cancel()
+        return results
+
+    async def render(self, program: tagscript.Program, ctx: commands.Context, **kwargs) -> tuple[str, list[discord.Embed], discord.ui.View | None, list[discord.File]]:
         text_parts = []
         embeds = []
         view = None
         files = []
         
-        for chunk in self._split_chunks(content):
-            if chunk.startswith('{') and chunk.endswith('}'):
-                result = await self._process_tag(chunk, ctx, **kwargs)
+        results = iter(await self._run_blocks(program, ctx, kwargs))
+        for node in program.nodes:
+            if isinstance(node, tagscript.Block):
+                result = next(results)
                 text, new_embeds, new_view, new_files = self._normalize_result(result)
                 
                 text_parts.append(str(text))
@@ -3006,22 +3174,35 @@ class TagFormatter:
                         view.add_item(item)
                 files.extend(new_files)
             else:
-                text_parts.append(chunk)
+                text_parts.append(node)
         
-        return ''.join(text_parts), embeds, view if view and view.children else None, files
+        text = ''.join(text_parts)
+        tagscript.check_output(tagscript.output_size(text))
+        return text, embeds, view if view and view.children else None, files
 
-    async def _process_tag(self, tag: str, ctx: commands.Context, **kwargs):
-        inner = tag[1:-1].strip()
-        parts = inner.split(':', 1)
-        name = parts[0].strip()
+    async def _process_block(self, block: tagscript.Block, ctx: commands.Context, **kwargs):
+        name = block.name
             
         if name not in self.functions:
-            return tag
-
+            return block.source
+
+        run = tagscript.current_run.get()
+        if run is None:
+            return await self._call_block(block, ctx, **kwargs)
+        run.budget.step()
+        if run.profile is None:
+            return await self._call_block(block, ctx, **kwargs)
+        start = time.perf_counter()
         try:
-            args = parts[1] if len(parts) > 1 else ''
-            func = self.functions[name]
+            return await self._call_block(block, ctx, **kwargs)
+        finally:
+            run.profile.record(name, time.perf_counter() - start)
 
+    async def _call_block(self, block: tagscript.Block, ctx: commands.Context, **kwargs):
+        name = block.name
+        args = block.args
+        func = self.functions[name]
+        try:
             if name in ('note', 'comment'):
                 return await func(ctx, args, **kwargs)
             
@@ -3029,14 +3210,24 @@ class TagFormatter:
                 return await func(ctx, args, **kwargs)
                 
 
-            if name in self._component_tags:
+            if name in self._lazy_functions:
+                result = func(ctx, LazyArgs(self, block, ctx, kwargs), **kwargs)
+            elif name in self._component_tags:
                 result = func(ctx, args, **kwargs)
             else:
-                arg_text, _, _, _ = await self.format(args, ctx, **kwargs)
+                arg_text, _, _, _ = await self.render(block.program, ctx, **kwargs)
                 result = func(ctx, arg_text.strip(), **kwargs)
+
+            if not asyncio.iscoroutine(result):
+                return result
+            run = tagscript.current_run.get()
+            if run is None or run.io_limit is None or name not in self._io_functions:
+                return await result
+            async with run.io_limit:
+                return await result
                 
-            return await result if asyncio.iscoroutine(result) else result
-                
+        except tagscript.BudgetExceeded:
+            raise
         except Exception as e:
             return f"[Tag Error: {str(e)}]"
     @staticmethod
@@ -3058,29 +3249,6 @@ class TagFormatter:
         else:
             return (result, [], None, [])
 
-    def _split_chunks(self, content: str) -> list[str]:
-        chunks = []
-        pos = 0
-        depth = 0
-        start = 0
-
-        for i, c in enumerate(content):
-            if c == '{':
-                if depth == 0:
-                    if pos < i:
-                        chunks.append(content[pos:i])
-                    start = i
-                depth += 1
-            elif c == '}' and depth > 0:
-                depth -= 1
-                if depth == 0:
-                    chunks.append(content[start:i+1])
-                    pos = i + 1
-
-        if pos < len(content):
-            chunks.append(content[pos:])
-        return chunks
-    
     async def resolve_user(self, ctx, input_str: str) -> Union[discord.User, discord.Member]:
         input_str = input_str.strip()
 
@@ -3095,22 +3263,108 @@ class TagFormatter:
             pass
 
         if ctx.guild:
-            member = discord.utils.find(
-                lambda m: m.name.lower() == input_str.lower() or m.display_name.lower() == input_str.lower(),
-                ctx.guild.members
-            )
+            member = await cache_policy.find_member(ctx.guild, input_str)
             if member:
                 return member
         
         return ctx.author
 
+# Resolved tags keyed by (scope, name), scope being who asked and how: (user, guild, personal only, aliases).
+# An entry is dropped whenever a tag or alias with the name it was looked up by, or resolved to, changes,
+# here and through NOTIFY in the other bot processes. Uses are counted here and written in batches.
+class TagCache:
+    channel = "gman_tag_cache"
+
+    def __init__(self, max_size: int = 5000, flush_interval: float = 30.0):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.token = os.urandom(8).hex()
+        self.entries = OrderedDict()
+        self.keys_by_name = defaultdict(set)
+        self.uses = Counter()
+        self.hits = 0
+        self.misses = 0
+        # Bumped by every invalidation, a lookup that raced one isn't cached
+        self.generation = 0
+
+    def get(self, scope: tuple, name: str):
+        tag = self.entries.get((scope, name))
+        if tag is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end((scope, name))
+        self.hits += 1
+        return tag
+
+    def set(self, scope: tuple, name: str, tag):
+        key = (scope, name)
+        self.entries[key] = tag
+        self.entries.move_to_end(key)
+        self.keys_by_name[name].add(key)
+        self.keys_by_name[tag['name']].add(key)
+        while len(self.entries) > self.max_size:
+            old_key, old_tag = self.entries.popitem(last=False)
+            self._unindex(old_key, old_tag)
+
+    def _unindex(self, key: tuple, tag):
+        for name in (key[1], tag['name']):
+            keys = self.keys_by_name.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_name[name]
+
+    # After the NOTIFY connection was down, changes in other processes may have been missed
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.keys_by_name.clear()
+
+    def invalidate(self, *names: str):
+        self.generation += 1
+        for name in names:
+            for key in self.keys_by_name.pop(name, set()):
+                tag = self.entries.pop(key, None)
+                if tag is not None:
+                    self._unindex(key, tag)
+
+    # Call after changing tags or aliases with these names, on the connection that made the change
+    async def publish(self, conn, *names: str):
+        self.invalidate(*names)
+        await conn.execute("SELECT pg_notify($1, $2)", self.channel, json.dumps({"token": self.token, "names": names}))
+
+    def _on_notify(self, connection, pid, channel, payload):
+        change = json.loads(payload)
+        if change["token"] != self.token:
+            self.invalidate(*change["names"])
+
+    def add_use(self, tag_id: int):
+        self.uses[tag_id] += 1
+
+    async def flush_uses(self, pool):
+        if not self.uses:
+            return
+        uses, self.uses = self.uses, Counter()
+        try:
+            await pool.execute(
+                "UPDATE tags SET uses = uses + v.uses FROM unnest($1::int[], $2::int[]) AS v(id, uses) WHERE tags.id = v.id",
+                list(uses.keys()), list(uses.values())
+            )
+        except Exception as e:
+            self.uses.update(uses)
+            logging.getLogger().warning(f"Failed to save tag uses: {e}")
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        return f"{len(self.entries)}/{self.max_size} tags, {self.hits / lookups * 100 if lookups else 0.0:.0f}% hit rate, {sum(self.uses.values())} uses waiting"
+
 class Tags(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.pool = bot.pool
         self._variables = {}
         self.formatter = TagFormatter()
-        self.processor = MediaProcessor()
+        self.processor = MediaProcessor(getattr(bot, 'download_cache', None))
         self.setup_formatters()
         self.media_cache = {}
         self.setup_media_formatters()
@@ -3119,7 +3373,52 @@ class Tags(commands.Cog):
         self.start_cleanup_task()
         self._custom_id_map = {}
         self._stored_custom_ids = {}
+        tag_cache_config = bot_info.data.get('tag_cache', {})
+        self.tag_cache = TagCache(tag_cache_config.get('max_size', 5000), tag_cache_config.get('flush_interval', 30.0))
+        self._tag_uses_task = asyncio.create_task(self._flush_tag_uses())
+        memory.register("tags.tag_cache", self.tag_cache, "entries")
+        memory.register("tags.variables", self, "_variables")
+        memory.register("tags.custom_id_map", self, "_custom_id_map")
+        memory.register("tags.stored_custom_ids", self, "_stored_custom_ids")
+        memory.register("tags.media_cache", self.processor, "media_cache")
+        memory.register("tags.temp_files", self.processor, "temp_files")
     
+    # Rows returned by a tag edit or delete, their old content won't run again
+    def evict_compiled(self, rows):
+        for row in rows:
+            tagscript.cache.evict(row['content'])
+
+    async def cog_load(self):
+        # Other processes publish tag changes on the connection gman listens for access policy changes on
+        listener = getattr(self.bot, 'db_listener', None)
+        if listener is not None:
+            await listener.listen(TagCache.channel, self.tag_cache._on_notify, self.tag_cache.clear)
+
+    async def _flush_tag_uses(self):
+        while True:
+            await asyncio.sleep(self.tag_cache.flush_interval)
+            await self.tag_cache.flush_uses(self.pool)
+
+    async def _close_tag_cache(self):
+        self._tag_uses_task.cancel()
+        listener = getattr(self.bot, 'db_listener', None)
+        if listener is not None:
+            await listener.unlisten(TagCache.channel, self.tag_cache._on_notify)
+        await self.tag_cache.flush_uses(self.pool)
+
+    # Personal tag first, then the guild's, then aliases. Served from the tag cache when possible
+    async def resolve_tag(self, name: str, user_id: int, guild_id: int | None, personal: bool = False, aliases: bool = True):
+        scope = (user_id, guild_id, personal, aliases)
+        tag = self.tag_cache.get(scope, name)
+        if tag is not None:
+            return tag
+        generation = self.tag_cache.generation
+        async with self.pool.acquire() as conn:
+            tag = await (await db.prepared(conn, "resolve_tag")).fetchrow(name, user_id, guild_id, personal, aliases)
+        if tag is not None and generation == self.tag_cache.generation:
+            self.tag_cache.set(scope, name, tag)
+        return tag
+
     def _find_original_custom_id(self, display_id):
         return self._custom_id_map.get(display_id)
     
@@ -3205,6 +3504,24 @@ class Tags(commands.Cog):
         
 
     
+    # Same output as the {gscript} formatter, but the script runs on a media worker (see worker.py)
+    async def run_gscript_remote(self, script: str):
+        async with self.bot.job_queue.run("gscript", {"script": script}) as (paths, errors):
+            if errors:
+                return ("\n".join(errors), [], None, [])
+            if not paths:
+                return ("Processing complete.", [], None, [])
+            files = []
+            for path in paths:
+                try:
+                    data = BytesIO(await io_pool.read_bytes(path))
+                    files.append(discord.File(data, filename=os.path.basename(path)))
+                except Exception:
+                    continue
+            if files:
+                return ("", [], None, files[:10])
+            return ("No valid files could be loaded.", [], None, [])
+
     def setup_media_formatters(self):
         @self.formatter.register('gmanscript')
         @self.formatter.register('gscript')
@@ -3250,6 +3567,8 @@ class Tags(commands.Cog):
                     - chromakey [input_key] [color] [similarity] [blend] [output_key]
             """
             try:
+                if job_queue.enabled():
+                    return await self.run_gscript_remote(script)
                 results = await self.processor.execute_media_script(script)
 
                 if isinstance(results, list):
@@ -3266,11 +3585,10 @@ class Tags(commands.Cog):
                     for path in results:
                         if os.path.isfile(path):
                             try:
-                                with open(path, 'rb') as f:
-                                    data = BytesIO(f.read())
+                                data = BytesIO(await io_pool.read_bytes(path))
                                 filename = os.path.basename(path)
                                 files.append(discord.File(data, filename=filename))
-                                os.remove(path)
+                                await io_pool.remove(path)
                             except Exception:
                                 continue
                     if files:
@@ -3313,7 +3631,7 @@ class Tags(commands.Cog):
             """
             return ""
         
-        @self.formatter.register('text')
+        @self.formatter.register('text', io=True)
         async def _fetch_text(ctx, url, **kwargs):
             """
             ### {text:url}
@@ -3321,12 +3639,11 @@ class Tags(commands.Cog):
                 * Example: `{text:https://example.com}`
             """
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as response:
-                        if response.status != 200:
-                            return f"[text error: HTTP Exception: {response.status}]"
-                        content = await response.text()
-                        return content
+                async with self.bot.http_client.get(url) as response:
+                    if response.status != 200:
+                        return f"[text error: HTTP Exception: {response.status}]"
+                    content = await self.bot.http_client.text(response)
+                    return content
             except Exception as e:
                 return f"[text error: {str(e)}]"
         
@@ -3386,16 +3703,18 @@ class Tags(commands.Cog):
             split_args = kwargs.get('args', '').split()
             return ' '.join(split_args[int(i):]) if i.isdigit() else ''
             
-        @self.formatter.register('default')
-        def default(ctx, val, fb, **kwargs):
+        @self.formatter.register('default', lazy=True)
+        async def default(ctx, args, **kwargs):
             """
             ### {default:value|fallback}
                 * Returns `value` if it exists, otherwise returns `fallback`.
+                * The fallback is only evaluated when it's used.
                 * Example: `{default:{arg:0}|No argument provided}`
             """
-            val_str = str(val) if val is not None else ""
-            fb_str = str(fb) if fb is not None else ""
-            return val_str if val_str else fb_str
+            value = await args.value(0) if len(args) > 0 else ""
+            if value or len(args) < 2:
+                return value
+            return await args.value(1)
         
         @self.formatter.register('newline')
         def _newline(ctx, _, **kwargs):
@@ -3476,7 +3795,8 @@ class Tags(commands.Cog):
                 
                 if repeat_count < 0:
                     repeat_count = 0
-                    
+                
+                tagscript.check_output(tagscript.output_size(text) * repeat_count)
                 return text * repeat_count
             except ValueError:
                 return text
@@ -3997,9 +4317,9 @@ class Tags(commands.Cog):
                 instance = json.loads(json_str)
                 schema = json.loads(schema_str)
                 
-                validate(instance=instance, schema=schema)
+                jsonschema.validate(instance=instance, schema=schema)
                 return "valid"
-            except ValidationError as e:
+            except jsonschema.ValidationError as e:
                 return f"validation error: {str(e)}"
             except Exception as e:
                 return f"[jsonschema error: {str(e)}]"
@@ -4220,32 +4540,31 @@ class Tags(commands.Cog):
             except (ValueError, TypeError):
                 return str(a), str(b)
             
-        @self.formatter.register('if')
-        async def _if(ctx, args_str, **kwargs):
+        @self.formatter.register('if', lazy=True)
+        async def _if(ctx, args, **kwargs):
             """
             ### {if:left|operator|right|then|value|else|value}
                 * Conditional statement with comparison operators.
                 * Operators: ==, !=, >=, <=, >, <, *= (contains), ^= (starts with), $= (ends with), ~= (regex match)
                 * Prefix the 4 special operators with `!` to reverse them. (!*=)
                 * Example: `{if:{arg:0}|==|hello|then|World|else|Goodbye}`
+                * Only the branch that's taken is evaluated.
             """
-            raw = self.parse_args(args_str)
-            if len(raw) < 5:
+            if len(args) < 5:
                 return "[error: insufficient arguments for if]"
 
-            left_raw, op_raw, right_raw, *rest = raw
-
+            left = await args.value(0)
+            op_raw = await args.value(1)
+            right = await args.value(2)
 
-            then_raw = else_raw = ""
-            for key, val in zip(rest[::2], rest[1::2]):
-                if key.lower() == "then":
-                    then_raw = val
-                elif key.lower() == "else":
-                    else_raw = val
 
-
-            left  = left_raw
-            right = right_raw
+            then_index = else_index = None
+            for i in range(3, len(args) - 1, 2):
+                key = (await args.value(i)).lower()
+                if key == "then":
+                    then_index = i + 1
+                elif key == "else":
+                    else_index = i + 1
             
             coercible_ops = {"==", "!=", ">=", "<=", ">", "<"}
 
@@ -4278,37 +4597,38 @@ class Tags(commands.Cog):
             if negate:
                 result = not result
 
-            chosen_raw = then_raw if result else else_raw
-            return chosen_raw
+            chosen_index = then_index if result else else_index
+            return await args.value(chosen_index) if chosen_index is not None else ""
         
-        @self.formatter.register('and')
-        async def _and(ctx, args_str, **kwargs):
+        @self.formatter.register('and', lazy=True)
+        async def _and(ctx, args, **kwargs):
             """
             ### {and:value1|value2|...}
                 * Returns last value if ALL values are non-empty strings
-                * Returns None if any value is empty
+                * Returns None if any value is empty, the values after it aren't evaluated
                 * Example: `{and:Yes|{get:var}}` returns "Yes" only if {get:var} exists
             """
-            args = self.parse_args(args_str)
-            if not args:
+            if not len(args):
                 return None
             
             last_valid = ""
-            for arg in args:
-                if not arg.strip():
+            for i in range(len(args)):
+                arg = await args.value(i)
+                if not arg:
                     return None
                 last_valid = arg
             return last_valid
         
-        @self.formatter.register('or')
-        async def _or(ctx, args_str, **kwargs):
+        @self.formatter.register('or', lazy=True)
+        async def _or(ctx, args, **kwargs):
             """
             ### {or:value1|value2|...}
-                * Returns first non-empty value
+                * Returns first non-empty value, the values after it aren't evaluated
                 * Example: `{or:{get:var1}|{get:var2}|default}`
             """
-            for arg in self.parse_args(args_str):
-                if arg.strip():
+            for i in range(len(args)):
+                arg = await args.value(i)
+                if arg:
                     return arg
             return None
         
@@ -4389,6 +4709,7 @@ class Tags(commands.Cog):
                 if count < 1 or sides < 1:
                     return "[dice error: values must be positive]"
         
+                tagscript.charge(count)
                 rolls = [random.randint(1, sides) for _ in range(count)]
                 total = sum(rolls)
         
@@ -4405,11 +4726,13 @@ class Tags(commands.Cog):
                 result += f"{total})"
         
                 return result
+            except tagscript.BudgetExceeded:
+                raise
             except Exception:
                 return "[dice error: invalid notation]"
         
-        @self.formatter.register('choose')
-        async def _choose(ctx, options_str, **kwargs):
+        @self.formatter.register('choose', lazy=True)
+        async def _choose(ctx, args, **kwargs):
             """
             ### {choose:option1|option2|option3|...}
                 * Randomly picks **one** option from the list.
@@ -4432,11 +4755,11 @@ class Tags(commands.Cog):
                         * "C vs Y"
                 * Use `\\n` for newlines in options:
                     * `{choose:Line1\\nLine2|SingleLine}`
-                * Works with other tags:
+                * Works with other tags, only the option that's picked is evaluated:
                     * `{choose:{user} rolled {dice:1d20}!|Try again!}`
             """
             try:
-                processed = str(options_str)
+                processed = args.text
                 settings = {}
                 if 'sep=' in processed.lower():
                     parts = processed.rsplit('sep=', 1)
@@ -4456,9 +4779,12 @@ class Tags(commands.Cog):
                     return random.choice(options) if options else ''
                 
                 if group_mode:
-                    processed = re.sub(r'\{([^{}]+)\}', process_group, processed)
-        
-                raw_parts = re.split(rf'(?<!\\)\{sep}', processed)
+                    # Groups are picked from the evaluated text, so every option is evaluated here
+                    processed, _, _, _ = await ctx.cog.formatter.format(processed, ctx, **kwargs)
+                    processed = re.sub(r'\{([^{}]+)\}', process_group, processed.strip())
+                    raw_parts = re.split(rf'(?<!\\)\{sep}', processed)
+                else:
+                    raw_parts = tagscript.split_args(processed, sep, unescape=False)
                 options = []
                 weights = []
                 total_percent = 0
@@ -4588,8 +4914,8 @@ class Tags(commands.Cog):
             except Exception as e:
                 return f'[math error: {e}]'
         
-        @self.formatter.register('python')
-        @self.formatter.register('py')
+        @self.formatter.register('python', io=True)
+        @self.formatter.register('py', io=True)
         async def _python(ctx, code, **kwargs):
             """
             ### {python:code}
@@ -4598,8 +4924,8 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'python', code, **kwargs)
 
-        @self.formatter.register('bash')
-        @self.formatter.register('sh')
+        @self.formatter.register('bash', io=True)
+        @self.formatter.register('sh', io=True)
         async def _bash(ctx, code, **kwargs):
             """
             ### {bash:code}
@@ -4608,9 +4934,9 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'bash', code, **kwargs)
 
-        @self.formatter.register('javascript')
-        @self.formatter.register('js')
-        @self.formatter.register('node')
+        @self.formatter.register('javascript', io=True)
+        @self.formatter.register('js', io=True)
+        @self.formatter.register('node', io=True)
         async def _javascript(ctx, code, **kwargs):
             """
             ### {javascript:code}
@@ -4619,8 +4945,8 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'javascript', code, **kwargs)
 
-        @self.formatter.register('typescript')
-        @self.formatter.register('ts')
+        @self.formatter.register('typescript', io=True)
+        @self.formatter.register('ts', io=True)
         async def _typescript(ctx, code, **kwargs):
             """
             ### {typescript:code}
@@ -4629,7 +4955,7 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'typescript', code, **kwargs)
         
-        @self.formatter.register('php')
+        @self.formatter.register('php', io=True)
         async def _php(ctx, code, **kwargs):
             """
             ### {php:code}
@@ -4637,8 +4963,8 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'php', code, **kwargs)
         
-        @self.formatter.register('ruby')
-        @self.formatter.register('rb')
+        @self.formatter.register('ruby', io=True)
+        @self.formatter.register('rb', io=True)
         async def _ruby(ctx, code, **kwargs):
             """
             ### {ruby:code}
@@ -4647,7 +4973,7 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'ruby', code, **kwargs)
         
-        @self.formatter.register('lua')
+        @self.formatter.register('lua', io=True)
         async def _lua(ctx, code, **kwargs):
             """
             ### {lua:code}
@@ -4656,7 +4982,7 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'lua', code, **kwargs)
 
-        @self.formatter.register('go')
+        @self.formatter.register('go', io=True)
         async def _go(ctx, code, **kwargs):
             """
             ### {go:code}
@@ -4664,8 +4990,8 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'go', code, **kwargs)
 
-        @self.formatter.register('rust')
-        @self.formatter.register('rs')
+        @self.formatter.register('rust', io=True)
+        @self.formatter.register('rs', io=True)
         async def _rust(ctx, code, **kwargs):
             """
             ### {rust:code}
@@ -4673,7 +4999,7 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'rust', code, **kwargs)
 
-        @self.formatter.register('c')
+        @self.formatter.register('c', io=True)
         async def _c(ctx, code, **kwargs):
             """
             ### {c:code}
@@ -4681,8 +5007,8 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'c', code, **kwargs)
 
-        @self.formatter.register('cpp')
-        @self.formatter.register('c++')
+        @self.formatter.register('cpp', io=True)
+        @self.formatter.register('c++', io=True)
         async def _cpp(ctx, code, **kwargs):
             """
             ### {cpp:code}
@@ -4690,9 +5016,9 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'cpp', code, **kwargs)
 
-        @self.formatter.register('csharp')
-        @self.formatter.register('cs')
-        @self.formatter.register('c#')
+        @self.formatter.register('csharp', io=True)
+        @self.formatter.register('cs', io=True)
+        @self.formatter.register('c#', io=True)
         async def _csharp(ctx, code, **kwargs):
             """
             ### {csharp:code}
@@ -4700,7 +5026,7 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'csharp', code, **kwargs)
 
-        @self.formatter.register('zig')
+        @self.formatter.register('zig', io=True)
         async def _zig(ctx, code, **kwargs):
             """
             ### {zig:code}
@@ -4708,7 +5034,7 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'zig', code, **kwargs)
         
-        @self.formatter.register('java')
+        @self.formatter.register('java', io=True)
         async def _java(ctx, code, **kwargs):
             """
             ### {java:code}
@@ -4716,8 +5042,8 @@ class Tags(commands.Cog):
             """
             return await self.execute_language(ctx, 'java', code, **kwargs)
         
-        @self.formatter.register('kotlin')
-        @self.formatter.register('kt')
+        @self.formatter.register('kotlin', io=True)
+        @self.formatter.register('kt', io=True)
         async def _kotlin(ctx, code, **kwargs):
             """
             ### {kt:code}
@@ -4841,7 +5167,7 @@ class Tags(commands.Cog):
             if isinstance(user, discord.Member):
                 return str(user.guild_banner.key) if user.guild_banner else await _userbannerkey(ctx, i)
         
-        @self.formatter.register('userbanner')
+        @self.formatter.register('userbanner', io=True)
         async def _userbanner(ctx, i, **kwargs):
             """
             ### {userbanner:mention/name/displayname/id}
@@ -4855,7 +5181,7 @@ class Tags(commands.Cog):
                 return None
             return str(user.banner.url)
         
-        @self.formatter.register('userbannerkey')
+        @self.formatter.register('userbannerkey', io=True)
         async def _userbannerkey(ctx, i, **kwargs):
             """
             ### {userbannerkey:mention/name/displayname/id}
@@ -4906,6 +5232,8 @@ class Tags(commands.Cog):
                 * Example: `{userstatus:@MiniatureEge2006}` -> "Online"
             """
             user = await self.formatter.resolve_user(ctx, i)
+            if ctx.guild and isinstance(user, discord.Member):
+                user = await cache_policy.get_member_with_presence(ctx.guild, user.id) or user
             if isinstance(user, discord.Member):
                 return str(user.status.value).capitalize()
             return None
@@ -4920,6 +5248,8 @@ class Tags(commands.Cog):
             user = await self.formatter.resolve_user(ctx, i)
             if not isinstance(user, discord.Member):
                 return None
+            if ctx.guild:
+                user = await cache_policy.get_member_with_presence(ctx.guild, user.id) or user
             
             activities = []
             for activity in user.activities:
@@ -5011,7 +5341,7 @@ class Tags(commands.Cog):
                 * Example: `{randuser}`
             """
             if ctx.guild:
-                random_user = random.choice(ctx.guild.members)
+                random_user = random.choice(await cache_policy.get_members(ctx.guild))
                 return random_user.name
             return None
         
@@ -5023,7 +5353,7 @@ class Tags(commands.Cog):
                 * Example: `{randuser}`
             """
             if ctx.guild:
-                random_user = random.choice(ctx.guild.members)
+                random_user = random.choice(await cache_policy.get_members(ctx.guild))
                 return random_user.id
             return None
         
@@ -5297,7 +5627,7 @@ class Tags(commands.Cog):
             except Exception as e:
                 return (f"[Select Error: {str(e)}]", [], None, [])
         
-        @self.formatter.register('json.user')
+        @self.formatter.register('json.user', io=True)
         async def _json_user(ctx, user_ref='', **kwargs):
             """
             ### {json.user:user}
@@ -5365,7 +5695,7 @@ class Tags(commands.Cog):
             except Exception as e:
                 return f"[JSON Member Error: {str(e)}]"
         
-        @self.formatter.register('json.memberoruser')
+        @self.formatter.register('json.memberoruser', io=True)
         async def _json_memberoruser(ctx, user_ref='', **kwargs):
             """
             ### {json.memberoruser:user}
@@ -5405,7 +5735,7 @@ class Tags(commands.Cog):
             except Exception as e:
                 return f"[JSON MemberOrUser Error: {str(e)}]"
         
-        @self.formatter.register('json.message')
+        @self.formatter.register('json.message', io=True)
         async def _json_message(ctx, message_ref='', **kwargs):
             """
             ### {json.message:message}
@@ -5751,7 +6081,7 @@ class Tags(commands.Cog):
             except Exception as e:
                 return f"[JSON Attachment Error: {str(e)}]"
         
-        @self.formatter.register('attach')
+        @self.formatter.register('attach', io=True)
         async def _attach(ctx, args_str, **kwargs):
             """
             ### {attach:optional_url}
@@ -5778,22 +6108,21 @@ class Tags(commands.Cog):
 
 
                 if url:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url) as resp:
-                            if resp.status != 200:
-                                return (f"[attach error: HTTP {resp.status}]", [], None, [])
-                            
-                            content_type = resp.headers.get('Content-Type', '')
-                            filename = unquote(urlparse(url).path.split('/'))[-1] or "attachment"
-                            
-
-                            ext = self._get_extension(content_type, filename)
-                            filename = f"{filename.split('.')[0]}.{ext}" if '.' not in filename else filename
-                            
-
-                            file_data = BytesIO(await resp.read())
-                            file = discord.File(file_data, filename=filename)
-                            return ("", [], None, [file])
+                    async with self.bot.http_client.get(url) as resp:
+                        if resp.status != 200:
+                            return (f"[attach error: HTTP {resp.status}]", [], None, [])
+                        
+                        content_type = resp.headers.get('Content-Type', '')
+                        filename = unquote(urlparse(url).path.split('/'))[-1] or "attachment"
+                        
+
+                        ext = self._get_extension(content_type, filename)
+                        filename = f"{filename.split('.')[0]}.{ext}" if '.' not in filename else filename
+                        
+
+                        file_data = BytesIO(await self.bot.http_client.read(resp))
+                        file = discord.File(file_data, filename=filename)
+                        return ("", [], None, [file])
 
                 return ("[attach error: No URL or attachment found]", [], None, [])
             
@@ -5969,6 +6298,7 @@ class Tags(commands.Cog):
 
             custom_id = interaction.data.get("custom_id")
             component_type = interaction.data.get("component_type")
+            scheduler.set_owner_from_interaction(interaction)
 
             if component_type == 2:
                 await self.handle_button(interaction, custom_id)
@@ -6050,14 +6380,7 @@ class Tags(commands.Cog):
     async def execute_tag(self, interaction: discord.Interaction, tag_str: str):
         tag_name = tag_str.split(maxsplit=1)[0]
 
-        async with self.pool.acquire() as conn:
-            tag = await conn.fetchrow(
-                """SELECT content FROM tags 
-                WHERE name = $1 AND (guild_id = $2 OR user_id = $3)""",
-                tag_name,
-                interaction.guild.id if interaction.guild else None,
-                interaction.user.id
-            )
+        tag = await self.resolve_tag(tag_name.lower(), interaction.user.id, interaction.guild.id if interaction.guild else None)
 
         if not tag:
             return await interaction.followup.send(
@@ -6099,6 +6422,7 @@ class Tags(commands.Cog):
     
     def cog_unload(self):
         asyncio.create_task(self.cleanup_resources())
+        asyncio.create_task(self._close_tag_cache())
     
     def parse_personal_flag(self, content: str) -> tuple[str, bool]:
         personal = False
@@ -6164,66 +6488,23 @@ class Tags(commands.Cog):
         name, forced_personal = self.parse_personal_flag(name)
         name = name.lower()
         
-        async with self.pool.acquire() as conn:
-            if not forced_personal:
-                tag = await conn.fetchrow(
-                    """SELECT content, uses FROM tags
-                    WHERE name = $1 AND user_id = $2""",
-                    name, ctx.author.id
-                )
-                
-
-                if not tag and ctx.guild:
-                    tag = await conn.fetchrow(
-                        """SELECT content, uses FROM tags
-                        WHERE name = $1 AND guild_id = $2""",
-                        name, ctx.guild.id
-                    )
-            else:
-                tag = await conn.fetchrow(
-                    """SELECT content, uses FROM tags
-                    WHERE name = $1 AND (($2 AND user_id = $3) OR (NOT $2 AND guild_id = $4))""",
-                    name, forced_personal, ctx.author.id, ctx.guild.id if ctx.guild else None
-                )
-
-
-            if not tag:
-                alias = await conn.fetchrow(
-                    """SELECT tag_name FROM tag_aliases
-                    WHERE alias = $1 AND (user_id = $2 OR guild_id = $3)""",
-                    name, ctx.author.id, ctx.guild.id if ctx.guild else None
+        tag = await self.resolve_tag(name, ctx.author.id, ctx.guild.id if ctx.guild else None, personal=forced_personal)
+        if not tag:
+            return await ctx.send(f"Tag or alias `{name}` not found.")
+        self.tag_cache.add_use(tag['id'])
+        
+        text, embeds, view, files = await self.formatter.format(tag['content'], ctx, args=args)
+        if text.strip() or embeds or (view and view.children) or files:
+            try:
+                await ctx.send(
+                    content=text[:2000] if text else None,
+                    embeds=embeds[:10],
+                    view=view if view and view.children else None,
+                    files=files[:10],
+                    allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=False, replied_user=True)
                 )
-                if alias:
-                    tag = await conn.fetchrow(
-                        """SELECT content, uses FROM tags
-                        WHERE name = $1 AND (user_id = $2 OR guild_id = $3)""",
-                        alias['tag_name'], ctx.author.id, ctx.guild.id if ctx.guild else None
-                    )
-                    if tag:
-                        name = alias['tag_name']
-            
-            if not tag:
-                return await ctx.send(f"Tag or alias `{name}` not found.")
-            
-
-            await conn.execute(
-                """UPDATE tags SET uses = uses + 1
-                WHERE name = $1 AND (user_id = $2 OR guild_id = $3)""",
-                name, ctx.author.id, ctx.guild.id if ctx.guild else None
-            )
-            
-            text, embeds, view, files = await self.formatter.format(tag['content'], ctx, args=args)
-            if text.strip() or embeds or (view and view.children) or files:
-                try:
-                    await ctx.send(
-                        content=text[:2000] if text else None,
-                        embeds=embeds[:10],
-                        view=view if view and view.children else None,
-                        files=files[:10],
-                        allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=False, replied_user=True)
-                    )
-                except discord.HTTPException as e:
-                    await ctx.send(f"Failed to send tag: {e}")
+            except discord.HTTPException as e:
+                await ctx.send(f"Failed to send tag: {e}")
     
     @tag.command(name="show", description="Show a tag.", with_app_command=True, aliases=["fetch"])
     @app_commands.describe(name="The tag name.", args="The tag arguments, if any.", personal="Whether to show a personal tag.")
@@ -6233,64 +6514,23 @@ class Tags(commands.Cog):
         personal = personal or content_personal
         name = name.lower()
         
-        async with self.pool.acquire() as conn:
-            if not personal:
-                tag = await conn.fetchrow(
-                    """SELECT content, uses FROM tags
-                    WHERE name = $1 AND user_id = $2""",
-                    name, ctx.author.id
-                )
-                if not tag and ctx.guild:
-                    tag = await conn.fetchrow(
-                        """SELECT content, uses FROM tags
-                        WHERE name = $1 AND guild_id = $2""",
-                        name, ctx.guild.id
-                    )
-            else:
-                tag = await conn.fetchrow(
-                    """SELECT content, uses FROM tags
-                    WHERE name = $1 AND user_id = $2""",
-                    name, ctx.author.id
-                )
-
-
-            if not tag and not personal:
-                alias = await conn.fetchrow(
-                    """SELECT tag_name FROM tag_aliases
-                    WHERE alias = $1 AND (guild_id = $2 OR user_id = $3)""",
-                    name, ctx.guild.id if ctx.guild else None, ctx.author.id
+        tag = await self.resolve_tag(name, ctx.author.id, ctx.guild.id if ctx.guild else None, personal=personal, aliases=not personal)
+        if not tag:
+            return await ctx.send(f"Tag or alias `{name}` not found.")
+        self.tag_cache.add_use(tag['id'])
+        
+        text, embeds, view, files = await self.formatter.format(tag['content'], ctx, args=args)
+        if text.strip() or embeds or (view and view.children) or files:
+            try:
+                await ctx.send(
+                    content=text[:2000] if text else None,
+                    embeds=embeds[:10],
+                    view=view if view and view.children else None,
+                    files=files[:10],
+                    allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=False, replied_user=True)
                 )
-                if alias:
-                    tag = await conn.fetchrow(
-                        """SELECT content, uses FROM tags
-                        WHERE name = $1 AND (guild_id = $2 OR user_id = $3)""",
-                        alias['tag_name'], ctx.guild.id if ctx.guild else None, ctx.author.id
-                    )
-                    if tag:
-                        name = alias['tag_name']
-            
-            if not tag:
-                return await ctx.send(f"Tag or alias `{name}` not found.")
-            
-            await conn.execute(
-                """UPDATE tags SET uses = uses + 1
-                WHERE name = $1 AND (($2 AND user_id = $3) OR (NOT $2 AND guild_id = $4))""",
-                name, personal, ctx.author.id, ctx.guild.id if ctx.guild else None
-            )
-            
-
-            text, embeds, view, files = await self.formatter.format(tag['content'], ctx, args=args)
-            if text.strip() or embeds or (view and view.children) or files:
-                try:
-                    await ctx.send(
-                        content=text[:2000] if text else None,
-                        embeds=embeds[:10],
-                        view=view if view and view.children else None,
-                        files=files[:10],
-                        allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=False, replied_user=True)
-                    )
-                except discord.HTTPException as e:
-                    await ctx.send(f"Failed to send tag: {e}")
+            except discord.HTTPException as e:
+                await ctx.send(f"Failed to send tag: {e}")
     
     @show.autocomplete("name")
     async def autocomplete_tag_show_name(
@@ -6328,6 +6568,7 @@ class Tags(commands.Cog):
                         VALUES ($1, $2, $3, $4)""",
                         ctx.author.id, name, content, ctx.author.id
                     )
+                    await self.tag_cache.publish(conn, name)
                     await ctx.send(f"Created personal tag `{name}`")
                 else:
                     if not ctx.guild:
@@ -6337,6 +6578,7 @@ class Tags(commands.Cog):
                         VALUES ($1, $2, $3, $4)""",
                         ctx.guild.id, name, content, ctx.author.id
                     )
+                    await self.tag_cache.publish(conn, name)
                     await ctx.send(f"Created server tag `{name}`")
         except asyncpg.UniqueViolationError:
             await ctx.send(f"A tag named `{name}` already exists in this context.")
@@ -6359,36 +6601,46 @@ class Tags(commands.Cog):
         if not new_content:
             return await ctx.send("Please provide the new content for the tag.")
         
+        # The self join returns the content from before the update, so its compiled program can be dropped
         async with self.pool.acquire() as conn:
             if personal:
-                updated = await conn.execute(
-                    """UPDATE tags SET content = $1 
-                    WHERE name = $2 AND user_id = $3""",
+                updated = await conn.fetch(
+                    """UPDATE tags AS t SET content = $1 FROM tags AS old
+                    WHERE old.id = t.id AND t.name = $2 AND t.user_id = $3
+                    RETURNING old.content""",
                     new_content, name, ctx.author.id
                 )
-                if updated != "UPDATE 0":
+                if updated:
+                    self.evict_compiled(updated)
+                    await self.tag_cache.publish(conn, name)
                     return await ctx.send(f"Edited personal tag `{name}`")
             else:
                 if not ctx.guild:
                     return await ctx.send("Server tags can only be edited in servers.")
                 
 
-                updated = await conn.execute(
-                    """UPDATE tags SET content = $1 
-                    WHERE name = $2 AND guild_id = $3 AND author_id = $4""",
+                updated = await conn.fetch(
+                    """UPDATE tags AS t SET content = $1 FROM tags AS old
+                    WHERE old.id = t.id AND t.name = $2 AND t.guild_id = $3 AND t.author_id = $4
+                    RETURNING old.content""",
                     new_content, name, ctx.guild.id, ctx.author.id
                 )
-                if updated != "UPDATE 0":
+                if updated:
+                    self.evict_compiled(updated)
+                    await self.tag_cache.publish(conn, name)
                     return await ctx.send(f"Edited server tag `{name}`")
 
 
                 if ctx.author.guild_permissions.manage_messages:
-                    updated = await conn.execute(
-                        """UPDATE tags SET content = $1 
-                        WHERE name = $2 AND guild_id = $3""",
+                    updated = await conn.fetch(
+                        """UPDATE tags AS t SET content = $1 FROM tags AS old
+                        WHERE old.id = t.id AND t.name = $2 AND t.guild_id = $3
+                        RETURNING old.content""",
                         new_content, name, ctx.guild.id
                     )
-                    if updated != "UPDATE 0":
+                    if updated:
+                        self.evict_compiled(updated)
+                        await self.tag_cache.publish(conn, name)
                         return await ctx.send(f"Forcefully edited server tag `{name}`")
 
             await ctx.send(f"No editable tag named `{name}` found.")
@@ -6470,6 +6722,9 @@ class Tags(commands.Cog):
                     new_name, old_name, personal, ctx.author.id, ctx.guild.id if ctx.guild else None
                 )
 
+            # After the commit, so a lookup in between can't cache the old tag again
+            await self.tag_cache.publish(conn, old_name, new_name)
+
         await ctx.send(f"Renamed tag from `{old_name}` to `{new_name}`")
     
     @rename.autocomplete("old_name")
@@ -6493,32 +6748,38 @@ class Tags(commands.Cog):
         
         async with self.pool.acquire() as conn:
             if personal:
-                deleted = await conn.execute(
-                    "DELETE FROM tags WHERE name = $1 AND user_id = $2",
+                deleted = await conn.fetch(
+                    "DELETE FROM tags WHERE name = $1 AND user_id = $2 RETURNING content",
                     name, ctx.author.id
                 )
-                if deleted != "DELETE 0":
+                if deleted:
+                    self.evict_compiled(deleted)
+                    await self.tag_cache.publish(conn, name)
                     return await ctx.send(f"Deleted personal tag `{name}`")
             else:
                 if not ctx.guild:
                     return await ctx.send("Server tags can only be deleted in servers.")
                 
 
-                deleted = await conn.execute(
+                deleted = await conn.fetch(
                     """DELETE FROM tags 
-                    WHERE name = $1 AND guild_id = $2 AND author_id = $3""",
+                    WHERE name = $1 AND guild_id = $2 AND author_id = $3 RETURNING content""",
                     name, ctx.guild.id, ctx.author.id
                 )
-                if deleted != "DELETE 0":
+                if deleted:
+                    self.evict_compiled(deleted)
+                    await self.tag_cache.publish(conn, name)
                     return await ctx.send(f"Deleted server tag `{name}`")
 
 
                 if ctx.author.guild_permissions.manage_messages:
-                    deleted = await conn.execute(
-                        "DELETE FROM tags WHERE name = $1 AND guild_id = $2",
+                    deleted = await conn.fetch(
+                        "DELETE FROM tags WHERE name = $1 AND guild_id = $2 RETURNING content",
                         name, ctx.guild.id
                     )
-                    if deleted != "DELETE 0":
+                    if deleted:
+                        self.evict_compiled(deleted)
+                        await self.tag_cache.publish(conn, name)
                         return await ctx.send(f"Forcefully deleted server tag `{name}`")
 
             await ctx.send(f"No deletable tag `{name}` found.")
@@ -6570,7 +6831,7 @@ class Tags(commands.Cog):
         
         async with self.pool.acquire() as conn:
             tag = await conn.fetchrow(
-                """SELECT content, author_id, created_at, uses,
+                """SELECT id, content, author_id, created_at, uses,
                 guild_id IS NOT NULL as is_guild_tag
                 FROM tags
                 WHERE name = $1 AND (($2 AND user_id = $3) OR (NOT $2 AND guild_id = $4))""",
@@ -6582,7 +6843,7 @@ class Tags(commands.Cog):
             
             embed = discord.Embed(title=f"Tag: {name}", color=discord.Color.blue())
             embed.add_field(name="Type", value="Server" if tag['is_guild_tag'] else "Personal", inline=True)
-            embed.add_field(name="Uses", value=tag['uses'], inline=True)
+            embed.add_field(name="Uses", value=tag['uses'] + self.tag_cache.uses[tag['id']], inline=True)
             embed.add_field(name="Created", value=tag['created_at'].strftime("%Y-%m-%d %H:%M:%S (%B %d, %Y at %I:%M:%S %p)"), inline=True)
             author = self.bot.get_user(tag['author_id'])
             if author:
@@ -6629,6 +6890,47 @@ class Tags(commands.Cog):
     ):
         return await self.tag_name_autocomplete(interaction, current)
     
+    @tag.command(name="profile", description="Run a tag and show the time and calls per tag function.", with_app_command=True)
+    @app_commands.describe(
+        name="The tag name.",
+        args="The tag arguments, if any.",
+        personal="Whether to look for a personal tag."
+    )
+    async def profile(self, ctx: commands.Context, name: str, *, args: str = "", personal: bool = False):
+        await ctx.typing()
+        name, content_personal = self.parse_personal_flag(name)
+        personal = personal or content_personal
+        name = name.lower()
+        
+        # Same lookup as g-tag, so the profiled tag is the one that would run
+        tag = await self.resolve_tag(name, ctx.author.id, ctx.guild.id if ctx.guild else None, personal=personal)
+        if not tag:
+            return await ctx.send(f"Tag or alias `{name}` not found.")
+        name = tag['name']
+        
+        profile = tagscript.Profile()
+        start = time.perf_counter()
+        text, embeds, view, files = await self.formatter.run(tagscript.cache.get(tag['content']), ctx, profile=profile, args=args)
+        elapsed = time.perf_counter() - start
+        budget = profile.budget
+        
+        summary = f"Ran `{name}` in {elapsed:.3f}s: {budget.steps}/{budget.max_steps} steps, {budget.output}/{budget.max_output} bytes of output, {len(embeds)} embeds, {len(files)} files"
+        if text.startswith("[Tag Error:"):
+            summary += f"\n{text[:200]}"
+        report = f"{profile.table()}\n\nTimes include the blocks nested in a function's arguments, and blocks that ran concurrently overlap."
+        if len(summary) + len(report) > 1980:
+            await ctx.send(summary, file=discord.File(BytesIO(report.encode()), filename=f"tag-profile-{name}.txt"))
+        else:
+            await ctx.send(f"{summary}\n```\n{report}\n```")
+    
+    @profile.autocomplete("name")
+    async def autocomplete_tag_profile_name(
+        self,
+        interaction: discord.Interaction,
+        current: str
+    ):
+        return await self.tag_name_autocomplete(interaction, current)
+    
     @tag.command(name="transfer", description="Transfer ownership of a personal tag.", with_app_command=True, aliases=["gift"])
     @app_commands.describe(name="The tag name.", new_owner="The user to transfer to.")
     async def transfer(self, ctx: commands.Context, name: str, new_owner: discord.User):
@@ -6641,9 +6943,10 @@ class Tags(commands.Cog):
                 new_owner.id, name, ctx.author.id
             )
 
-            if updated == "UPDATED 0":
+            if updated == "UPDATE 0":
                 await ctx.send(f"No personal tag `{name}` found that you own.")
             else:
+                await self.tag_cache.publish(conn, name)
                 await ctx.send(f"Transferred tag `{name}` to {new_owner.name}")
     
     @tag.group(name="alias", description="Manage tag aliases.", with_app_command=True)
@@ -6670,6 +6973,7 @@ class Tags(commands.Cog):
         if not ctx.guild and not personal:
             return await ctx.send("Server tags can only be managed in servers.")
 
+        added = False
         async with self.pool.acquire() as conn:
             async with conn.transaction():
                 try:
@@ -6708,6 +7012,7 @@ class Tags(commands.Cog):
                         VALUES ($1, $2, $3, $4)""",
                         alias, tag_name, guild_id, user_id
                     )
+                    added = True
                     
                     await ctx.send(f"Added alias `{alias}` for tag `{tag_name}`")
                     
@@ -6716,6 +7021,9 @@ class Tags(commands.Cog):
                 except Exception as e:
                     await ctx.send(f"An error occurred: {str(e)}")
 
+            if added:
+                await self.tag_cache.publish(conn, alias)
+
     @alias.command(name="remove", description="Remove a tag alias.", aliases=["delete", "rm", "del"])
     @app_commands.describe(
         alias="The alias to remove",
@@ -6728,6 +7036,7 @@ class Tags(commands.Cog):
         if not ctx.guild and not personal:
             return await ctx.send("Server tags can only be managed in servers.")
 
+        deleted = "DELETE 0"
         async with self.pool.acquire() as conn:
             async with conn.transaction():
                 try:
@@ -6753,6 +7062,9 @@ class Tags(commands.Cog):
                 except Exception as e:
                     await ctx.send(f"An error occurred: {str(e)}")
 
+            if deleted != "DELETE 0":
+                await self.tag_cache.publish(conn, alias)
+
     @alias.command(name="list", description="List tag aliases.", aliases=["ls"])
     @app_commands.describe(personal="Whether to list personal tag aliases")
     async def alias_list(self, ctx: commands.Context, personal: bool = False):
@@ -6791,5 +7103,5 @@ class Tags(commands.Cog):
 
 async def setup(bot):
     if not hasattr(bot, 'pool'):
-        bot.pool = await asyncpg.create_pool(bot_info.data['database'])
+        bot.pool = await db.create_pool()
     await bot.add_cog(Tags(bot))
\ No newline at end of file
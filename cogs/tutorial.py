@@ -5,30 +5,33 @@ from discord import app_commands
 import os
 import random
 import textwrap
-import aiohttp
 import re
 import urllib.parse
+import metrics
+import scheduler
+import io_pool
+from workspace import workspaces
+from download_cache import DownloadFailed
 
 class Tutorial(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
     
-    async def download_file(self, url, prefix="temp_input"):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    parsed = urllib.parse.urlparse(url)
-                    filename = os.path.basename(parsed.path)
-                    if "." not in filename:
-                        content_disposition = resp.headers.get("Content-Disposition", "")
-                        if "filename=" in content_disposition:
-                            filename = re.findall("filename=(.+)", content_disposition)[0].strip('"')
-                    _, ext = os.path.splitext(filename)
-                    temp_filename = f"{prefix}{ext or ''}"
-                    with open(temp_filename, "wb") as f:
-                        f.write(await resp.read())
-                    return temp_filename
-                return None
+    async def download_file(self, url, workspace, prefix="temp_input"):
+        try:
+            entry = await self.bot.download_cache.fetch(url, workspace.file(prefix))
+        except DownloadFailed:
+            return None
+        parsed = urllib.parse.urlparse(url)
+        filename = os.path.basename(parsed.path)
+        if "." not in filename:
+            content_disposition = entry.content_disposition or ""
+            if "filename=" in content_disposition:
+                filename = re.findall("filename=(.+)", content_disposition)[0].strip('"')
+        _, ext = os.path.splitext(filename)
+        temp_filename = workspace.file(f"{prefix}{ext or ''}")
+        await io_pool.replace(workspace.file(prefix), temp_filename)
+        return temp_filename
 
 
     @commands.hybrid_command(name="tutorial", description="Make an oldschool video tutorial.")
@@ -37,11 +40,17 @@ class Tutorial(commands.Cog):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def tutorial(self, ctx: commands.Context, *, msg: str = ''):
         await ctx.typing()
+        workspace = await workspaces.acquire("tutorial")
+        try:
+            await self.make_tutorial(ctx, msg, workspace)
+        finally:
+            await workspace.release()
 
+    async def make_tutorial(self, ctx: commands.Context, msg: str, workspace):
         if ctx.message.attachments:
             video_attachment = ctx.message.attachments[0]
-            video_filename = f"vids/temp_video_{video_attachment.filename}"
-            await video_attachment.save(video_filename)
+            video_filename = workspace.file(f"temp_video_{video_attachment.filename}")
+            await self.bot.download_cache.fetch(video_attachment.url, video_filename)
         else:
             url_match = re.search(r'(https?://\S+)', msg)
             if not url_match:
@@ -49,7 +58,7 @@ class Tutorial(commands.Cog):
                 return
             video_url = url_match.group(1)
             msg = msg.replace(video_url, '').strip()
-            video_filename = await self.download_file(video_url, "temp_video_")
+            video_filename = await self.download_file(video_url, workspace, "temp_video_")
             if not video_filename:
                 await ctx.send("Failed to download the video.")
                 return
@@ -57,14 +66,14 @@ class Tutorial(commands.Cog):
         music_filename = None
         if len(ctx.message.attachments) > 1:
             music_attachment = ctx.message.attachments[1]
-            music_filename = f"vids/temp_music_{music_attachment.filename}"
-            await music_attachment.save(music_filename)
+            music_filename = workspace.file(f"temp_music_{music_attachment.filename}")
+            await self.bot.download_cache.fetch(music_attachment.url, music_filename)
         else:
             url_match = re.search(r'(https?://\S+)', msg)
             if url_match:
                 music_url = url_match.group(1)
                 msg = msg.replace(music_url, '').strip()
-                music_filename = await self.download_file(music_url, "temp_music_")
+                music_filename = await self.download_file(music_url, workspace, "temp_music_")
         
         if not music_filename:
             await ctx.send("Please provide a music URL or attach a music file.")
@@ -108,7 +117,7 @@ class Tutorial(commands.Cog):
             max_line_width = 40
             wrapped_title = textwrap.wrap(title_top, width=max_line_width)
         sub_font_size = title_font_size * 0.7
-        output_filename = "vids/tutorial.mp4"
+        output_filename = workspace.file("tutorial.mp4")
         ffmpeg_command = [
             'ffmpeg',
             '-i', 'tutorial/bg.mp4',
@@ -131,17 +140,14 @@ class Tutorial(commands.Cog):
             '-shortest',
             '-y', output_filename
         ]
-        try:
-            proc = await asyncio.create_subprocess_exec(*ffmpeg_command)
-            await proc.wait()
-            if proc.returncode == 0:
-                await ctx.send(file=discord.File(output_filename))
-            else:
-                await ctx.send("Video processing failed.")
-        finally:
-            for f in [video_filename, music_filename, output_filename]:
-                if f and os.path.exists(f):
-                    os.remove(f)
+        async with scheduler.slot("tutorial"):
+            with metrics.phase("subprocess"):
+                proc = await asyncio.create_subprocess_exec(*ffmpeg_command)
+                await proc.wait()
+        if proc.returncode == 0:
+            await ctx.send(file=discord.File(output_filename))
+        else:
+            await ctx.send("Video processing failed.")
 
 async def setup(bot):
     await bot.add_cog(Tutorial(bot))
\ No newline at end of file
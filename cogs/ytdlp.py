@@ -4,8 +4,6 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 from discord.ext import tasks
-from yt_dlp.utils import download_range_func
-import yt_dlp
 import shlex
 import json
 import asyncio
@@ -13,6 +11,12 @@ import tempfile
 import shutil
 import re
 import uuid
+from io import BytesIO
+import metrics
+import io_pool
+import lazy_imports
+
+yt_dlp = lazy_imports.module("yt_dlp")
 
 class Ytdlp(commands.Cog):
     def __init__(self, bot):
@@ -33,11 +37,10 @@ class Ytdlp(commands.Cog):
         await ctx.typing()
         async with self.download_semaphore:
             temp_dir = os.path.join(tempfile.gettempdir(), f"{self.temp_dir_prefix}{uuid.uuid4().hex}")
-            os.makedirs(temp_dir, exist_ok=True)
+            await io_pool.makedirs(temp_dir)
             lock_file = os.path.join(temp_dir, "active.lock")
             try:
-                with open(lock_file, 'w') as f:
-                    f.write("active")
+                await io_pool.write_text(lock_file, "active")
                 if ' ' in url and not url.startswith(('http://', 'https://', 'ytsearch', 'ytsearch:')):
                     url = f"ytsearch1:{url}"
                 ydl_opts = {
@@ -122,14 +125,8 @@ class Ytdlp(commands.Cog):
             except Exception as e:
                 await ctx.send(f"An error occurred during download: {str(e)}")
             finally:
-                try:
-                    os.remove(lock_file)
-                except:
-                    pass
-                try:
-                    shutil.rmtree(temp_dir)
-                except Exception as e:
-                    pass
+                await io_pool.remove(lock_file)
+                await io_pool.rmtree(temp_dir)
     
     async def send_results(self, ctx: commands.Context, results, is_multiple, max_size, start_time, ydl_opts):
         for failure in results['failed']:
@@ -217,12 +214,13 @@ class Ytdlp(commands.Cog):
             output_path
         ]
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
+        with metrics.phase("subprocess"):
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await process.communicate()
 
         if process.returncode != 0:
             raise RuntimeError(f"```{stderr.decode()}```")
@@ -299,25 +297,19 @@ class Ytdlp(commands.Cog):
 
         message = "\n".join(lines)
         if len(message) > 2000:
-            path = f"vids/formats-{info.get('id', 'Unknown')}.txt"
-            with open(path, 'w') as f:
-                f.write(message)
-            await ctx.send(f"Available formats for {info.get('title', 'Unknown')}:", file=discord.File(path))
-            os.remove(path)
+            # Sent straight from memory, there's no need for a file on disk
+            file = discord.File(BytesIO(message.encode()), filename=f"formats-{info.get('id', 'Unknown')}.txt")
+            await ctx.send(f"Available formats for {info.get('title', 'Unknown')}:", file=file)
         else:
             await ctx.send(f"Available formats for {info.get('title', 'Unknown')}:\n```{message}```")
     
     async def handle_json_output(self, ctx: commands.Context, info):
-        path = f"vids/{info.get('id', 'Unknown')}.info.json"
         try:
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(info, f, indent=4)
-            await ctx.send(f"Info dict JSON extracted for {info.get('title', 'Unknown Title')}:", file=discord.File(path))
+            data = await io_pool.run(json.dumps, info, indent=4)
+            file = discord.File(BytesIO(data.encode('utf-8')), filename=f"{info.get('id', 'Unknown')}.info.json")
+            await ctx.send(f"Info dict JSON extracted for {info.get('title', 'Unknown Title')}:", file=file)
         except Exception as e:
             await ctx.send(f"Error extracting the info dict JSON: {e}")
-        finally:
-            if os.path.exists(path):
-                os.remove(path)
     
     def build_metadata_message(self, info: dict, file_path: str, file_size: int, elapsed: float) -> str:
         fields = []
@@ -372,28 +364,37 @@ class Ytdlp(commands.Cog):
         except Exception as e:
             print(f"Error cleaning temp files: {e}")
     
+    def _remove_path(self, path: str):
+        if os.path.exists(path):
+            if os.path.isfile(path):
+                os.unlink(path)
+            else:
+                shutil.rmtree(path)
+
     async def safe_cleanup(self, path: str):
         try:
-            if os.path.exists(path):
-                if os.path.isfile(path):
-                    os.unlink(path)
-                else:
-                    shutil.rmtree(path)
+            await io_pool.run(self._remove_path, path)
         except Exception as e:
             print(f"Error cleaning up {path}: {e}")
+
+    def _stale_temp_dirs(self, temp_parent: str) -> list[str]:
+        stale = []
+        for name in os.listdir(temp_parent):
+            if name.startswith('yt_dlp_'):
+                path = os.path.join(temp_parent, name)
+                try:
+                    if os.path.getmtime(path) < time.time() - 3600:
+                        stale.append(path)
+                except Exception as e:
+                    print(f"Could not delete {path}: {e}")
+        return stale
     
     @tasks.loop(minutes=30)
     async def clean_temp_dir(self):
         temp_parent = tempfile.gettempdir()
         try:
-            for name in os.listdir(temp_parent):
-                if name.startswith('yt_dlp_'):
-                    path = os.path.join(temp_parent, name)
-                    try:
-                        if os.path.getmtime(path) < time.time() - 3600:
-                            await self.safe_cleanup(path)
-                    except Exception as e:
-                        print(f"Could not delete {path}: {e}")
+            for path in await io_pool.run(self._stale_temp_dirs, temp_parent):
+                await self.safe_cleanup(path)
         except Exception as e:
             print(f"Error cleaning temp dir: {e}")
 
@@ -540,7 +541,7 @@ class Ytdlp(commands.Cog):
                             else:
                                 start = self.parse_time_to_seconds(rng.strip())
                                 ranges.append((start, None))
-                            parsed_opts[key] = download_range_func(None, ranges)
+                            parsed_opts[key] = yt_dlp.utils.download_range_func(None, ranges)
                     except ValueError as e:
                         raise ValueError(f"Invalid range format for download_ranges: `{e}`")
                 else:
@@ -0,0 +1,447 @@
+import asyncio
+import contextvars
+import inspect
+import logging
+import time
+from collections import Counter, defaultdict, namedtuple
+import asyncpg
+import bot_info
+import metrics
+
+# The shared asyncpg pool: sizing from "database_pool" in bot_info.json, named prepared statements
+# for the hottest queries, and health tracking (acquire wait, connections in use, longest holder).
+
+# Hot queries, prepared once per connection under a fixed name and reused through prepared()
+STATEMENTS = {
+    "user_prefixes": "SELECT prefixes FROM user_prefixes WHERE user_id = $1",
+    "guild_prefixes": "SELECT prefixes FROM guild_prefixes WHERE guild_id = $1",
+    # A tag by name for user $2 in guild $3: their personal tag, then the guild's (unless $4, personal only),
+    # then (if $5) a personal or guild alias pointing at either
+    "resolve_tag": """
+        SELECT id, name, content FROM (
+            SELECT id, name, content, 0 AS rank FROM tags WHERE name = $1 AND user_id = $2
+            UNION ALL
+            SELECT id, name, content, 1 FROM tags WHERE name = $1 AND guild_id = $3 AND NOT $4
+            UNION ALL
+            SELECT t.id, t.name, t.content, 2 + (a.user_id IS NULL)::int * 2 + (t.user_id IS NULL)::int
+            FROM tag_aliases a JOIN tags t ON t.name = a.tag_name AND (t.user_id = $2 OR t.guild_id = $3)
+            WHERE $5 AND a.alias = $1 AND (a.user_id = $2 OR a.guild_id = $3)
+        ) matches ORDER BY rank LIMIT 1""",
+    "guild_server_permissions": "SELECT guild_id, command_name, status, reason FROM server_command_permissions WHERE guild_id = $1",
+    "guild_command_permissions": "SELECT guild_id, command_name, target_type, target_id, status, reason FROM command_permissions WHERE guild_id = $1 ORDER BY id"
+}
+
+_STATEMENT_NAMES = {" ".join(query.split()): name for name, query in STATEMENTS.items()}
+# Plain EXPLAIN (no ANALYZE) never runs the statement, so writes are safe to explain too
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+class StatementStats:
+    __slots__ = ("count", "errors", "duration", "commands")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.duration = metrics.Histogram()
+        self.commands = Counter()
+
+# Per-statement count, time and p99 from the query logger, tagged with the command that ran them.
+# Statements slower than slow_threshold are logged with their EXPLAIN plan (once per statement every
+# explain_cooldown seconds), and each finished command's queries are kept to spot N+1 patterns:
+# several round trips per run, or the same statement repeated within one run.
+class QueryStats:
+    def __init__(self, slow_threshold: float = 0.1, explain_cooldown: float = 300.0, max_statements: int = 200, round_trip_threshold: int = 3, max_patterns: int = 10):
+        self.slow_threshold = slow_threshold
+        self.explain_cooldown = explain_cooldown
+        self.max_statements = max_statements
+        self.round_trip_threshold = round_trip_threshold
+        self.max_patterns = max_patterns
+        self.statements = {}
+        self.slow = 0
+        # command -> [runs, queries, most queries in one run]
+        self.runs = defaultdict(lambda: [0, 0, 0])
+        # (command, statement) -> [runs where it repeated, most times in one run]
+        self.repeats = defaultdict(lambda: [0, 0])
+        self.patterns = defaultdict(Counter)
+        self.pool = None
+        self._explained = {}
+
+    def _key(self, text: str) -> str:
+        name = _STATEMENT_NAMES.get(text)
+        if name is not None:
+            return name
+        if text in self.statements or len(self.statements) < self.max_statements:
+            return text
+        return "other"
+
+    # asyncpg query logger, runs in the context of the query so the command is known
+    def record(self, record):
+        text = " ".join(record.query.split())
+        if text.startswith("EXPLAIN "):
+            return
+        key = self._key(text)
+        stats = self.statements.get(key)
+        if stats is None:
+            stats = self.statements[key] = StatementStats()
+        command = metrics.current_command() or "background"
+        stats.count += 1
+        stats.duration.observe(record.elapsed)
+        stats.commands[command] += 1
+        if record.exception is not None:
+            stats.errors += 1
+        invocation = metrics.current_invocation()
+        if invocation is not None:
+            invocation.queries.append(key)
+        if record.elapsed >= self.slow_threshold:
+            self.slow += 1
+            self._slow_query(key, text, record, command)
+
+    def _slow_query(self, key: str, text: str, record, command: str):
+        now = time.monotonic()
+        last = self._explained.get(key)
+        if self.pool is None or text.split(" ", 1)[0].upper() not in EXPLAINABLE or (last is not None and now - last < self.explain_cooldown):
+            logging.getLogger().warning(f"Slow query ({record.elapsed * 1000:.0f}ms, {command}): {text}")
+            return
+        self._explained[key] = now
+        # Started from an empty context so the EXPLAIN isn't counted as the command's database time
+        contextvars.Context().run(asyncio.create_task, self._explain(text, record.args or (), record.elapsed, command))
+
+    async def _explain(self, text: str, args, elapsed: float, command: str):
+        try:
+            async with self.pool.acquire(timeout=5) as conn:
+                rows = await conn.fetch(f"EXPLAIN {text}", *args)
+            plan = "\n".join(row[0] for row in rows)
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+        logging.getLogger().warning(f"Slow query ({elapsed * 1000:.0f}ms, {command}): {text}\n{plan}")
+
+    # metrics finish hook
+    def finish(self, invocation):
+        queries = invocation.queries
+        runs = self.runs[invocation.command]
+        runs[0] += 1
+        runs[1] += len(queries)
+        runs[2] = max(runs[2], len(queries))
+        for key, count in Counter(queries).items():
+            if count > 1:
+                repeat = self.repeats[(invocation.command, key)]
+                repeat[0] += 1
+                repeat[1] = max(repeat[1], count)
+        if len(queries) < self.round_trip_threshold:
+            return
+        # Consecutive runs of one statement are collapsed so loops of different lengths share a pattern
+        steps = []
+        for key in queries:
+            if steps and steps[-1][0] == key:
+                steps[-1][1] += 1
+            else:
+                steps.append([key, 1])
+        pattern = " -> ".join(_short(key) + (" (repeated)" if count > 1 else "") for key, count in steps)
+        patterns = self.patterns[invocation.command]
+        if pattern in patterns or len(patterns) < self.max_patterns:
+            patterns[pattern] += 1
+
+    def report(self, limit: int = 10) -> str:
+        lines = ["Statements by total time", f"{'Count':>7} {'Errs':>5} {'Total':>9} {'Avg':>8} {'p99':>8}  Statement"]
+        rows = sorted(self.statements.items(), key=lambda item: item[1].duration.sum, reverse=True)[:limit]
+        for key, stats in rows:
+            duration = stats.duration
+            lines.append(f"{stats.count:>7} {stats.errors:>5} {duration.sum:>8.2f}s {duration.sum / duration.count * 1000:>6.1f}ms {duration.quantile(0.99) * 1000:>6.0f}ms  {key}")
+            lines.append(f"{'':>44}by " + ", ".join(f"{command} ({count})" for command, count in stats.commands.most_common(3)))
+        if self.slow:
+            lines.append(f"{self.slow} queries took longer than {self.slow_threshold * 1000:.0f}ms, see the log for their plans")
+        lines += ["", f"Commands averaging {self.round_trip_threshold} or more queries per run"]
+        busy = sorted(((command, runs) for command, runs in self.runs.items() if runs[1] >= self.round_trip_threshold * runs[0]), key=lambda item: item[1][1], reverse=True)[:limit]
+        for command, (count, queries, most) in busy:
+            lines.append(f"{command}: {queries / count:.1f} queries per run over {count} runs (most {most})")
+            lines += [f"  {times}x {pattern}" for pattern, times in self.patterns[command].most_common(3)]
+        lines += ["", "Statements repeated within one run"]
+        repeats = sorted(self.repeats.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        lines += [f"{command}: {_short(key)} repeated in {count} runs, up to {most} times" for (command, key), (count, most) in repeats]
+        return "\n".join(lines) + "\n"
+
+    def prometheus_lines(self) -> list[str]:
+        lines = ["# TYPE gman_db_slow_queries_total counter", f"gman_db_slow_queries_total {self.slow}", "# TYPE gman_db_statement_errors_total counter"]
+        lines += [f'gman_db_statement_errors_total{{statement="{metrics.escape(key)}"}} {stats.errors}' for key, stats in self.statements.items()]
+        lines.append("# TYPE gman_db_statement_seconds histogram")
+        for key, stats in self.statements.items():
+            lines += metrics.histogram_lines("gman_db_statement_seconds", stats.duration, f'statement="{metrics.escape(key)}"')
+        lines.append("# TYPE gman_db_command_queries_total counter")
+        lines += [f'gman_db_command_queries_total{{command="{metrics.escape(command)}"}} {runs[1]}' for command, runs in sorted(self.runs.items())]
+        return lines
+
+def _short(key: str) -> str:
+    return key if len(key) <= 60 else key[:57] + "..."
+
+_stats_config = bot_info.data.get('database_stats', {})
+stats = QueryStats(
+    _stats_config.get('slow_threshold', 0.1),
+    _stats_config.get('explain_cooldown', 300.0),
+    _stats_config.get('max_statements', 200),
+    _stats_config.get('round_trip_threshold', 3)
+)
+metrics.register_collector(stats.prometheus_lines)
+metrics.register_finish_hook(stats.finish)
+
+class Connection(asyncpg.Connection):
+    __slots__ = ("statements",)
+
+# The fields of asyncpg's LoggedQuery that the query loggers read
+LoggedQuery = namedtuple("LoggedQuery", ("query", "args", "elapsed", "exception"))
+
+# asyncpg runs prepared statements without calling the connection's query loggers, so every call is
+# timed here and passed to the same loggers (the command's db phase, dbstats)
+class PreparedStatement:
+    __slots__ = ("statement", "query")
+
+    def __init__(self, statement, query: str):
+        self.statement = statement
+        self.query = query
+
+    def __getattr__(self, name: str):
+        return getattr(self.statement, name)
+
+    async def _timed(self, method, args: tuple, kwargs: dict):
+        start = time.perf_counter()
+        exception = None
+        try:
+            return await method(*args, **kwargs)
+        except Exception as e:
+            exception = e
+            raise
+        finally:
+            record = LoggedQuery(self.query, args, time.perf_counter() - start, exception)
+            metrics.record_query(record)
+            stats.record(record)
+
+    async def fetch(self, *args, **kwargs):
+        return await self._timed(self.statement.fetch, args, kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        return await self._timed(self.statement.fetchrow, args, kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        return await self._timed(self.statement.fetchval, args, kwargs)
+
+async def init_connection(conn):
+    conn.statements = {}
+    await metrics.instrument_connection(conn)
+    conn.add_query_logger(stats.record)
+
+async def prepared(conn, name: str):
+    statements = getattr(conn, "statements", None)
+    if statements is None:
+        # Connection from a pool not made by create_pool(), asyncpg's own statement cache still applies
+        return PreparedStatement(await conn.prepare(STATEMENTS[name]), STATEMENTS[name])
+    statement = statements.get(name)
+    if statement is None:
+        statement = PreparedStatement(await conn.prepare(STATEMENTS[name], name=f"gman_{name}"), STATEMENTS[name])
+        statements[name] = statement
+    return statement
+
+# Dedicated connection for LISTEN, shared by every cache that hears about changes through NOTIFY.
+# When the connection drops it reconnects with backoff, listens again and calls each channel's resync,
+# since notifications sent while it was down are lost.
+class Listener:
+    def __init__(self, dsn: str, max_retry_delay: float = 60.0):
+        self.dsn = dsn
+        self.max_retry_delay = max_retry_delay
+        self.conn = None
+        # channel -> [(callback, resync)]
+        self.channels = defaultdict(list)
+        self.reconnects = 0
+        self._reconnecting = None
+        self._closing = False
+
+    async def start(self):
+        self._closing = False
+        await self._connect()
+
+    async def _connect(self):
+        conn = await asyncpg.connect(self.dsn)
+        conn.add_termination_listener(self._on_terminate)
+        for channel, subscribers in self.channels.items():
+            for callback, _ in subscribers:
+                await conn.add_listener(channel, callback)
+        self.conn = conn
+
+    # resync (sync or async, no arguments) brings the subscriber up to date after a reconnect
+    async def listen(self, channel: str, callback, resync=None):
+        self.channels[channel].append((callback, resync))
+        if self.conn is not None and not self.conn.is_closed():
+            await self.conn.add_listener(channel, callback)
+
+    async def unlisten(self, channel: str, callback):
+        self.channels[channel] = [subscriber for subscriber in self.channels[channel] if subscriber[0] != callback]
+        if not self.channels[channel]:
+            del self.channels[channel]
+        if self.conn is not None and not self.conn.is_closed():
+            await self.conn.remove_listener(channel, callback)
+
+    def _on_terminate(self, conn):
+        if self._closing or self._reconnecting is not None or conn is not self.conn:
+            return
+        logging.getLogger().warning("Lost the database LISTEN connection, reconnecting")
+        self._reconnecting = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1.0
+        try:
+            while True:
+                try:
+                    await self._connect()
+                    break
+                except Exception as e:
+                    logging.getLogger().warning(f"Couldn't reconnect the database LISTEN connection, retrying in {delay:.0f}s: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+            self.reconnects += 1
+            for channel, subscribers in list(self.channels.items()):
+                for callback, resync in list(subscribers):
+                    if resync is None:
+                        continue
+                    try:
+                        result = resync()
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception as e:
+                        logging.getLogger().error(f"Failed to resync {channel} after reconnecting: {e}")
+        finally:
+            self._reconnecting = None
+
+    async def close(self):
+        self._closing = True
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+        if self.conn is not None and not self.conn.is_closed():
+            await self.conn.close()
+
+def pool_options() -> dict:
+    config = bot_info.data.get('database_pool', {})
+    return {
+        "min_size": config.get('min_size', 10),
+        "max_size": config.get('max_size', 10),
+        "command_timeout": config.get('command_timeout'),
+        "statement_cache_size": config.get('statement_cache_size', 100),
+        "max_inactive_connection_lifetime": config.get('max_inactive_connection_lifetime', 300.0)
+    }
+
+class _Acquire:
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    async def _acquire(self):
+        self.pool.waiting += 1
+        start = time.perf_counter()
+        try:
+            conn = await self.pool._pool.acquire(timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.pool.timeouts += 1
+            raise
+        finally:
+            self.pool.waiting -= 1
+            self.pool.acquire_wait.observe(time.perf_counter() - start)
+        task = asyncio.current_task()
+        holder = metrics.current_command() or (task.get_name() if task else "unknown")
+        self.pool.holders[id(conn)] = (holder, time.perf_counter())
+        return conn
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self._acquire()
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        await self.pool.release(self.conn)
+
+# Wraps an asyncpg pool so every acquire is timed and every checked out connection has a known holder
+class Pool:
+    def __init__(self, pool):
+        self._pool = pool
+        self.acquire_wait = metrics.Histogram()
+        self.acquires = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.holders = {}
+
+    def __getattr__(self, name: str):
+        return getattr(self._pool, name)
+
+    def acquire(self, *, timeout: float = None):
+        self.acquires += 1
+        return _Acquire(self, timeout)
+
+    async def release(self, conn, *, timeout: float = None):
+        self.holders.pop(id(conn), None)
+        await self._pool.release(conn, timeout=timeout)
+
+    async def execute(self, query: str, *args, timeout: float = None):
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args, timeout=timeout)
+
+    async def executemany(self, command: str, args, *, timeout: float = None):
+        async with self.acquire() as conn:
+            return await conn.executemany(command, args, timeout=timeout)
+
+    async def fetch(self, query: str, *args, timeout: float = None, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args, timeout=timeout, **kwargs)
+
+    async def fetchrow(self, query: str, *args, timeout: float = None, **kwargs):
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args, timeout=timeout, **kwargs)
+
+    async def fetchval(self, query: str, *args, column: int = 0, timeout: float = None):
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args, column=column, timeout=timeout)
+
+    def health(self) -> dict:
+        now = time.perf_counter()
+        longest = max(self.holders.values(), key=lambda holder: now - holder[1], default=None)
+        return {
+            "size": self._pool.get_size(),
+            "idle": self._pool.get_idle_size(),
+            "max_size": self._pool.get_max_size(),
+            "in_use": len(self.holders),
+            "waiting": self.waiting,
+            "acquires": self.acquires,
+            "timeouts": self.timeouts,
+            "wait_avg": self.acquire_wait.sum / self.acquire_wait.count if self.acquire_wait.count else 0.0,
+            "wait_p95": self.acquire_wait.quantile(0.95),
+            "longest_holder": longest[0] if longest else None,
+            "longest_held": now - longest[1] if longest else 0.0
+        }
+
+    def summary(self) -> str:
+        health = self.health()
+        text = f"{health['in_use']}/{health['max_size']} in use ({health['size']} open), {health['waiting']} waiting, acquire wait avg {health['wait_avg'] * 1000:.1f}ms / p95 {health['wait_p95'] * 1000:.0f}ms"
+        if health["longest_holder"]:
+            text += f", longest holder {health['longest_holder']} ({health['longest_held']:.1f}s)"
+        return text
+
+    def prometheus_lines(self) -> list[str]:
+        health = self.health()
+        lines = [
+            "# TYPE gman_db_pool_connections gauge",
+            f'gman_db_pool_connections{{state="open"}} {health["size"]}',
+            f'gman_db_pool_connections{{state="idle"}} {health["idle"]}',
+            f'gman_db_pool_connections{{state="in_use"}} {health["in_use"]}',
+            f'gman_db_pool_connections{{state="max"}} {health["max_size"]}',
+            "# TYPE gman_db_pool_waiting gauge",
+            f"gman_db_pool_waiting {health['waiting']}",
+            "# TYPE gman_db_pool_acquire_timeouts_total counter",
+            f"gman_db_pool_acquire_timeouts_total {health['timeouts']}",
+            "# TYPE gman_db_pool_longest_held_seconds gauge",
+            f"gman_db_pool_longest_held_seconds {health['longest_held']}",
+            "# TYPE gman_db_pool_acquire_wait_seconds histogram"
+        ]
+        return lines + metrics.histogram_lines("gman_db_pool_acquire_wait_seconds", self.acquire_wait)
+
+async def create_pool() -> Pool:
+    pool = Pool(await asyncpg.create_pool(bot_info.data['database'], init=init_connection, connection_class=Connection, **pool_options()))
+    metrics.register_collector(pool.prometheus_lines)
+    stats.pool = pool
+    return pool
@@ -0,0 +1,270 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+from pathlib import Path
+import bot_info
+import io_pool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Downloads kept on disk so the same URL isn't fetched again by every media command it goes through.
+# Files are stored once under their SHA-256 (blobs/<digest>), looked up by URL, revalidated with
+# ETag/Last-Modified and evicted least recently used first once they pass the size cap.
+# Callers get their own copy in their workspace: a reflink or hard link when the filesystem allows it.
+
+FICLONE = 0x40049409
+
+class DownloadFailed(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"Failed to download the file (HTTP {status}).")
+        self.status = status
+
+class Entry:
+    __slots__ = ("digest", "size", "mtime_ns", "suffix", "etag", "last_modified", "content_type", "content_disposition", "checked_at")
+
+    def __init__(self, digest: str, size: int, suffix: str = "", headers=None):
+        headers = headers or {}
+        self.digest = digest
+        self.size = size
+        self.mtime_ns = None
+        self.suffix = suffix
+        self.etag = headers.get("ETag")
+        self.last_modified = headers.get("Last-Modified")
+        self.content_type = headers.get("Content-Type")
+        self.content_disposition = headers.get("Content-Disposition")
+        self.checked_at = time.monotonic()
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Moves a new download into the blob store (or drops it when the blob exists) and returns the blob's mtime
+def _place(path: Path, blob: Path, duplicate: bool) -> int:
+    if duplicate:
+        os.unlink(path)
+    else:
+        os.replace(path, blob)
+        os.chmod(blob, 0o444)
+    return os.stat(blob).st_mtime_ns
+
+def _url_suffix(url: str) -> str:
+    return Path(url.split('?')[0]).suffix[1:]
+
+class DownloadCache:
+    def __init__(self, http, root: Path, max_size: int, revalidate_after: float, max_age: float):
+        self.http = http
+        self.root = root.resolve()
+        self.blob_dir = self.root / "blobs"
+        self.tmp_dir = self.root / "tmp"
+        self.max_size = max_size
+        self.revalidate_after = revalidate_after
+        # How long files without an ETag or Last-Modified (and yt-dlp downloads) are trusted
+        self.max_age = max_age
+        self.entries = {}
+        self.blobs = OrderedDict()
+        self.blob_urls = defaultdict(set)
+        self.size = 0
+        self.inflight = {}
+        self.results = Counter()
+        self.handoffs = Counter()
+        self.bytes_saved = 0
+        # Stores wait on the I/O pool, this keeps two of them from adding the same blob at once
+        self._store_lock = asyncio.Lock()
+
+    # The URL index only lives in memory, so files from a previous run can't be found again
+    async def sweep(self):
+        await io_pool.rmtree(self.root)
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    def _blob(self, digest: str) -> Path:
+        return self.blob_dir / digest
+
+    async def _drop_blob(self, digest: str):
+        size = self.blobs.pop(digest, None)
+        if size is not None:
+            self.size -= size
+        for url in self.blob_urls.pop(digest, ()):
+            self.entries.pop(url, None)
+        await io_pool.remove(self._blob(digest))
+
+    # A blob changed on disk (through a hard link) can't be trusted anymore
+    async def _intact(self, entry: Entry) -> bool:
+        try:
+            stat = await io_pool.run(os.stat, self._blob(entry.digest))
+        except FileNotFoundError:
+            await self._drop_blob(entry.digest)
+            return False
+        if stat.st_size != entry.size or stat.st_mtime_ns != entry.mtime_ns:
+            await self._drop_blob(entry.digest)
+            self.results["corrupt"] += 1
+            return False
+        return True
+
+    def _fresh(self, entry: Entry) -> bool:
+        age = time.monotonic() - entry.checked_at
+        if entry.etag or entry.last_modified:
+            return age < self.revalidate_after
+        return age < self.max_age
+
+    async def _store(self, url: str, entry: Entry, path: Path) -> Entry:
+        async with self._store_lock:
+            # Same content under another URL
+            duplicate = entry.digest in self.blobs
+            entry.mtime_ns = await io_pool.run(_place, path, self._blob(entry.digest), duplicate)
+            if duplicate:
+                self.results["deduplicated"] += 1
+            else:
+                self.blobs[entry.digest] = entry.size
+                self.size += entry.size
+            old = self.entries.get(url)
+            if old is not None and old.digest != entry.digest:
+                self.blob_urls[old.digest].discard(url)
+            self.entries[url] = entry
+            self.blob_urls[entry.digest].add(url)
+            self.blobs.move_to_end(entry.digest)
+            while self.size > self.max_size and len(self.blobs) > 1:
+                digest = next(iter(self.blobs))
+                await self._drop_blob(digest)
+                self.results["evicted"] += 1
+        return entry
+
+    async def _download(self, url: str, entry: Entry = None) -> tuple[Entry, bool]:
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        async with self.http.get(url, headers=headers) as resp:
+            if resp.status == 304 and entry is not None:
+                entry.checked_at = time.monotonic()
+                self.results["revalidated"] += 1
+                return entry, False
+            if resp.status != 200:
+                self.results["failed"] += 1
+                raise DownloadFailed(resp.status)
+            path = self.tmp_dir / uuid.uuid4().hex
+            try:
+                size = await self.http.save(resp, path)
+                digest = await io_pool.run(_hash_file, path)
+            except BaseException:
+                await io_pool.remove(path)
+                raise
+            self.results["miss"] += 1
+            return await self._store(url, Entry(digest, size, _url_suffix(url), resp.headers), path), True
+
+    # Returns the entry for url and whether the body had to be downloaded
+    async def _resolve(self, url: str, cached_only: bool) -> tuple[Entry, bool]:
+        entry = self.entries.get(url)
+        if entry is not None and not await self._intact(entry):
+            entry = None
+        if entry is not None and self._fresh(entry):
+            self.results["hit"] += 1
+            return entry, False
+        if cached_only:
+            return None, False
+        if entry is not None and not (entry.etag or entry.last_modified):
+            entry = None
+        return await self._download(url, entry)
+
+    def _forget_inflight(self, url: str, task: asyncio.Future):
+        if self.inflight.get(url) is task:
+            del self.inflight[url]
+
+    def _handoff(self, entry: Entry, dest: str) -> str:
+        source = self._blob(entry.digest)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(dest)
+        if fcntl is not None:
+            try:
+                with open(source, "rb") as src, open(dest, "wb") as dst:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return "reflink"
+            except OSError:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(dest)
+        try:
+            os.link(source, dest)
+            return "link"
+        except OSError:
+            shutil.copyfile(source, dest)
+            return "copy"
+
+    # Puts the file behind url at dest and returns its entry, downloading it only when needed.
+    # Concurrent fetches of the same URL share one download. Raises DownloadFailed for non-200 responses.
+    # With cached_only, returns None instead of going to the network.
+    async def fetch(self, url: str, dest: str, cached_only: bool = False) -> Entry:
+        for attempt in range(2):
+            task = self.inflight.get(url)
+            shared = task is not None
+            if task is None:
+                task = asyncio.ensure_future(self._resolve(url, cached_only))
+                if not cached_only:
+                    self.inflight[url] = task
+                    task.add_done_callback(lambda done: self._forget_inflight(url, done))
+            entry, downloaded = await asyncio.shield(task)
+            if entry is None:
+                return None
+            if shared:
+                self.results["shared"] += 1
+            if entry.digest in self.blobs:
+                self.blobs.move_to_end(entry.digest)
+            try:
+                mode = await io_pool.run(self._handoff, entry, str(dest))
+            except FileNotFoundError:
+                # Evicted between the lookup and the hand-off
+                await self._drop_blob(entry.digest)
+                continue
+            self.handoffs[mode] += 1
+            if shared or not downloaded:
+                self.bytes_saved += entry.size
+            return entry
+        raise FileNotFoundError(f"Couldn't keep {url} in the download cache")
+
+    # Adds a file downloaded some other way (yt-dlp) under its URL, the file itself is left in place
+    async def put(self, url: str, path: str) -> Entry:
+        path = Path(path)
+        tmp = self.tmp_dir / uuid.uuid4().hex
+        await io_pool.run(shutil.copyfile, path, tmp)
+        digest = await io_pool.run(_hash_file, tmp)
+        size = (await io_pool.run(os.stat, tmp)).st_size
+        return await self._store(url, Entry(digest, size, path.suffix[1:]), tmp)
+
+    def hit_rate(self) -> float:
+        hits = self.results["hit"] + self.results["revalidated"] + self.results["shared"]
+        return hits / (hits + self.results["miss"]) if hits + self.results["miss"] else 0.0
+
+    def summary(self) -> str:
+        return f"{self.size / 1024 ** 2:.1f}/{self.max_size / 1024 ** 2:.0f} MB in {len(self.blobs)} files for {len(self.entries)} URLs, hit rate {self.hit_rate() * 100:.0f}% ({self.results['hit']} hits, {self.results['revalidated']} revalidated, {self.results['miss']} misses), {self.bytes_saved / 1024 ** 2:.1f} MB not downloaded again, {self.results['evicted']} evicted"
+
+    def prometheus_lines(self) -> list[str]:
+        lines = [
+            "# TYPE gman_download_cache_bytes gauge",
+            f"gman_download_cache_bytes {self.size}",
+            "# TYPE gman_download_cache_files gauge",
+            f"gman_download_cache_files {len(self.blobs)}",
+            "# TYPE gman_download_cache_hit_ratio gauge",
+            f"gman_download_cache_hit_ratio {self.hit_rate()}",
+            "# TYPE gman_download_cache_lookups_total counter"
+        ]
+        lines += [f'gman_download_cache_lookups_total{{result="{result}"}} {count}' for result, count in sorted(self.results.items())]
+        lines += ["# TYPE gman_download_cache_saved_bytes_total counter", f"gman_download_cache_saved_bytes_total {self.bytes_saved}"]
+        lines.append("# TYPE gman_download_cache_handoffs_total counter")
+        lines += [f'gman_download_cache_handoffs_total{{mode="{mode}"}} {count}' for mode, count in sorted(self.handoffs.items())]
+        return lines
+
+def create(http, name: str) -> DownloadCache:
+    config = bot_info.data.get('download_cache', {})
+    root = Path(config.get('root', 'vids/cache')) / name
+    return DownloadCache(http, root, int(config.get('max_mb', 1024) * 1024 ** 2), config.get('revalidate_after', 300), config.get('max_age', 3600))
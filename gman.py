@@ -1,13 +1,30 @@
 import contextlib
 import io
 import textwrap
+import tracemalloc
 import bot_info
+import metrics
+import cache_policy
+import db
+import scheduler
+import job_queue
+import io_pool
+import profiler
+import memory
+import http_client
+import download_cache
+from loop_monitor import monitor as loop_monitor
+from workspace import workspaces, WorkspaceFull
 import datetime
 import time
 import psutil
 import logging
+import logging.handlers
+import queue
+import copy
+import json
 import colorlog
-import asyncpg
+import asyncio
 import discord
 from discord import app_commands
 from discord.ext import commands
@@ -15,31 +32,135 @@ from typing import Literal, Optional, Union
 import os
 import traceback
 import random
+from collections import Counter, OrderedDict
 
 
 uptime_start = datetime.datetime.now(datetime.timezone.utc)
 
-# If any videos were not deleted while the bot was last up, remove them
-vid_files = [f for f in os.listdir('vids') if os.path.isfile(os.path.join('vids', f))]
-for f in vid_files:
-    os.remove(f'vids/{f}')
+# Set by launcher.py when running as one cluster of a multi-process bot
+cluster_id = int(os.environ['GMAN_CLUSTER_ID']) if 'GMAN_CLUSTER_ID' in os.environ else None
+shard_ids = [int(i) for i in os.environ['GMAN_SHARD_IDS'].split(',')] if 'GMAN_SHARD_IDS' in os.environ else None
+shard_count = int(os.environ['GMAN_SHARD_COUNT']) if 'GMAN_SHARD_COUNT' in os.environ else bot_info.data.get('sharding', {}).get('shard_count')
+
+# If any videos were not deleted while the bot was last up, remove them (the launcher does this once for all clusters)
+def clean_vids():
+    for f in os.listdir('vids'):
+        if os.path.isfile(os.path.join('vids', f)):
+            os.remove(os.path.join('vids', f))
+
+# In-memory prefix cache so get_prefix doesn't hit the database for every message
+class PrefixCache:
+    channel = "gman_prefix_cache"
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.token = os.urandom(8).hex()
+        self.entries = {"user": OrderedDict(), "guild": OrderedDict()}
+        # When a table fully fits in the cache, a missing key means "no prefixes" and never needs a query
+        self.complete = {"user": False, "guild": False}
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self, pool):
+        async with pool.acquire() as conn:
+            user_rows = await conn.fetch("SELECT user_id, prefixes FROM user_prefixes LIMIT $1", self.max_size + 1)
+            guild_rows = await conn.fetch("SELECT guild_id, prefixes FROM guild_prefixes LIMIT $1", self.max_size + 1)
+        for kind, rows, id_field in (("user", user_rows, "user_id"), ("guild", guild_rows, "guild_id")):
+            self.entries[kind].clear()
+            for row in rows[:self.max_size]:
+                self.entries[kind][row[id_field]] = list(row["prefixes"] or [])
+            self.complete[kind] = len(rows) <= self.max_size
+
+    def get(self, kind: str, entity_id: int):
+        entries = self.entries[kind]
+        if entity_id in entries:
+            entries.move_to_end(entity_id)
+            self.hits += 1
+            return True, entries[entity_id]
+        if self.complete[kind]:
+            self.hits += 1
+            return True, []
+        self.misses += 1
+        return False, None
+
+    def set(self, kind: str, entity_id: int, prefixes):
+        entries = self.entries[kind]
+        prefixes = list(prefixes or [])
+        if not prefixes and self.complete[kind]:
+            entries.pop(entity_id, None)
+            return
+        entries[entity_id] = prefixes
+        entries.move_to_end(entity_id)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+            self.complete[kind] = False
+
+    # Lets other bot processes apply the same change to their caches
+    async def publish(self, conn, kind: str, entity_id: int, prefixes):
+        self.set(kind, entity_id, prefixes)
+        await conn.execute("SELECT pg_notify($1, $2)", self.channel, json.dumps({"token": self.token, "kind": kind, "id": entity_id, "prefixes": list(prefixes or [])}))
+
+    def _on_notify(self, connection, pid, channel, payload):
+        change = json.loads(payload)
+        if change["token"] != self.token:
+            self.set(change["kind"], change["id"], change["prefixes"])
+
+    def peek(self, kind: str, entity_id: int):
+        if entity_id in self.entries[kind]:
+            return self.entries[kind][entity_id]
+        return [] if self.complete[kind] else None
+
+    # Resolves prefixes without awaiting anything, returns None if the cache can't answer on its own
+    def resolve_cached(self, message: discord.Message) -> Optional[list]:
+        personal_prefixes = self.peek("user", message.author.id)
+        if personal_prefixes is None:
+            return None
+        if personal_prefixes or not message.guild:
+            return personal_prefixes or [bot_info.data['prefix']]
+        guild_prefixes = self.peek("guild", message.guild.id)
+        if guild_prefixes is None:
+            return None
+        return guild_prefixes or [bot_info.data['prefix']]
+
+    async def fetch(self, kind: str, entity_id: int):
+        found, prefixes = self.get(kind, entity_id)
+        if found:
+            return prefixes
+        async with bot.db.acquire() as conn:
+            statement = await db.prepared(conn, f"{kind}_prefixes")
+            prefixes = await statement.fetchval(entity_id)
+        self.set(kind, entity_id, prefixes)
+        return list(prefixes or [])
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 100.0
+        return f"{self.hits} hits / {self.misses} misses ({hit_rate:.1f}%), {len(self.entries['user'])} users, {len(self.entries['guild'])} guilds cached"
+
+
+prefix_cache = PrefixCache(bot_info.data.get('prefix_cache_size', 10000))
+# Counts where on_message stops processing a message
+dispatch_stats = Counter()
+
+def core_metrics() -> list[str]:
+    lines = [
+        "# TYPE gman_prefix_cache_hits_total counter",
+        f"gman_prefix_cache_hits_total {prefix_cache.hits}",
+        "# TYPE gman_prefix_cache_misses_total counter",
+        f"gman_prefix_cache_misses_total {prefix_cache.misses}",
+        "# TYPE gman_messages_total counter"
+    ]
+    lines += [f'gman_messages_total{{stage="{stage}"}} {count}' for stage, count in sorted(dispatch_stats.items())]
+    return lines
+
+metrics.register_collector(core_metrics)
 
 async def get_prefix(bot, message: discord.Message):
+    personal_prefixes = await prefix_cache.fetch("user", message.author.id)
     if not message.guild:
-        async with bot.db.acquire() as conn:
-            personal_prefixes = await conn.fetchval("SELECT prefixes from user_prefixes WHERE user_id = $1", message.author.id)
         return commands.when_mentioned_or(*(personal_prefixes or [bot_info.data['prefix']]))(bot, message)
-    
-    async with bot.db.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-SELECT (SELECT prefixes FROM user_prefixes WHERE user_id = $1) AS personal_prefixes,
-(SELECT prefixes FROM guild_prefixes WHERE guild_id = $2) AS guild_prefixes""",
-message.author.id, message.guild.id
-        )
-    
-    personal_prefixes = row["personal_prefixes"] or []
-    guild_prefixes = row["guild_prefixes"] or []
+
+    guild_prefixes = [] if personal_prefixes else await prefix_cache.fetch("guild", message.guild.id)
 
     all_prefixes = personal_prefixes or guild_prefixes or [bot_info.data['prefix']]
 
@@ -60,23 +181,125 @@ async def set_prefix(entity_id: int, prefix: str, is_guild: bool = True):
         if prefix not in current_prefixes:
             current_prefixes.append(prefix)
             await conn.execute(f"INSERT INTO {table} ({id_field}, prefixes) VALUES ($1, $2) ON CONFLICT ({id_field}) DO UPDATE SET prefixes = $2", entity_id, current_prefixes)
+            await prefix_cache.publish(conn, "guild" if is_guild else "user", entity_id, current_prefixes)
             return f"Added prefix `{prefix}` successfully."
         else:
             return f"Prefix `{prefix}` is already set."
 
 
 extensions = ['cogs.audio', 'cogs.help', 'cogs.caption', 'cogs.code', 'cogs.exif', 'cogs.ffmpeg', 'cogs.tutorial', 'cogs.imagemagick', 'cogs.ytdlp', 'cogs.info', 'cogs.ai', 'cogs.reminder', 'cogs.roblox', 'cogs.search', 'cogs.tags', 'cogs.media', 'cogs.moderation']
-bot = commands.Bot(command_prefix=get_prefix, case_insensitive=True, strip_after_prefix=True, status=discord.Status.online, activity=discord.Game(name=f"{bot_info.data['prefix']}help"), help_command=None, intents=discord.Intents.all(), allowed_mentions=discord.AllowedMentions(users=False, roles=False, everyone=False, replied_user=True))
+if shard_ids is not None or bot_info.data.get('sharding', {}).get('auto_shard', False):
+    bot = commands.AutoShardedBot(command_prefix=get_prefix, case_insensitive=True, strip_after_prefix=True, status=discord.Status.online, activity=discord.Game(name=f"{bot_info.data['prefix']}help"), help_command=None, allowed_mentions=discord.AllowedMentions(users=False, roles=False, everyone=False, replied_user=True), shard_ids=shard_ids, shard_count=shard_count, **cache_policy.build_options())
+else:
+    bot = commands.Bot(command_prefix=get_prefix, case_insensitive=True, strip_after_prefix=True, status=discord.Status.online, activity=discord.Game(name=f"{bot_info.data['prefix']}help"), help_command=None, allowed_mentions=discord.AllowedMentions(users=False, roles=False, everyone=False, replied_user=True), **cache_policy.build_options())
+bot.cluster_id = cluster_id
 
 
+# Writes one JSON object per line, including the structured fields attached to command logs
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+# The old human-readable command log blocks, built on the listener thread instead of the event loop
+class CommandLogFormatter(colorlog.ColoredFormatter):
+    def format(self, record):
+        fields = getattr(record, "fields", None)
+        if not fields or "command" not in fields:
+            return super().format(record)
+        record = logging.makeLogRecord(record.__dict__)
+        user = f"{fields['user_name']} (ID: {fields['user_id']})"
+        if fields.get("guild_id"):
+            guild = f"{fields['guild_name']} (ID: {fields['guild_id']})"
+            channel = f"{fields['channel_name']} (ID: {fields['channel_id']})"
+        else:
+            guild = "DMs"
+            channel = f"DMs with {user}"
+        lines = [
+            f"\n--- {record.msg} ---",
+            f"Timestamp: {datetime.datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S')}",
+            f"User: {user}",
+            f"Guild: {guild}",
+            f"Channel: {channel}",
+            f"Command: {fields['command']}",
+            f"Command Content: {fields['content']}"
+        ]
+        if "error" in fields:
+            lines.append(f"Error: {fields['error']}")
+        lines.append(f"--- End {record.msg} ---")
+        record.msg = "\n".join(lines)
+        record.args = None
+        return super().format(record)
+
+# Drops a share of the records marked as sampled (command success logs), per level
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = {logging.getLevelName(level.upper()): float(rate) for level, rate in rates.items()}
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+# Only copies the record, formatting happens on the listener thread
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
 def setup_logger():
-    log_format = "%(log_color)s%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+    config = bot_info.data.get('logging', {})
+    handlers = []
+    if config.get('console', True):
+        handler = logging.StreamHandler()
+        handler.setFormatter(CommandLogFormatter("%(log_color)s%(asctime)s - %(levelname)s - %(name)s - %(message)s"))
+        handlers.append(handler)
+    if config.get('file', 'logs/gman.jsonl'):
+        log_path = config.get('file', 'logs/gman.jsonl')
+        if cluster_id is not None:
+            # Each cluster rotates its own file, RotatingFileHandler can't be shared between processes
+            root, ext = os.path.splitext(log_path)
+            log_path = f"{root}-cluster{cluster_id}{ext}"
+        os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=config.get('max_bytes', 10 * 1024 * 1024), backupCount=config.get('backup_count', 5), encoding='utf-8')
+        handler.setFormatter(JsonLineFormatter())
+        handlers.append(handler)
+    queue_handler = LogQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(config.get('success_sample_rates', {})))
     logger = logging.getLogger()
-    handler = logging.StreamHandler()
-    formatter = colorlog.ColoredFormatter(log_format)
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    logger.addHandler(queue_handler)
     logger.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+def command_log_fields(ctx: commands.Context) -> dict:
+    fields = {
+        "user_id": ctx.author.id,
+        "user_name": f"{ctx.author.name}#{ctx.author.discriminator}",
+        "guild_id": ctx.guild.id if ctx.guild else None,
+        "guild_name": ctx.guild.name if ctx.guild else None,
+        "channel_id": ctx.channel.id,
+        "channel_name": getattr(ctx.channel, "name", None),
+        "command": ctx.command.qualified_name if ctx.command else "Unknown"
+    }
+    if ctx.interaction:
+        fields["content"] = f"/{ctx.interaction.command.qualified_name} " + " ".join(f"{k}:{v}" for k, v in ctx.interaction.namespace.__dict__.items() if v is not None)
+    else:
+        fields["content"] = ctx.message.content
+    return fields
 
 # Loads extensions, returns string saying what reloaded
 async def reload_extensions(exs):
@@ -92,56 +315,178 @@ async def reload_extensions(exs):
     return module_msg
 
 
+# Compiled access policy (global blocks, allow/blocklist and per-guild command permissions) so command checks are plain dict/set lookups
+class GuildCommandPolicy:
+    def __init__(self):
+        self.server = {}
+        self.targets = {}
+
+    def check(self, command_name: str, user_id: int, channel_id: int, role_ids: list, is_admin: bool) -> Optional[str]:
+        if is_admin:
+            return None
+        server_rule = self.server.get(command_name)
+        if server_rule and not server_rule[0]:
+            return f"Command blocked. This server disabled this command. Reason: `{server_rule[1]}`"
+        rules = self.targets.get(command_name)
+        if not rules:
+            return None
+        user_rule = rules.get(("user", user_id))
+        if user_rule and not user_rule[0]:
+            return f"Command blocked. You are part of the command blocklist. Reason: `{user_rule[1]}`"
+        channel_rule = rules.get(("channel", channel_id))
+        if channel_rule and not channel_rule[0]:
+            return f"Command blocked. This channel is part of the command blocklist. Reason: `{channel_rule[1]}`"
+        for role_id in role_ids:
+            role_rule = rules.get(("role", role_id))
+            if role_rule and not role_rule[0]:
+                return f"Command blocked. One of your roles is part of the command blocklist. Reason: `{role_rule[1]}`"
+        allow_rules = [(key, rule) for key, rule in rules.items() if rule[0]]
+        if not allow_rules:
+            return None
+        if ("user", user_id) in rules or ("channel", channel_id) in rules or any(("role", role_id) in rules for role_id in role_ids):
+            return None
+        return f"Command blocked. Either you, this channel, or one of your roles are not part of the allowlist. Reason: `{allow_rules[-1][1][1]}`"
+
+
+class AccessPolicy:
+    channel = "gman_access_policy"
+    sections = ("global_users", "global_servers", "allowlist", "blocklist")
+
+    def __init__(self):
+        self.pool = None
+        self.listener = None
+        self.token = os.urandom(8).hex()
+        self._tasks = set()
+        self.global_users = {}
+        self.global_servers = {}
+        self.allowlist = {}
+        self.blocklist = {}
+        self.guilds = {}
+
+    async def start(self, pool):
+        self.pool = pool
+        await self.load_all()
+        if self.listener is not None:
+            await self.listener.close()
+        self.listener = db.Listener(bot_info.data['database'])
+        await self.listener.listen(self.channel, self._on_notify, self.load_all)
+        await self.listener.start()
+
+    async def load_all(self):
+        async with self.pool.acquire() as conn:
+            for section in self.sections:
+                await self._load_section(conn, section)
+            await self._load_guilds(conn)
+
+    async def _load_section(self, conn, section: str):
+        if section == "global_users":
+            rows = await conn.fetch("SELECT discord_id, reason FROM global_blocked_users")
+            self.global_users = {row["discord_id"]: row["reason"] for row in rows}
+        elif section == "global_servers":
+            rows = await conn.fetch("SELECT guild_id, reason FROM global_blocked_servers")
+            self.global_servers = {row["guild_id"]: row["reason"] for row in rows}
+        elif section == "allowlist":
+            rows = await conn.fetch("SELECT type, entity_id, reason FROM allowlist")
+            self.allowlist = {(row["type"], row["entity_id"]): row["reason"] for row in rows}
+        elif section == "blocklist":
+            rows = await conn.fetch("SELECT type, entity_id, reason FROM blocklist")
+            self.blocklist = {(row["type"], row["entity_id"]): row["reason"] for row in rows}
+
+    async def _load_guilds(self, conn, guild_id: int = None):
+        if guild_id is None:
+            server_rows = await conn.fetch("SELECT guild_id, command_name, status, reason FROM server_command_permissions")
+            target_rows = await conn.fetch("SELECT guild_id, command_name, target_type, target_id, status, reason FROM command_permissions ORDER BY id")
+            guilds = {}
+        else:
+            server_rows = await (await db.prepared(conn, "guild_server_permissions")).fetch(guild_id)
+            target_rows = await (await db.prepared(conn, "guild_command_permissions")).fetch(guild_id)
+            guilds = {guild_id: GuildCommandPolicy()}
+        for row in server_rows:
+            policy = guilds.setdefault(row["guild_id"], GuildCommandPolicy())
+            policy.server[row["command_name"]] = (row["status"], row["reason"])
+        for row in target_rows:
+            policy = guilds.setdefault(row["guild_id"], GuildCommandPolicy())
+            policy.targets.setdefault(row["command_name"], {})[(row["target_type"], row["target_id"])] = (row["status"], row["reason"])
+        if guild_id is None:
+            self.guilds = guilds
+        elif guilds[guild_id].server or guilds[guild_id].targets:
+            self.guilds[guild_id] = guilds[guild_id]
+        else:
+            self.guilds.pop(guild_id, None)
+
+    async def reload(self, section: str, guild_id: int = None, notify: bool = True):
+        async with self.pool.acquire() as conn:
+            if section == "guild":
+                await self._load_guilds(conn, guild_id)
+            else:
+                await self._load_section(conn, section)
+            if notify:
+                await conn.execute("SELECT pg_notify($1, $2)", self.channel, f"{self.token}:{section}:{guild_id or ''}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        token, section, guild_id = payload.split(":")
+        if token == self.token:
+            return
+        task = asyncio.get_running_loop().create_task(self.reload(section, int(guild_id) if guild_id else None, notify=False))
+        self._tasks.add(task)
+        task.add_done_callback(self._reload_done)
+
+    def _reload_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.getLogger().error(f"Failed to reload access policy after a change in another process: {task.exception()}")
+
+    def check_global(self, user_id: int, guild_id: Optional[int]) -> Optional[tuple[str, str]]:
+        if user_id in self.global_users:
+            return f"You are globally blocked from using G-Man. Reason: `{self.global_users[user_id]}`", "User is globally blocked."
+        if guild_id and guild_id in self.global_servers:
+            return f"This server is globally blocked from using G-Man. Reason: `{self.global_servers[guild_id]}`", "Server is globally blocked."
+        return None
+
+    def check_lists(self, user_id: int, channel_id: int, role_ids: list) -> Optional[tuple[str, str]]:
+        keys = [("user", user_id), ("channel", channel_id)] + [("role", role_id) for role_id in role_ids]
+        if self.allowlist:
+            if any(key in self.allowlist for key in keys):
+                return None
+            return "You, this channel, or one of your roles are not part of the allowlist.", "User/Channel/Role is not allowed."
+        for key in keys:
+            if key in self.blocklist:
+                return f"You, this channel, or one of your roles are part of the blocklist. Reason: `{self.blocklist[key]}`", "User/Channel/Role is blocked."
+        return None
+
+    def check_command(self, guild_id: int, command_name: str, user_id: int, channel_id: int, role_ids: list, is_admin: bool) -> Optional[str]:
+        policy = self.guilds.get(guild_id)
+        if policy is None:
+            return None
+        return policy.check(command_name, user_id, channel_id, role_ids, is_admin)
+
+
+access_policy = AccessPolicy()
+
+
 @bot.check
 async def global_permissions_check(ctx: commands.Context):
+    metrics.begin(ctx)
+    scheduler.set_owner_from_ctx(ctx)
     if ctx.author.id in bot_info.data['owners']:
         return True
-    return await command_permission_check(ctx)
+    with metrics.phase("access_check"):
+        return await command_permission_check(ctx)
 
 async def command_permission_check(ctx: commands.Context) -> bool:
+    if not ctx.guild:
+        return True
     try:
         is_admin = ctx.author.guild_permissions.administrator
         role_ids = [role.id for role in ctx.author.roles]
     except AttributeError:
         is_admin = False
         role_ids = []
-    guild_id = ctx.guild.id if ctx.guild else None
-    if guild_id:
-        async with bot.db.acquire() as conn:
-            server_query = "SELECT status, reason FROM server_command_permissions WHERE guild_id = $1 AND command_name = $2"
-            server_result = await conn.fetchrow(server_query, ctx.guild.id, ctx.command.name)
-            if server_result:
-                if not server_result["status"] and not is_admin:
-                    await ctx.send(f"Command blocked. This server disabled this command. Reason: `{server_result['reason']}`")
-                    return False
-            block_query = "SELECT status, target_type, reason FROM command_permissions WHERE guild_id = $1 AND command_name = $2 AND ((target_type = 'user' AND target_id = $3) OR (target_type = 'channel' AND target_id = $4) OR (target_type = 'role' AND target_id = ANY($5::BIGINT[])))"
-            block_result = await conn.fetch(block_query, ctx.guild.id, ctx.command.name, ctx.author.id, ctx.channel.id, role_ids)
-            for row in block_result:
-                if not row["status"] and not is_admin:
-                    if row["target_type"] == "user":
-                        await ctx.send(f"Command blocked. You are part of the command blocklist. Reason: `{row['reason']}`")
-                    elif row["target_type"] == "channel":
-                        await ctx.send(f"Command blocked. This channel is part of the command blocklist. Reason: `{row['reason']}`")
-                    elif row["target_type"] == "role":
-                        await ctx.send(f"Command blocked. One of your roles is part of the command blocklist. Reason: `{row['reason']}`")
-                    return False
-            allow_query = "SELECT status, target_type, target_id, reason FROM command_permissions WHERE guild_id = $1 AND command_name = $2 AND status = TRUE"
-            allow_result = await conn.fetch(allow_query, ctx.guild.id, ctx.command.name)
-            if allow_result:
-                allowed = False
-                for row in allow_result:
-                    if row["target_type"] == "user" and ctx.author.id == row["target_id"]:
-                        allowed = True
-                    elif row["target_type"] == "channel" and ctx.channel.id == row["target_id"]:
-                        allowed = True
-                    elif row["target_type"] == "role" and row["target_id"] in role_ids:
-                        allowed = True
-                if not allowed and not is_admin:
-                    await ctx.send(f"Command blocked. Either you, this channel, or one of your roles are not part of the allowlist. Reason: `{row['reason']}`")
-                    return False
-        return True
-    else:
-        return True
+    denied = access_policy.check_command(ctx.guild.id, ctx.command.name, ctx.author.id, ctx.channel.id, role_ids, is_admin)
+    if denied:
+        await ctx.send(denied)
+        return False
+    return True
 
 @bot.before_invoke
 async def check_access(ctx: commands.Context):
@@ -152,103 +497,143 @@ async def check_access(ctx: commands.Context):
         is_admin = False
         roles = []
     user_id = ctx.author.id
-    channel_id = ctx.channel.id
     guild_id = ctx.guild.id if ctx.guild else None
-    async with bot.db.acquire() as conn:
-        global_blocked = await conn.fetchval("SELECT reason FROM global_blocked_users WHERE discord_id = $1", user_id)
-        if global_blocked:
-            await ctx.send(f"You are globally blocked from using G-Man. Reason: `{global_blocked}`")
-            raise commands.CheckFailure("User is globally blocked.")
-        if guild_id:
-            server_blocked = await conn.fetchval("SELECT reason FROM global_blocked_servers WHERE guild_id = $1", guild_id)
-            if server_blocked:
-                await ctx.send(f"This server is globally blocked from using G-Man. Reason: `{server_blocked}`")
-                raise commands.CheckFailure("Server is globally blocked.")
-        if str(user_id) in bot_info.data['owners']:
-            return
-        if is_admin:
-            return
-        allowlist_active = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM allowlist)")
-        if allowlist_active:
-            is_allowed = await conn.fetchval("SELECT 1 FROM allowlist WHERE (type = 'user' AND entity_id = $1) OR (type = 'channel' AND entity_id = $2) OR (type = 'role' AND entity_id = ANY($3))", user_id, channel_id, roles)
-            if not is_allowed:
-                await ctx.send("You, this channel, or one of your roles are not part of the allowlist.")
-                raise commands.CheckFailure("User/Channel/Role is not allowed.")
-            if is_allowed:
-                return
-        blocked = await conn.fetchval("SELECT reason FROM blocklist WHERE (type = 'user' AND entity_id = $1) OR (type = 'channel' AND entity_id = $2) OR (type = 'role' AND entity_id = ANY($3))", user_id, channel_id, roles)
-        if blocked:
-            await ctx.send(f"You, this channel, or one of your roles are part of the blocklist. Reason: `{blocked}`")
-            raise commands.CheckFailure("User/Channel/Role is blocked.")
+    metrics.begin(ctx)
+    with metrics.phase("access_check"):
+        denied = access_policy.check_global(user_id, guild_id)
+        if denied is None and str(user_id) not in bot_info.data['owners'] and not is_admin:
+            denied = access_policy.check_lists(user_id, ctx.channel.id, roles)
+        if denied:
+            message, reason = denied
+            await ctx.send(message)
+            raise commands.CheckFailure(reason)
     
     
     
     
-# Set up stuff
-@bot.event
-async def on_ready():
-    logger = logging.getLogger()
-    global extensions
+# Times import plus setup together: load_extension always executes the module itself, and heavy
+# libraries are already deferred through lazy_imports (importtime.py breaks imports down further)
+async def load_extension_timed(ex: str) -> tuple:
+    start = time.perf_counter()
     try:
-        logger.info(await reload_extensions(extensions))
+        if ex in bot.extensions:
+            await bot.unload_extension(ex)
+        await bot.load_extension(ex)
     except Exception as e:
-        logger.error(f"Error reloading extensions: {e}")
+        return ex, time.perf_counter() - start, f"failed: {e}"
+    return ex, time.perf_counter() - start, "ok"
+
+def format_startup_table(rows: list, total: float) -> str:
+    lines = ["Startup timings:", f"{'Step':<24} {'Time':>10}  Status"]
+    for name, elapsed, status in rows:
+        lines.append(f"{name:<24} {elapsed * 1000:>8.1f}ms  {status}")
+    lines.append(f"Total: {total:.2f}s")
+    return "\n".join(lines)
+
+# Set up stuff, runs once before connecting (on_ready runs again on every reconnect)
+@bot.event
+async def setup_hook():
+    logger = logging.getLogger()
+    startup_start = time.perf_counter()
+    loop_monitor.start()
+    rows = []
+    start = time.perf_counter()
+    bot.http_client = http_client.HTTPClient()
+    metrics.register_collector(bot.http_client.prometheus_lines)
+    bot.download_cache = download_cache.create(bot.http_client, f"cluster-{cluster_id}" if cluster_id is not None else "main")
+    metrics.register_collector(bot.download_cache.prometheus_lines)
+    if cluster_id is None:
+        await io_pool.run(clean_vids)
+    # Each cluster only sweeps its own workspace root
+    await workspaces.sweep()
+    await bot.download_cache.sweep()
+    rows.append(("scratch cleanup", time.perf_counter() - start, "ok"))
+    start = time.perf_counter()
     try:
-        bot.db = await asyncpg.create_pool(bot_info.data['database'])
+        bot.db = await db.create_pool()
+        # Cogs that used to create their own pool (Tags reads bot.pool) share this one
+        bot.pool = bot.db
         logger.info(f"Connected to PostgreSQL database via {bot_info.data['database']}")
+        rows.append(("database pool", time.perf_counter() - start, "ok"))
+        start = time.perf_counter()
+        await prefix_cache.load(bot.db)
+        logger.info(f"Loaded prefix cache: {prefix_cache.stats()}")
+        await access_policy.start(bot.db)
+        await access_policy.listener.listen(PrefixCache.channel, prefix_cache._on_notify, lambda: prefix_cache.load(bot.db))
+        # Cogs add their own NOTIFY channels to the same connection (db.Listener.listen)
+        bot.db_listener = access_policy.listener
+        logger.info(f"Loaded access policy: {len(access_policy.global_users)} global user blocks, {len(access_policy.global_servers)} server blocks, {len(access_policy.allowlist)} allowlist and {len(access_policy.blocklist)} blocklist entries, command permissions for {len(access_policy.guilds)} guilds")
+        rows.append(("prefixes/access policy", time.perf_counter() - start, "ok"))
+        if job_queue.enabled():
+            bot.job_queue = job_queue.JobQueue(bot.db)
+            await bot.job_queue.start()
+            logger.info(f"Sending media jobs to workers through {job_queue.scratch_dir()}")
     except Exception as e:
+        rows.append(("database pool", time.perf_counter() - start, f"failed: {e}"))
         logger.error(f"Error connecting to PostgreSQL database: {e}")
+    for ex in extensions:
+        rows.append(await load_extension_timed(ex))
+    bot.startup_timings = rows
+    logger.info(format_startup_table(rows, time.perf_counter() - startup_start))
+
+@bot.event
+async def on_ready():
+    logger = logging.getLogger()
     logger.info(f"Bot {bot.user.name} has successfully logged in via Token {bot_info.data['login']}. ID: {bot.user.id}")
     logger.info(f"Bot {bot.user.name} is in {len(bot.guilds)} guilds, caching a total of {sum(1 for _ in bot.get_all_channels())} channels and {len(bot.users)} users.")
     logger.info(f"Bot {bot.user.name} has a total of {len(bot.commands)} commands with {len(bot.cogs)} cogs.")
+    metrics_config = bot_info.data.get('metrics', {})
+    if metrics_config.get('port', 9100):
+        try:
+            await metrics.start_server(metrics_config.get('host', '127.0.0.1'), metrics_config.get('port', 9100) + (cluster_id or 0))
+        except OSError as e:
+            logger.error(f"Error starting metrics server: {e}")
 
 
 @bot.event
 async def on_message(message):
-    ctx = await bot.get_context(message)
+    dispatch_stats["messages"] += 1
+    if message.author.bot:
+        dispatch_stats["bot_author"] += 1
+        return
 
+    prefixes = prefix_cache.resolve_cached(message)
+    if prefixes is not None and not message.content.startswith(tuple(commands.when_mentioned_or(*prefixes)(bot, message))):
+        dispatch_stats["no_prefix"] += 1
+        return
+
+    ctx = await bot.get_context(message)
+    if ctx.prefix is None:
+        dispatch_stats["no_prefix"] += 1
+        return
     if ctx.command is None:
+        dispatch_stats["unknown_command"] += 1
         return
-    
-    await bot.process_commands(message)
+
+    dispatch_stats["dispatched"] += 1
+    await bot.invoke(ctx)
 
 
 @bot.event
 async def on_command(ctx: commands.Context):
     logger = logging.getLogger()
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user = f"{ctx.author.name}#{ctx.author.discriminator} (ID: {ctx.author.id})"
-    guild = f"{ctx.guild.name} (ID: {ctx.guild.id})" if ctx.guild else "DMs"
-    channel = f"{ctx.channel.name} (ID: {ctx.channel.id})" if ctx.guild else f"DMs with {ctx.author.name}#{ctx.author.discriminator} (ID: {ctx.author.id})"
-    command_name = ctx.command.qualified_name
-    command_content = ctx.message.content if not ctx.interaction else "".join(f"/{ctx.interaction.command.qualified_name} " + " ".join(f"{k}:{v}" for k, v in ctx.interaction.namespace.__dict__.items() if v is not None))
-    log_message = (
-        f"\n--- Command Log ---\n"
-        f"Timestamp: {timestamp}\n"
-        f"User: {user}\n"
-        f"Guild: {guild}\n"
-        f"Channel: {channel}\n"
-        f"Command: {command_name}\n"
-        f"Command Content: {command_content}\n"
-        f"--- End Command Log ---"
-    )
-    logger.info(log_message)
+    metrics.count_invocation(ctx.command.qualified_name)
+    logger.info("Command Log", extra={"fields": {"event": "command", **command_log_fields(ctx)}})
 
 # Command error
 @bot.event
 async def on_command_error(ctx: commands.Context, error):
     logger = logging.getLogger()
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user = f"{ctx.author.name}#{ctx.author.discriminator} (ID: {ctx.author.id})"
-    guild = f"{ctx.guild.name} (ID: {ctx.guild.id})" if ctx.guild else "DMs"
-    channel = f"{ctx.channel.name} (ID: {ctx.channel.id})" if ctx.guild else f"DMs with {ctx.author.name}#{ctx.author.discriminator} (ID: {ctx.author.id})"
-    command_name = ctx.command.qualified_name if ctx.command else "Unknown"
-    command_content = ctx.message.content if not ctx.interaction else "".join(f"/{ctx.interaction.command.qualified_name} " + " ".join(f"{k}:{v}" for k, v in ctx.interaction.namespace.__dict__.items() if v is not None))
-    logger.error(f"\n--- Command Error Log ---\nTimestamp: {timestamp}\nUser: {user}\nGuild: {guild}\nChannel: {channel}\nCommand: {command_name}\nCommand Content: {command_content}\nError: {error}\n--- End Command Error Log ---")
+    fields = command_log_fields(ctx)
+    command_name = fields["command"]
+    logger.error("Command Error Log", extra={"fields": {"event": "command_error", **fields, "error": str(error)}})
     embed = discord.Embed(title=":warning: Command Error", color=discord.Color.red(), timestamp=discord.utils.utcnow())
     embed.set_author(name=f"{ctx.author.name}#{ctx.author.discriminator}", icon_url=ctx.author.display_avatar.url, url=f"https://discord.com/users/{ctx.author.id}")
     if isinstance(error, commands.CheckFailure):
+        dispatch_stats["blocked"] += 1
+        metrics.finish(ctx, "blocked")
         return
+    metrics.finish(ctx, "error")
     if isinstance(error, commands.MissingRequiredArgument):
         logger.warning(f"Missing required argument for command {ctx.command.qualified_name}: {ctx.message.content} ({error.param.name} is required)")
         embed.description = f"Missing required argument: `{error.param.name}`"
@@ -259,26 +644,26 @@ async def on_command_error(ctx: commands.Context, error):
         embed.description = f"Bad argument: `{error}`"
         await ctx.send(embed=embed)
         return
+    if isinstance(error, commands.CommandInvokeError) and isinstance(error.original, WorkspaceFull):
+        logger.warning(f"Scratch disk full for command {ctx.command.qualified_name}: {await workspaces.summary()}")
+        embed.description = str(error.original)
+        await ctx.send(embed=embed)
+        return
     if isinstance(error, commands.MissingPermissions):
         logger.warning(f"Missing permissions for command {ctx.command.qualified_name}: {ctx.message.content} ({error})")
         embed.description = f"`{command_name}` requires the following permissions: `{', '.join(error.missing_permissions).capitalize()}`"
         await ctx.send(embed=embed)
         return
     else:
-        logger.critical(f"An unexpected error occurred: {traceback.format_exception(type(error), error, error.__traceback__)}")
+        logger.critical("An unexpected error occurred", exc_info=(type(error), error, error.__traceback__))
         embed.description = f"An unexpected error occurred: {error}"
     await ctx.send(embed=embed)
     
 @bot.event
 async def on_command_completion(ctx: commands.Context):
     logger = logging.getLogger()
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    user = f"{ctx.author.name}#{ctx.author.discriminator} (ID: {ctx.author.id})"
-    guild = f"{ctx.guild.name} (ID: {ctx.guild.id})" if ctx.guild else "DMs"
-    channel = f"{ctx.channel.name} (ID: {ctx.channel.id})" if ctx.guild else f"DMs with {ctx.author.name}#{ctx.author.discriminator} (ID: {ctx.author.id})"
-    command_name = ctx.command.qualified_name
-    command_content = ctx.message.content if not ctx.interaction else "".join(f"/{ctx.interaction.command.qualified_name} " + " ".join(f"{k}:{v}" for k, v in ctx.interaction.namespace.__dict__.items() if v is not None))
-    logger.info(f"\n--- Command Success ---\nTimestamp: {timestamp}\nUser: {user}\nGuild: {guild}\nChannel: {channel}\nCommand: {command_name}\nCommand Content: {command_content}\n--- End Command Success ---")
+    metrics.finish(ctx)
+    logger.info("Command Success", extra={"fields": {"event": "command_success", **command_log_fields(ctx)}, "sampled": True})
 
 @bot.event
 async def on_guild_join(guild):
@@ -321,9 +706,122 @@ async def ping(ctx: commands.Context):
     memory_usage = round(memory_info.used / (1024 ** 2))
     memory_total = round(memory_info.total / (1024 ** 2))
 
-    content = f"Pong!\nGateway: {ws_latency}ms\nAPI: {api_response_time}ms\nUptime: {days}d {hours}h {minutes}m {seconds}s\nCPU Usage: {cpu_usage}%\nMemory Usage: {memory_usage} MB / {memory_total} MB"
+    content = f"Pong!\nGateway: {ws_latency}ms\nAPI: {api_response_time}ms\nUptime: {days}d {hours}h {minutes}m {seconds}s\nCPU Usage: {cpu_usage}%\nMemory Usage: {memory_usage} MB / {memory_total} MB\nPrefix Cache: {prefix_cache.stats()}\nMessages: {dispatch_stats['messages']} seen, {dispatch_stats['dispatched']} dispatched, {dispatch_stats['no_prefix']} without prefix, {dispatch_stats['unknown_command']} unknown commands, {dispatch_stats['blocked']} blocked"
+    if hasattr(bot, 'db'):
+        content += f"\nDatabase Pool: {bot.db.summary()}"
+    content += f"\nJobs: {scheduler.jobs.summary()}"
+    content += f"\nScratch Disk: {await workspaces.summary()}"
+    content += f"\nHTTP: {bot.http_client.summary()}"
+    content += f"\nDownload Cache: {bot.download_cache.summary()}"
+    content += f"\nEvent Loop: {loop_monitor.summary()}"
+    content += f"\nI/O Pool: {io_pool.pool.summary()}"
+    if hasattr(bot, 'job_queue'):
+        content += f"\nMedia Workers: {bot.job_queue.summary()}"
+    tags_cog = bot.get_cog("Tags")
+    if tags_cog is not None:
+        content += f"\nTag Cache: {tags_cog.tag_cache.summary()}"
+    if isinstance(bot, commands.AutoShardedBot):
+        shard_guilds = Counter(guild.shard_id for guild in bot.guilds)
+        content += f"\nCluster: {bot.cluster_id if bot.cluster_id is not None else 'single'}, shard {ctx.guild.shard_id if ctx.guild else 0} of {bot.shard_count}"
+        content += "".join(f"\nShard {shard_id}: {round(latency * 1000)}ms, {shard_guilds[shard_id]} guilds" for shard_id, latency in bot.latencies)
+
+    await message.edit(content=content[:2000])
+
+
+@bot.command(name="stats", description="Show the slowest commands.")
+@bot_info.is_owner()
+async def stats(ctx: commands.Context, limit: int = 10):
+    rows = metrics.slowest(limit)
+    if not rows:
+        await ctx.send("No commands have finished yet.")
+        return
+    lines = [f"{'Command':<20} {'Runs':>6} {'Errs':>5} {'Avg':>8} {'p95':>8}  Phases (avg)"]
+    for row in rows:
+        phases = ", ".join(f"{name} {elapsed * 1000:.0f}ms" for name, elapsed in row["phases"].items())
+        lines.append(f"{row['command'][:20]:<20} {row['count']:>6} {row['errors']:>5} {row['avg'] * 1000:>6.0f}ms {row['p95'] * 1000:>6.0f}ms  {phases}")
+    table = "\n".join(lines)[:1980]
+    await ctx.send(f"```\n{table}\n```")
+
+
+@bot.command(name="dbstats", description="Show which queries take the most database time.")
+@bot_info.is_owner()
+async def dbstats(ctx: commands.Context, limit: int = 10):
+    if not db.stats.statements:
+        await ctx.send("No queries have run yet.")
+        return
+    report = db.stats.report(limit)
+    if len(report) > 1980:
+        await ctx.send(file=discord.File(io.BytesIO(report.encode()), filename="dbstats.txt"))
+    else:
+        await ctx.send(f"```\n{report}\n```")
+
+
+@bot.command(name="profile", description="Profile one run of a command.")
+@bot_info.is_owner()
+async def profile_command(ctx: commands.Context, *, command: str):
+    mode = "sample"
+    if command.startswith("--cprofile "):
+        mode = "cprofile"
+        command = command[len("--cprofile "):].strip()
+    message = copy.copy(ctx.message)
+    message.content = f"{ctx.prefix}{command}"
+    profiled_ctx = await bot.get_context(message)
+    if profiled_ctx.command is None:
+        await ctx.send(f"`{command.split()[0] if command else command}` isn't a command.")
+        return
+    result, elapsed = await profiler.profile(bot.invoke(profiled_ctx), mode)
+    name = profiled_ctx.command.qualified_name.replace(" ", "-")
+    files = [
+        discord.File(io.BytesIO(result.table().encode()), filename=f"profile-{name}.txt"),
+        discord.File(io.BytesIO(result.collapsed().encode()), filename=f"profile-{name}.collapsed.txt")
+    ]
+    await ctx.send(f"Profiled `{profiled_ctx.command.qualified_name}` ({mode}), took {elapsed:.2f}s. The `.collapsed.txt` file opens in speedscope or flamegraph.pl.", files=files)
+
 
-    await message.edit(content=content)
+@bot.command(name="memoryreport", description="Show memory usage and cache sizes.", aliases=["memreport"])
+@bot_info.is_owner()
+async def memoryreport(ctx: commands.Context):
+    rss = psutil.Process().memory_info().rss / (1024 ** 2)
+    guild_count = len(bot.guilds)
+    cached_members = sum(len(guild.members) for guild in bot.guilds)
+    total_members = sum(guild.member_count or 0 for guild in bot.guilds)
+    chunked = sum(1 for guild in bot.guilds if guild.chunked)
+    embed = discord.Embed(title="Memory Report", color=discord.Color.blurple(), timestamp=discord.utils.utcnow())
+    embed.add_field(name="Cache Profile", value=f"`{cache_policy.profile_name()}` (intents: `{bot.intents.value}`, max messages: `{bot._connection.max_messages}`)", inline=False)
+    embed.add_field(name="RSS", value=f"{rss:.1f} MB", inline=True)
+    embed.add_field(name="RSS per Guild", value=f"{rss / guild_count:.3f} MB" if guild_count else "N/A", inline=True)
+    embed.add_field(name="Guilds", value=f"{guild_count} ({chunked} chunked)", inline=True)
+    embed.add_field(name="Members", value=f"{cached_members} cached of {total_members}", inline=True)
+    embed.add_field(name="Users", value=f"{len(bot.users)} cached", inline=True)
+    embed.add_field(name="Messages", value=f"{len(bot.cached_messages)} cached", inline=True)
+    caches = "\n".join(f"`{row['name']}`: {row['entries']} entries, ~{row['bytes'] / 1024:.1f} KiB" for row in memory.report())
+    embed.add_field(name="Caches", value=caches[:1024] or "None registered", inline=False)
+    await ctx.send(embed=embed)
+
+
+@bot.command(name="tracemalloc", description="Take tracemalloc snapshots to find memory leaks.")
+@bot_info.is_owner()
+async def tracemalloc_command(ctx: commands.Context, action: Literal["start", "snapshot", "diff", "stop"], frames: int = 10):
+    if action == "start":
+        memory.tracemalloc_start(frames)
+        await ctx.send(f"Tracing allocations with {frames} frames. Use `snapshot` for a baseline, then `diff` later to see what grew.")
+        return
+    if action == "stop":
+        memory.tracemalloc_stop()
+        await ctx.send("Stopped tracing allocations.")
+        return
+    if not tracemalloc.is_tracing():
+        await ctx.send("Tracing isn't running, use `start` first.")
+        return
+    lines = memory.snapshot() if action == "snapshot" else memory.diff()
+    if not lines:
+        await ctx.send("No snapshot to compare with yet, this one is the baseline now.")
+        return
+    text = "\n".join(lines)
+    if len(text) > 1980:
+        await ctx.send(file=discord.File(io.BytesIO(text.encode()), filename=f"tracemalloc-{action}.txt"))
+    else:
+        await ctx.send(f"```\n{text}\n```")
 
 
 @bot.command(name="sync", description="Sync slash commands.")
@@ -396,6 +894,7 @@ async def command_permission(
         
         async with bot.db.acquire() as conn:
             await conn.execute(query, *params)
+        await access_policy.reload("guild", ctx.guild.id)
         
         await ctx.send(f"Command `{command}` has been {action} server-wide. Reason: `{reason}`")
         return
@@ -430,6 +929,7 @@ async def command_permission(
 
     async with bot.db.acquire() as conn:
         await conn.execute(query, *params)
+    await access_policy.reload("guild", ctx.guild.id)
 
     await ctx.send(f"Command `{command}` has been {action} for {target_type} {target_obj}. Reason: `{reason}`")
 
@@ -444,6 +944,7 @@ async def command_clear(ctx: commands.Context, command: str, target_type: str):
                 if result == "DELETE 0":
                     await ctx.send(f"No server-wide command permissions found for command `{command}`.")
                 else:
+                    await access_policy.reload("guild", ctx.guild.id)
                     await ctx.send(f"Server-wide command permissions for command `{command}` have been cleared.")
         except Exception as e:
             await ctx.send(f"Error clearing server-wide command permissions: {e}")
@@ -455,6 +956,7 @@ async def command_clear(ctx: commands.Context, command: str, target_type: str):
             if result == "DELETE 0":
                 await ctx.send(f"No command permissions found for command `{command}` for {target_type}.")
             else:
+                await access_policy.reload("guild", ctx.guild.id)
                 await ctx.send(f"Command permissions for command `{command}` have been cleared for {target_type}.")
     except Exception as e:
         await ctx.send(f"Error clearing command permissions: {e}")
@@ -580,12 +1082,12 @@ async def blocklist(ctx: commands.Context):
             entity_id = record['entity_id']
             entity_type = record['type']
             reason = record['reason']
-            added_by_user = ctx.guild.get_member(record['added_by'])
+            added_by_user = await cache_policy.get_member(ctx.guild, record['added_by'])
             added_by_name_unknown = await bot.fetch_user(record['added_by'])
             added_by_name = added_by_user.mention if added_by_user else added_by_name_unknown.mention
             added_at = f"<t:{int(record['added_at'].timestamp())}:R>"
             if entity_type == "user":
-                user = ctx.guild.get_member(entity_id)
+                user = await cache_policy.get_member(ctx.guild, entity_id)
                 entity_name = f"{user.name}#{user.discriminator} ({user.mention})" if user else entity_id
             elif entity_type == "channel":
                 channel = ctx.guild.get_channel(entity_id)
@@ -620,12 +1122,12 @@ async def allowlist(ctx: commands.Context):
             entity_id = record['entity_id']
             entity_type = record['type']
             reason = record['reason']
-            added_by_user = ctx.guild.get_member(record['added_by'])
+            added_by_user = await cache_policy.get_member(ctx.guild, record['added_by'])
             added_by_name_unknown = await bot.fetch_user(record['added_by'])
             added_by_name = added_by_user.mention if added_by_user else added_by_name_unknown.mention
             added_at = f"<t:{int(record['added_at'].timestamp())}:R>"
             if entity_type == "user":
-                user = ctx.guild.get_member(entity_id)
+                user = await cache_policy.get_member(ctx.guild, entity_id)
                 entity_name = f"{user.name}#{user.discriminator} ({user.mention})" if user else entity_id
             elif entity_type == "channel":
                 channel = ctx.guild.get_channel(entity_id)
@@ -705,6 +1207,7 @@ async def block(ctx: commands.Context, type: str, target: str, *, reason = "No r
                 await ctx.send(f"Server `{converted_name}` is already globally blocked.")
                 return
             await conn.execute("INSERT INTO global_blocked_servers (guild_id, reason) VALUES ($1, $2) ON CONFLICT (guild_id) DO UPDATE SET reason = $2", entity_id, reason)
+            await access_policy.reload("global_servers")
             await ctx.send(f"Globally blocked server `{converted_name}`. Reason: `{reason}`")
 
         elif type == "global":
@@ -713,6 +1216,7 @@ async def block(ctx: commands.Context, type: str, target: str, *, reason = "No r
                 await ctx.send(f"User `{converted_name}` is already globally blocked.")
                 return
             await conn.execute("INSERT INTO global_blocked_users (discord_id, reason) VALUES ($1, $2) ON CONFLICT (discord_id) DO UPDATE SET reason = $2", entity_id, reason)
+            await access_policy.reload("global_users")
             await ctx.send(f"Globally blocked user `{converted_name}`. Reason: `{reason}`")
 
         else:
@@ -725,6 +1229,7 @@ async def block(ctx: commands.Context, type: str, target: str, *, reason = "No r
                 "VALUES ($1, $2, $3, $4, $5) ON CONFLICT (type, entity_id) DO UPDATE SET reason = $3",
                 type, entity_id, reason, ctx.author.id, datetime.datetime.now()
             )
+            await access_policy.reload("blocklist")
             await ctx.send(f"Blocked {type} `{converted_name}`. Reason: `{reason}`")
 
 @bot.command(name="unblock", description="Unblocks a user, channel, or role from using the bot.")
@@ -783,6 +1288,7 @@ async def unblock(ctx: commands.Context, type: str, target: str):
             if result == "DELETE 0":
                 await ctx.send(f"Server `{converted_name}` is not globally blocked.")
             else:
+                await access_policy.reload("global_servers")
                 await ctx.send(f"Unblocked server `{converted_name}`.")
 
         elif type == "global":
@@ -790,6 +1296,7 @@ async def unblock(ctx: commands.Context, type: str, target: str):
             if result == "DELETE 0":
                 await ctx.send(f"User `{converted_name}` is not globally blocked.")
             else:
+                await access_policy.reload("global_users")
                 await ctx.send(f"Unblocked user `{converted_name}`.")
 
         else:
@@ -797,6 +1304,7 @@ async def unblock(ctx: commands.Context, type: str, target: str):
             if result == "DELETE 0":
                 await ctx.send(f"{type.capitalize()} `{converted_name}` is not blocked.")
             else:
+                await access_policy.reload("blocklist")
                 await ctx.send(f"Unblocked {type} `{converted_name}`.")
 
 @bot.command(name="allow", description="Allows a user, channel, or role to use the bot.")
@@ -816,6 +1324,7 @@ async def allow(ctx: commands.Context, type: str, target: commands.MemberConvert
             await ctx.send(f"{type.capitalize()} {converted_name} is already allowed.")
             return
         await conn.execute("INSERT INTO allowlist (type, entity_id, reason, added_by, added_at) VALUES ($1, $2, $3, $4, $5) ON CONFLICT (type, entity_id) DO NOTHING", type, type_id, reason, ctx.author.id, datetime.datetime.now())
+    await access_policy.reload("allowlist")
     await ctx.send(f"Allowed {type} {converted_name}. Reason: `{reason}`")
 
 @bot.command(name="deny", description="Denies a user, channel, or role from using the bot. (Not to be confused with `block`.)")
@@ -835,6 +1344,7 @@ async def deny(ctx: commands.Context, type: str, target: commands.MemberConverte
             await ctx.send(f"{type.capitalize()} {converted_name} is not allowed.")
             return
         await conn.execute("DELETE FROM allowlist WHERE type = $1 AND entity_id = $2", type, type_id)
+    await access_policy.reload("allowlist")
     await ctx.send(f"Denied {type} {converted_name}.")
 
 @bot.command(name="addpersonalprefix", description="Add a personal prefix for yourself.", aliases=["apersonalprefix", "apprefix", "app"])
@@ -856,6 +1366,7 @@ async def removepersonalprefix(ctx: commands.Context, prefix: str):
         if prefix in current_prefixes:
             current_prefixes.remove(prefix)
             await conn.execute("UPDATE user_prefixes SET prefixes = $1 WHERE user_id = $2", current_prefixes, ctx.author.id)
+            await prefix_cache.publish(conn, "user", ctx.author.id, current_prefixes)
             await ctx.send(f"Removed personal prefix `{prefix}`.")
         else:
             await ctx.send(f"Prefix `{prefix}` is not in your personal prefixes.")
@@ -896,6 +1407,7 @@ async def removeguildprefix(ctx: commands.Context, prefix: str):
         if prefix in current_prefixes:
             current_prefixes.remove(prefix)
             await conn.execute("UPDATE guild_prefixes SET prefixes = $1 WHERE guild_id = $2", current_prefixes, ctx.guild.id)
+            await prefix_cache.publish(conn, "guild", ctx.guild.id, current_prefixes)
             await ctx.send(f"Removed guild prefix `{prefix}`.")
         else:
             await ctx.send(f"Prefix `{prefix}` is not in the guild prefixes.")
@@ -1075,7 +1587,10 @@ def cleanup_code(content: str) -> str:
     return content.strip()
 
 
-setup_logger()
+log_listener = setup_logger()
 
 # Start the bot
-bot.run(bot_info.data['login'], log_handler=None)
+try:
+    bot.run(bot_info.data['login'], log_handler=None)
+finally:
+    log_listener.stop()
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import random
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+import aiohttp
+import bot_info
+import io_pool
+import metrics
+
+# One aiohttp session for the whole bot (bot.http_client), so keep-alive connections, DNS lookups and
+# TLS sessions are reused between commands. Idempotent requests are retried with backoff, bodies are
+# read with a size cap and every request is timed per host.
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+# How much of a body save() collects before handing it to the I/O pool in one write
+WRITE_BATCH = 1024 * 1024
+
+class ResponseTooLarge(Exception):
+    pass
+
+class HTTPClient:
+    def __init__(self, config: dict = None):
+        self.config = config if config is not None else bot_info.data.get('http', {})
+        self.max_size = int(self.config.get('max_download_mb', 200) * 1024 ** 2)
+        self.retries = self.config.get('retries', 2)
+        self.retry_backoff = self.config.get('retry_backoff', 0.5)
+        self.max_tracked_hosts = self.config.get('max_tracked_hosts', 50)
+        self.latency = defaultdict(metrics.Histogram)
+        self.responses = Counter()
+        self.failures = Counter()
+        self.retried = Counter()
+        self.received = Counter()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created on first use so it belongs to the running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.get('limit', 100),
+                limit_per_host=self.config.get('limit_per_host', 10),
+                ttl_dns_cache=self.config.get('dns_cache_ttl', 300),
+                enable_cleanup_closed=True
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=self.config.get('total_timeout', 300),
+                sock_connect=self.config.get('connect_timeout', 10),
+                sock_read=self.config.get('read_timeout', 30)
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    # Label used in metrics, hosts past the limit share one series so user supplied URLs can't blow it up
+    def _host(self, url: str) -> str:
+        host = urlparse(str(url)).hostname or "unknown"
+        if host not in self.latency and len(self.latency) >= self.max_tracked_hosts:
+            return "other"
+        return host
+
+    def _retry_delay(self, attempt: int, response: aiohttp.ClientResponse = None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), 30.0)
+        return self.retry_backoff * 2 ** attempt * (1 + random.random())
+
+    # Yields the response once its headers arrive, retrying connection errors and 429/5xx for idempotent methods
+    @contextlib.asynccontextmanager
+    async def request(self, method: str, url: str, *, retries: int = None, **kwargs):
+        method = method.upper()
+        host = self._host(url)
+        retries = (self.retries if retries is None else retries) if method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                with metrics.phase("http"):
+                    response = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.failures[(host, type(e).__name__)] += 1
+                if attempt >= retries:
+                    raise
+                self.retried[host] += 1
+                await asyncio.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+            self.latency[host].observe(time.perf_counter() - start)
+            self.responses[(host, response.status)] += 1
+            if response.status in RETRY_STATUSES and attempt < retries:
+                delay = self._retry_delay(attempt, response)
+                response.release()
+                self.retried[host] += 1
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            break
+        try:
+            yield response
+        finally:
+            response.release()
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    async def _chunks(self, response: aiohttp.ClientResponse, max_size: int = None):
+        max_size = max_size or self.max_size
+        if response.content_length is not None and response.content_length > max_size:
+            raise ResponseTooLarge(f"The file is too big ({response.content_length / 1024 ** 2:.1f} MB, the limit is {max_size / 1024 ** 2:.0f} MB).")
+        host = self._host(response.url)
+        size = 0
+        with metrics.phase("http"):
+            async for chunk in response.content.iter_chunked(65536):
+                size += len(chunk)
+                if size > max_size:
+                    raise ResponseTooLarge(f"The file is too big (over {max_size / 1024 ** 2:.0f} MB).")
+                self.received[host] += len(chunk)
+                yield chunk
+
+    async def read(self, response: aiohttp.ClientResponse, max_size: int = None) -> bytes:
+        return b"".join([chunk async for chunk in self._chunks(response, max_size)])
+
+    async def text(self, response: aiohttp.ClientResponse, max_size: int = None) -> str:
+        return (await self.read(response, max_size)).decode(response.charset or "utf-8", errors="replace")
+
+    # Streams the body to a file instead of holding all of it in memory, writes go through io_pool
+    async def save(self, response: aiohttp.ClientResponse, path: str, max_size: int = None) -> int:
+        size = 0
+        batch = []
+        batch_size = 0
+        f = await io_pool.run(open, path, "wb")
+        try:
+            async for chunk in self._chunks(response, max_size):
+                batch.append(chunk)
+                batch_size += len(chunk)
+                size += len(chunk)
+                if batch_size >= WRITE_BATCH:
+                    await io_pool.run(f.write, b"".join(batch))
+                    batch = []
+                    batch_size = 0
+            if batch:
+                await io_pool.run(f.write, b"".join(batch))
+        finally:
+            await io_pool.run(f.close)
+        return size
+
+    def summary(self) -> str:
+        requests = sum(self.responses.values())
+        slowest = sorted(((host, histogram.sum / histogram.count) for host, histogram in self.latency.items() if histogram.count), key=lambda item: item[1], reverse=True)[:3]
+        text = f"{requests} requests to {len(self.latency)} hosts, {sum(self.retried.values())} retried, {sum(self.failures.values())} failed, {sum(self.received.values()) / 1024 ** 2:.1f} MB received"
+        if slowest:
+            text += ", slowest " + ", ".join(f"{host} {avg * 1000:.0f}ms" for host, avg in slowest)
+        return text
+
+    def prometheus_lines(self) -> list[str]:
+        lines = ["# TYPE gman_http_responses_total counter"]
+        lines += [f'gman_http_responses_total{{host="{host}",status="{status}"}} {count}' for (host, status), count in sorted(self.responses.items())]
+        lines.append("# TYPE gman_http_failures_total counter")
+        lines += [f'gman_http_failures_total{{host="{host}",error="{error}"}} {count}' for (host, error), count in sorted(self.failures.items())]
+        lines.append("# TYPE gman_http_retries_total counter")
+        lines += [f'gman_http_retries_total{{host="{host}"}} {count}' for host, count in sorted(self.retried.items())]
+        lines.append("# TYPE gman_http_received_bytes_total counter")
+        lines += [f'gman_http_received_bytes_total{{host="{host}"}} {count}' for host, count in sorted(self.received.items())]
+        lines.append("# TYPE gman_http_response_seconds histogram")
+        for host, histogram in sorted(self.latency.items()):
+            lines += metrics.histogram_lines("gman_http_response_seconds", histogram, f'host="{host}"')
+        return lines
@@ -0,0 +1,81 @@
+import argparse
+import ast
+import io
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+# Measures what importing the bot's modules costs at startup, the same imports gman.py does before connecting,
+# using python -X importtime. Compare against another commit to see the effect of a change:
+# Usage: python importtime.py [--against <git ref>] [--top 15] [--runs 3]
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def extension_list(tree: str) -> list[str]:
+    with open(os.path.join(tree, "gman.py"), encoding="utf-8") as f:
+        match = re.search(r"^extensions = (\[.*\])", f.read(), re.MULTILINE)
+    return ast.literal_eval(match.group(1))
+
+def measure(tree: str) -> dict:
+    modules = ["bot_info"] + extension_list(tree)
+    code = "; ".join(f"import {name}" for name in modules)
+    # ru_maxrss is in kilobytes on Linux
+    code += "; import resource, sys; sys.stdout.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=tree, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing the bot failed in {tree}:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+
+    top_level = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # Only packages imported directly (indent of one space) so nested imports aren't counted twice
+        if match and len(match.group(3)) == 1:
+            name = match.group(4).split(".")[0]
+            top_level[name] = top_level.get(name, 0) + int(match.group(2))
+    return {"total": sum(top_level.values()), "modules": top_level, "max_rss": int(result.stdout.strip() or 0)}
+
+def best_of(tree: str, runs: int) -> dict:
+    # The fastest run is the least disturbed by disk cache and scheduling noise
+    return min((measure(tree) for _ in range(runs)), key=lambda m: m["total"])
+
+def export_ref(ref: str, destination: str):
+    archive = subprocess.run(["git", "archive", "--format=tar", ref], capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(destination, filter="data")
+    # bot_info.json isn't tracked, but every cog reads it on import
+    if os.path.exists("bot_info.json"):
+        shutil.copy("bot_info.json", destination)
+
+def print_report(label: str, result: dict, top: int):
+    print(f"{label}: {result['total'] / 1000:.1f}ms cumulative import time, {result['max_rss'] / 1024:.1f}MB peak RSS")
+    for name, micros in sorted(result["modules"].items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  {name:<28} {micros / 1000:>9.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bot import time with python -X importtime")
+    parser.add_argument("--against", help="git ref to compare the working tree against")
+    parser.add_argument("--top", type=int, default=15, help="number of top-level packages to list")
+    parser.add_argument("--runs", type=int, default=3, help="runs per tree, the fastest is reported")
+    args = parser.parse_args()
+
+    current = best_of(".", args.runs)
+    if not args.against:
+        print_report("Working tree", current, args.top)
+        return
+
+    with tempfile.TemporaryDirectory() as tree:
+        export_ref(args.against, tree)
+        baseline = best_of(tree, args.runs)
+    print_report(args.against, baseline, args.top)
+    print()
+    print_report("Working tree", current, args.top)
+    print()
+    print(f"Import time: {baseline['total'] / 1000:.1f}ms -> {current['total'] / 1000:.1f}ms ({(current['total'] - baseline['total']) / 1000:+.1f}ms)")
+    print(f"Peak RSS: {baseline['max_rss'] / 1024:.1f}MB -> {current['max_rss'] / 1024:.1f}MB ({(current['max_rss'] - baseline['max_rss']) / 1024:+.1f}MB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import os
+import shutil
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import bot_info
+import metrics
+
+# Small thread pool for blocking file system calls, so reading, writing and deleting media files
+# never runs on the event loop. It's separate from the default executor, which yt-dlp and PIL
+# work can fill up. Use the async helpers below instead of open()/os.remove()/shutil in cogs.
+
+class IOPool:
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gman-io")
+        self.pending = 0
+        self.calls = Counter()
+        self.duration = metrics.Histogram()
+
+    def _timed(self, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.duration.observe(time.perf_counter() - start)
+
+    async def run(self, func, *args, **kwargs):
+        self.pending += 1
+        self.calls[getattr(func, "__name__", "call")] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(self._timed, func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def summary(self) -> str:
+        return f"{self.pending} pending on {self.max_workers} threads, {sum(self.calls.values())} calls, avg {self.duration.sum / self.duration.count * 1000 if self.duration.count else 0.0:.1f}ms"
+
+    def prometheus_lines(self) -> list[str]:
+        lines = [
+            "# TYPE gman_io_pool_pending gauge",
+            f"gman_io_pool_pending {self.pending}",
+            "# TYPE gman_io_pool_calls_total counter"
+        ]
+        lines += [f'gman_io_pool_calls_total{{call="{metrics.escape(name)}"}} {count}' for name, count in sorted(self.calls.items())]
+        lines.append("# TYPE gman_io_pool_call_seconds histogram")
+        return lines + metrics.histogram_lines("gman_io_pool_call_seconds", self.duration)
+
+pool = IOPool(bot_info.data.get('io_pool', {}).get('max_workers', 4))
+metrics.register_collector(pool.prometheus_lines)
+
+def run(func, *args, **kwargs):
+    return pool.run(func, *args, **kwargs)
+
+def _read_bytes(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def _read_text(path, encoding: str) -> str:
+    with open(path, encoding=encoding) as f:
+        return f.read()
+
+def _write_bytes(path, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def _write_text(path, text: str, encoding: str):
+    with open(path, "w", encoding=encoding) as f:
+        f.write(text)
+
+def _remove(path) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+async def read_bytes(path) -> bytes:
+    return await pool.run(_read_bytes, path)
+
+async def read_text(path, encoding: str = "utf-8") -> str:
+    return await pool.run(_read_text, path, encoding)
+
+async def write_bytes(path, data: bytes):
+    await pool.run(_write_bytes, path, data)
+
+async def write_text(path, text: str, encoding: str = "utf-8"):
+    await pool.run(_write_text, path, text, encoding)
+
+# False if the file was already gone
+async def remove(path) -> bool:
+    return await pool.run(_remove, path)
+
+async def rmtree(path):
+    await pool.run(shutil.rmtree, path, True)
+
+async def move(source, dest):
+    return await pool.run(shutil.move, str(source), str(dest))
+
+async def replace(source, dest):
+    await pool.run(os.replace, source, dest)
+
+async def makedirs(path):
+    await pool.run(os.makedirs, path, exist_ok=True)
@@ -0,0 +1,158 @@
+import asyncio
+import contextlib
+import json
+from collections import Counter
+from pathlib import Path
+import asyncpg
+import bot_info
+import io_pool
+import metrics
+import scheduler
+
+# Media jobs stored in the media_jobs table so worker.py processes (on this machine or others) run them
+# instead of the bot process. Workers claim jobs with FOR UPDATE SKIP LOCKED, write output files to
+# <scratch_dir>/<job id>/ and NOTIFY the bot, which sends the files and removes the directory.
+
+CHANNEL = "gman_media_jobs"
+DONE_CHANNEL = "gman_media_jobs_done"
+
+def config() -> dict:
+    return bot_info.data.get('job_queue', {})
+
+def enabled() -> bool:
+    return config().get('enabled', False)
+
+def scratch_dir() -> Path:
+    return Path(config().get('scratch_dir', 'vids/jobs'))
+
+async def claim(conn, worker: str):
+    row = await conn.fetchrow(
+        """UPDATE media_jobs SET status = 'running', worker = $1, started_at = now(), heartbeat_at = now(), attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM media_jobs WHERE status = 'queued'
+            ORDER BY priority, id
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING id, kind, payload""",
+        worker
+    )
+    if row is None:
+        return None
+    return {"id": row["id"], "kind": row["kind"], "payload": json.loads(row["payload"])}
+
+# False when the bot already gave up on the job and deleted it
+async def finish(conn, job_id: int, result: dict = None, error: str = None) -> bool:
+    async with conn.transaction():
+        status = await conn.execute(
+            "UPDATE media_jobs SET status = $2, result = $3, error = $4, finished_at = now() WHERE id = $1",
+            job_id, "failed" if error else "done", json.dumps(result) if result is not None else None, error
+        )
+        await conn.execute("SELECT pg_notify($1, $2)", DONE_CHANNEL, str(job_id))
+    return status != "UPDATE 0"
+
+# Workers call this every heartbeat_interval seconds while they run a job, so a slow job isn't taken for a dead one
+async def heartbeat(conn, job_id: int, worker: str):
+    await conn.execute("UPDATE media_jobs SET heartbeat_at = now() WHERE id = $1 AND worker = $2 AND status = 'running'", job_id, worker)
+
+# Puts jobs whose worker stopped sending heartbeats back in the queue, or fails them once they've used up their attempts
+async def recover_stale(conn, stale_after: float, max_attempts: int):
+    await conn.execute(
+        """UPDATE media_jobs SET status = 'queued', worker = NULL
+        WHERE status = 'running' AND coalesce(heartbeat_at, started_at) < now() - make_interval(secs => $1) AND attempts < $2""",
+        stale_after, max_attempts
+    )
+    failed = await conn.fetch(
+        """UPDATE media_jobs SET status = 'failed', error = 'The worker running this job stopped responding.', finished_at = now()
+        WHERE status = 'running' AND coalesce(heartbeat_at, started_at) < now() - make_interval(secs => $1) AND attempts >= $2
+        RETURNING id""",
+        stale_after, max_attempts
+    )
+    for row in failed:
+        await conn.execute("SELECT pg_notify($1, $2)", DONE_CHANNEL, str(row["id"]))
+
+class JobQueue:
+    def __init__(self, pool):
+        self.pool = pool
+        self.listener = None
+        self.waiters = {}
+        self.submitted = Counter()
+        self.finished = Counter()
+
+    async def start(self):
+        self.listener = await asyncpg.connect(bot_info.data['database'])
+        await self.listener.add_listener(DONE_CHANNEL, self._on_done)
+        metrics.register_collector(self.prometheus_lines)
+
+    async def close(self):
+        if self.listener is not None and not self.listener.is_closed():
+            await self.listener.close()
+
+    def _on_done(self, conn, pid, channel, payload):
+        future = self.waiters.get(int(payload))
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def submit(self, kind: str, payload: dict) -> int:
+        owner = scheduler.current_owner()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                job_id = await conn.fetchval(
+                    "INSERT INTO media_jobs (kind, payload, priority, user_id, guild_id) VALUES ($1, $2, $3, $4, $5) RETURNING id",
+                    kind, json.dumps(payload), owner.priority, owner.user_id, owner.guild_id
+                )
+                await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, str(job_id))
+        self.submitted[kind] += 1
+        return job_id
+
+    async def wait(self, job_id: int, timeout: float) -> dict:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                self.waiters[job_id] = loop.create_future()
+                row = await self.pool.fetchrow("SELECT status, result, error FROM media_jobs WHERE id = $1", job_id)
+                if row is None or row["status"] in ("done", "failed"):
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                # Poll now and then in case a notification was missed while reconnecting
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.waiters[job_id], min(remaining, 10))
+        finally:
+            self.waiters.pop(job_id, None)
+            await self.pool.execute("DELETE FROM media_jobs WHERE id = $1", job_id)
+        if row is None:
+            return {"files": [], "errors": ["The job was removed before it finished."]}
+        self.finished[row["status"]] += 1
+        if row["status"] == "failed":
+            return {"files": [], "errors": [row["error"] or "The job failed."]}
+        return json.loads(row["result"])
+
+    # Runs a job on a worker and yields (file paths, errors); the files are deleted when the block exits
+    @contextlib.asynccontextmanager
+    async def run(self, kind: str, payload: dict):
+        job_id = await self.submit(kind, payload)
+        job_dir = scratch_dir() / str(job_id)
+        try:
+            with metrics.phase("queue"):
+                try:
+                    result = await self.wait(job_id, config().get('timeout', 300))
+                except asyncio.TimeoutError:
+                    self.finished["timeout"] += 1
+                    result = {"files": [], "errors": ["The media workers took too long to process this job."]}
+            yield [str(job_dir / name) for name in result["files"]], result["errors"]
+        finally:
+            await io_pool.rmtree(job_dir)
+
+    def summary(self) -> str:
+        return f"{len(self.waiters)} waiting on workers, {sum(self.submitted.values())} submitted, {self.finished['done']} done, {self.finished['failed']} failed, {self.finished['timeout']} timed out"
+
+    def prometheus_lines(self) -> list[str]:
+        lines = ["# TYPE gman_media_jobs_submitted_total counter"]
+        lines += [f'gman_media_jobs_submitted_total{{kind="{kind}"}} {count}' for kind, count in sorted(self.submitted.items())]
+        lines.append("# TYPE gman_media_jobs_finished_total counter")
+        lines += [f'gman_media_jobs_finished_total{{status="{status}"}} {count}' for status, count in sorted(self.finished.items())]
+        lines += ["# TYPE gman_media_jobs_in_flight gauge", f"gman_media_jobs_in_flight {len(self.waiters)}"]
+        return lines
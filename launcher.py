@@ -0,0 +1,114 @@
+import bot_info
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Runs gman.py as several cluster processes, each owning a range of shards, and restarts clusters that die.
+# Usage: python launcher.py [clusters]
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - launcher - %(message)s")
+logger = logging.getLogger("launcher")
+
+def recommended_shard_count() -> int:
+    request = urllib.request.Request("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {bot_info.data['login']}", "User-Agent": "G-Man launcher"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.load(response)["shards"]
+
+def split_shards(shard_count: int, clusters: int) -> list[list[int]]:
+    clusters = max(1, min(clusters, shard_count))
+    per_cluster, extra = divmod(shard_count, clusters)
+    ranges = []
+    start = 0
+    for i in range(clusters):
+        size = per_cluster + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+class Cluster:
+    def __init__(self, cluster_id: int, shard_ids: list[int], shard_count: int, cluster_count: int):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.cluster_count = cluster_count
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.next_start = 0.0
+
+    def start(self):
+        env = dict(os.environ, GMAN_CLUSTER_ID=str(self.cluster_id), GMAN_SHARD_IDS=",".join(map(str, self.shard_ids)), GMAN_SHARD_COUNT=str(self.shard_count), GMAN_CLUSTER_COUNT=str(self.cluster_count))
+        self.process = subprocess.Popen([sys.executable, "gman.py"], env=env)
+        self.started_at = time.monotonic()
+        logger.info(f"Started cluster {self.cluster_id} (PID {self.process.pid}) with shards {self.shard_ids[0]}-{self.shard_ids[-1]} of {self.shard_count}")
+
+    def check(self):
+        if self.process is None:
+            if time.monotonic() >= self.next_start:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        # Clusters that stayed up for a while get their backoff reset
+        if time.monotonic() - self.started_at > 60:
+            self.restarts = 0
+        delay = min(2 ** self.restarts, 60)
+        self.restarts += 1
+        self.process = None
+        self.next_start = time.monotonic() + delay
+        logger.warning(f"Cluster {self.cluster_id} exited with code {code}, restarting in {delay}s")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+def main():
+    config = bot_info.data.get('sharding', {})
+    clusters = int(sys.argv[1]) if len(sys.argv) > 1 else config.get('clusters', os.cpu_count() or 1)
+    shard_count = config.get('shard_count') or recommended_shard_count()
+
+    # Clusters skip the vids cleanup so a restarting cluster doesn't delete files another one is using
+    for f in os.listdir('vids'):
+        if os.path.isfile(os.path.join('vids', f)):
+            os.remove(os.path.join('vids', f))
+
+    ranges = split_shards(shard_count, clusters)
+    workers = [Cluster(i, shard_ids, shard_count, len(ranges)) for i, shard_ids in enumerate(ranges)]
+    logger.info(f"Launching {len(workers)} clusters for {shard_count} shards")
+
+    stopping = False
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for worker in workers:
+        worker.start()
+        # Give each cluster a head start so shards don't all identify at once
+        time.sleep(config.get('cluster_start_delay', 5))
+        if stopping:
+            break
+    while not stopping:
+        for worker in workers:
+            worker.check()
+        time.sleep(1)
+
+    logger.info("Stopping clusters")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        if worker.process is not None:
+            try:
+                worker.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+
+if __name__ == "__main__":
+    main()
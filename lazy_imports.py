@@ -0,0 +1,46 @@
+import importlib
+import time
+
+# Heavy libraries (numpy, PIL, wand, yt_dlp, ...) are only imported the first time an attribute is used,
+# so cogs that rarely need them don't pay for them at startup or keep them resident.
+# Usage: np = lazy_imports.module("numpy"), then np.zeros(...) as usual.
+
+load_times = {}
+
+class LazyModule:
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            # importlib's own locks make concurrent first uses from worker threads safe
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            load_times.setdefault(self._name, time.perf_counter() - start)
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+_modules = {}
+
+def module(name: str) -> LazyModule:
+    if name not in _modules:
+        _modules[name] = LazyModule(name)
+    return _modules[name]
+
+def loaded() -> dict:
+    return {name: lazy.__dict__["_module"] is not None for name, lazy in _modules.items()}
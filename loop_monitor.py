@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+import bot_info
+import metrics
+
+# Measures event loop lag by sleeping for a fixed interval and checking how late the wakeup was.
+# In debug mode a watchdog thread also notices when the loop stops responding for longer than
+# block_threshold and logs the loop thread's stack at that moment, which points at the blocking call.
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.25, debug: bool = False, block_threshold: float = 0.1):
+        self.interval = interval
+        self.debug = debug
+        self.block_threshold = block_threshold
+        self.lag = metrics.Histogram()
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.blocked = Counter()
+        self._heartbeat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.create_task(self._sample(), name="loop-monitor")
+        if self.debug:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self):
+        while True:
+            start = time.monotonic()
+            self._heartbeat = start
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - start - self.interval, 0.0)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.lag.observe(lag)
+
+    # Where the loop thread is stuck: the innermost frame from this repository, or the innermost frame
+    def _location(self, stack) -> str:
+        root = os.path.dirname(os.path.abspath(__file__))
+        for frame in reversed(stack):
+            if frame.filename.startswith(root):
+                return f"{os.path.relpath(frame.filename, root)}:{frame.lineno} {frame.name}"
+        frame = stack[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+
+    def _watch(self):
+        logger = logging.getLogger()
+        reported = None
+        while not self._stopping.wait(self.block_threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.block_threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            location = self._location(stack)
+            self.blocked[location] += 1
+            logger.warning(f"Event loop blocked for over {stalled * 1000:.0f}ms at {location}\n{''.join(traceback.format_list(stack[-15:]))}")
+
+    def summary(self) -> str:
+        text = f"lag {self.last_lag * 1000:.1f}ms now, p95 {self.lag.quantile(0.95) * 1000:.0f}ms, max {self.max_lag * 1000:.0f}ms"
+        if self.debug:
+            text += f", {sum(self.blocked.values())} blocking calls caught"
+        return text
+
+    def prometheus_lines(self) -> list[str]:
+        lines = [
+            "# TYPE gman_event_loop_lag_seconds gauge",
+            f"gman_event_loop_lag_seconds {self.last_lag}",
+            "# TYPE gman_event_loop_max_lag_seconds gauge",
+            f"gman_event_loop_max_lag_seconds {self.max_lag}",
+            "# TYPE gman_event_loop_lag_sample_seconds histogram"
+        ]
+        lines += metrics.histogram_lines("gman_event_loop_lag_sample_seconds", self.lag)
+        if self.debug:
+            lines.append("# TYPE gman_event_loop_blocked_total counter")
+            lines += [f'gman_event_loop_blocked_total{{location="{metrics.escape(location)}"}} {count}' for location, count in sorted(self.blocked.items())]
+        return lines
+
+_config = bot_info.data.get('loop_monitor', {})
+monitor = LoopMonitor(_config.get('interval', 0.25), _config.get('debug', False), _config.get('block_threshold', 0.1))
+metrics.register_collector(monitor.prometheus_lines)
@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import io_pool
+from loop_monitor import LoopMonitor
+
+# Measures event loop lag while concurrent fake media jobs write, read and delete files, once with the
+# file calls made directly on the loop (how the cogs used to do it) and once through io_pool.
+# Usage: python loopbench.py [--jobs 16] [--size-mb 8] [--rounds 4]
+
+def write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def inline_job(path: str, data: bytes, rounds: int):
+    for _ in range(rounds):
+        write_file(path, data)
+        read_file(path)
+        os.remove(path)
+        await asyncio.sleep(0)
+
+async def pooled_job(path: str, data: bytes, rounds: int):
+    for _ in range(rounds):
+        await io_pool.write_bytes(path, data)
+        await io_pool.read_bytes(path)
+        await io_pool.remove(path)
+
+async def measure(job, jobs: int, size: int, rounds: int) -> dict:
+    directory = tempfile.mkdtemp(prefix="loopbench_")
+    data = os.urandom(size)
+    monitor = LoopMonitor(interval=0.005)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(job(os.path.join(directory, f"job-{i}"), data, rounds) for i in range(jobs)))
+    finally:
+        elapsed = time.perf_counter() - start
+        monitor.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"elapsed": elapsed, "mean": monitor.lag.sum / monitor.lag.count if monitor.lag.count else 0.0, "p95": monitor.lag.quantile(0.95), "max": monitor.max_lag}
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare event loop lag with file I/O on the loop and in the I/O pool.")
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--rounds", type=int, default=4)
+    args = parser.parse_args()
+    size = int(args.size_mb * 1024 ** 2)
+
+    print(f"{args.jobs} jobs x {args.rounds} rounds of {args.size_mb:g} MB write/read/delete, io_pool has {io_pool.pool.max_workers} threads")
+    print(f"{'Mode':<10} {'Total':>8} {'Lag avg':>9} {'Lag p95':>9} {'Lag max':>9}")
+    for name, job in (("inline", inline_job), ("io_pool", pooled_job)):
+        result = await measure(job, args.jobs, size, args.rounds)
+        print(f"{name:<10} {result['elapsed']:>7.2f}s {result['mean'] * 1000:>7.1f}ms {result['p95'] * 1000:>7.0f}ms {result['max'] * 1000:>7.0f}ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
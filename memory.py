@@ -0,0 +1,115 @@
+import itertools
+import sys
+import tracemalloc
+import weakref
+from collections import deque
+import psutil
+import metrics
+
+# Registry of long-lived containers (caches, per-user state) so their growth can be watched, plus
+# tracemalloc snapshots and diffs on demand. Register with memory.register("cog.name", self, "attribute"),
+# the owner is held weakly so a reloaded cog's old instance can still be freed.
+
+SAMPLE_ITEMS = 100
+MAX_DEPTH = 4
+
+_caches = {}
+_last_snapshot = None
+
+def register(name: str, owner, attribute: str):
+    _caches[name] = (weakref.ref(owner), attribute)
+
+def _deep_size(obj, depth: int, seen: set) -> int:
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if depth <= 0 or isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        size += sum(_deep_size(key, depth - 1, seen) + _deep_size(value, depth - 1, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(_deep_size(item, depth - 1, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_size(vars(obj), depth - 1, seen)
+    return size
+
+# Size of a container and what it holds, measured on a sample of its items and scaled up
+def approximate_size(container) -> int:
+    size = sys.getsizeof(container)
+    if isinstance(container, dict):
+        items = container.items()
+    elif isinstance(container, (list, tuple, set, frozenset, deque)):
+        items = container
+    else:
+        return _deep_size(container, MAX_DEPTH, set())
+    seen = {id(container)}
+    sampled = 0
+    total = 0
+    for item in itertools.islice(items, SAMPLE_ITEMS):
+        if isinstance(container, dict):
+            total += _deep_size(item[0], MAX_DEPTH, seen) + _deep_size(item[1], MAX_DEPTH, seen)
+        else:
+            total += _deep_size(item, MAX_DEPTH, seen)
+        sampled += 1
+    return size + (total * len(container) // sampled if sampled else 0)
+
+def report() -> list[dict]:
+    rows = []
+    for name, (owner_ref, attribute) in list(_caches.items()):
+        owner = owner_ref()
+        if owner is None:
+            del _caches[name]
+            continue
+        container = getattr(owner, attribute, None)
+        if container is None:
+            continue
+        rows.append({"name": name, "entries": len(container) if hasattr(container, "__len__") else 1, "bytes": approximate_size(container)})
+    rows.sort(key=lambda row: row["bytes"], reverse=True)
+    return rows
+
+def tracemalloc_start(frames: int = 10):
+    tracemalloc.start(frames)
+
+def tracemalloc_stop():
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+
+def _take_snapshot():
+    snapshot = tracemalloc.take_snapshot()
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>")
+    ))
+
+# Top allocation sites now, the snapshot is kept as the baseline for the next diff
+def snapshot(limit: int = 15) -> list[str]:
+    global _last_snapshot
+    _last_snapshot = _take_snapshot()
+    return [f"{stat.size / 1024:>10.1f} KiB {stat.count:>8} blocks  {stat.traceback}" for stat in _last_snapshot.statistics("lineno")[:limit]]
+
+# Allocation sites that grew the most since the last snapshot (or diff)
+def diff(limit: int = 15) -> list[str]:
+    global _last_snapshot
+    current = _take_snapshot()
+    previous, _last_snapshot = _last_snapshot, current
+    if previous is None:
+        return []
+    return [f"{stat.size_diff / 1024:>+10.1f} KiB {stat.count_diff:>+8} blocks  {stat.traceback} (now {stat.size / 1024:.1f} KiB)" for stat in current.compare_to(previous, "lineno")[:limit]]
+
+def prometheus_lines() -> list[str]:
+    lines = ["# TYPE gman_process_rss_bytes gauge", f"gman_process_rss_bytes {psutil.Process().memory_info().rss}"]
+    rows = report()
+    lines.append("# TYPE gman_cache_entries gauge")
+    lines += [f'gman_cache_entries{{cache="{metrics.escape(row["name"])}"}} {row["entries"]}' for row in rows]
+    lines.append("# TYPE gman_cache_approx_bytes gauge")
+    lines += [f'gman_cache_approx_bytes{{cache="{metrics.escape(row["name"])}"}} {row["bytes"]}' for row in rows]
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines += ["# TYPE gman_tracemalloc_bytes gauge", f'gman_tracemalloc_bytes{{kind="current"}} {current}', f'gman_tracemalloc_bytes{{kind="peak"}} {peak}']
+    return lines
+
+metrics.register_collector(prometheus_lines)
@@ -0,0 +1,203 @@
+import time
+import contextvars
+import contextlib
+import logging
+from collections import defaultdict
+from aiohttp import web
+
+# Per-command counters and latency histograms, served in Prometheus text format
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float("inf"))
+PHASES = ("total", "access_check", "db", "http", "queue", "subprocess", "send")
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return bound if bound != float("inf") else BUCKETS[-2]
+        return BUCKETS[-2]
+
+class Invocation:
+    def __init__(self, command: str):
+        self.command = command
+        self.start = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.queries = []
+
+invocations = defaultdict(int)
+results = defaultdict(int)
+histograms = defaultdict(Histogram)
+collectors = []
+finish_hooks = []
+_current = contextvars.ContextVar("metrics_invocation", default=None)
+_server = None
+
+# Starts tracking a command invocation, safe to call more than once per context
+def begin(ctx) -> Invocation:
+    invocation = getattr(ctx, "_metrics", None)
+    if invocation is None:
+        invocation = Invocation(ctx.command.qualified_name if ctx.command else "unknown")
+        ctx._metrics = invocation
+        send = ctx.send
+        async def timed_send(*args, **kwargs):
+            with phase("send"):
+                return await send(*args, **kwargs)
+        ctx.send = timed_send
+    _current.set(invocation)
+    return invocation
+
+def count_invocation(command: str):
+    invocations[command] += 1
+
+def finish(ctx, result: str = "success"):
+    invocation = getattr(ctx, "_metrics", None)
+    command = invocation.command if invocation else (ctx.command.qualified_name if ctx.command else "unknown")
+    results[(command, result)] += 1
+    if invocation is None or result == "blocked":
+        return
+    histograms[(command, "total")].observe(time.perf_counter() - invocation.start)
+    for name, elapsed in invocation.phases.items():
+        histograms[(command, name)].observe(elapsed)
+    for hook in finish_hooks:
+        try:
+            hook(invocation)
+        except Exception as e:
+            logging.getLogger().warning(f"Metrics finish hook {hook.__name__} failed: {e}")
+
+def add_phase_time(name: str, elapsed: float):
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.phases[name] += elapsed
+
+def current_invocation():
+    return _current.get()
+
+# Name of the command running in the current context, if any
+def current_command():
+    invocation = _current.get()
+    return invocation.command if invocation is not None else None
+
+# Attributes the time spent inside the block to a phase of the current command
+@contextlib.contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(name, time.perf_counter() - start)
+
+# asyncpg query logger, add it to pool connections through the pool's init hook
+def record_query(record):
+    add_phase_time("db", record.elapsed)
+
+async def instrument_connection(conn):
+    conn.add_query_logger(record_query)
+
+# Collectors are callables returning extra Prometheus lines (caches, pools, etc.)
+def register_collector(collector):
+    if collector not in collectors:
+        collectors.append(collector)
+
+# Finish hooks are called with each finished Invocation (after its histograms are updated)
+def register_finish_hook(hook):
+    if hook not in finish_hooks:
+        finish_hooks.append(hook)
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# Bucket, sum and count lines for one histogram, for collectors that keep their own
+def histogram_lines(name: str, histogram: Histogram, labels: str = "") -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f'{name}_bucket{{{labels + "," if labels else ""}le="{le}"}} {cumulative}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+def render() -> str:
+    lines = [
+        "# HELP gman_command_invocations_total Commands invoked.",
+        "# TYPE gman_command_invocations_total counter"
+    ]
+    for command, count in sorted(invocations.items()):
+        lines.append(f'gman_command_invocations_total{{command="{escape(command)}"}} {count}')
+    lines += [
+        "# HELP gman_command_results_total Finished commands by result (success, error, blocked).",
+        "# TYPE gman_command_results_total counter"
+    ]
+    for (command, result), count in sorted(results.items()):
+        lines.append(f'gman_command_results_total{{command="{escape(command)}",result="{result}"}} {count}')
+    lines += [
+        "# HELP gman_command_phase_seconds Command latency split by phase.",
+        "# TYPE gman_command_phase_seconds histogram"
+    ]
+    for (command, name), histogram in sorted(histograms.items()):
+        lines += histogram_lines("gman_command_phase_seconds", histogram, f'command="{escape(command)}",phase="{name}"')
+    for collector in collectors:
+        try:
+            lines.extend(collector())
+        except Exception as e:
+            logging.getLogger().warning(f"Metrics collector {collector.__name__} failed: {e}")
+    return "\n".join(lines) + "\n"
+
+# Commands sorted by average total latency, each with a per-phase breakdown
+def slowest(limit: int = 10) -> list[dict]:
+    rows = []
+    for (command, name), histogram in histograms.items():
+        if name != "total" or not histogram.count:
+            continue
+        rows.append({
+            "command": command,
+            "count": invocations.get(command, histogram.count),
+            "errors": results.get((command, "error"), 0),
+            "avg": histogram.sum / histogram.count,
+            "p95": histogram.quantile(0.95),
+            "phases": {p: histograms[(command, p)].sum / histogram.count for p in PHASES[1:] if (command, p) in histograms}
+        })
+    rows.sort(key=lambda row: row["avg"], reverse=True)
+    return rows[:limit]
+
+async def _handle_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+async def start_server(host: str = "127.0.0.1", port: int = 9100):
+    global _server
+    if _server is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    _server = runner
+    logging.getLogger().info(f"Serving metrics on http://{host}:{port}/metrics")
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        await _server.cleanup()
+        _server = None
@@ -0,0 +1,140 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+# Profiles one coroutine (a command invocation for g-profile) in one of two ways:
+# - sampling: a thread looks at the task every few milliseconds. While the task runs on the loop the
+#   sample is the real call stack, while it's suspended it's the chain of awaiting coroutines ending
+#   in "[waiting on X]", so time spent across awaits shows up as well as CPU time.
+# - cprofile: deterministic cProfile of the loop thread while the coroutine runs (other tasks that run
+#   in between are included too).
+# Both produce collapsed stacks ("frame;frame;frame count") that flamegraph.pl or speedscope can read.
+
+def _label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+def _await_chain(coro) -> tuple[list, object]:
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames, coro
+
+class Sampler:
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.running_samples = 0
+        self._task = None
+        self._loop_thread = None
+        self._stopping = threading.Event()
+
+    def _sample_once(self):
+        coro = self._task.get_coro()
+        chain, awaited = _await_chain(coro)
+        if not chain:
+            return
+        if getattr(coro, "cr_running", False):
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = []
+            while frame is not None:
+                stack.append(frame)
+                if frame is chain[0]:
+                    break
+                frame = frame.f_back
+            labels = [_label(f) for f in reversed(stack)]
+            self.running_samples += 1
+        else:
+            labels = [_label(f) for f in chain]
+            # The future the task is suspended on says more than the awaitable wrapping it
+            waiter = getattr(self._task, "_fut_waiter", None) or awaited
+            labels.append(f"[waiting on {type(waiter).__name__.lstrip('_') if waiter is not None else 'loop'}]")
+        self.stacks[";".join(labels)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            if self._task.done():
+                break
+            try:
+                self._sample_once()
+            except (AttributeError, ValueError):
+                # The task moved on while it was being looked at
+                pass
+
+    async def profile(self, coro):
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.ensure_future(coro)
+        thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        thread.start()
+        try:
+            return await self._task
+        finally:
+            self._stopping.set()
+            await asyncio.to_thread(thread.join)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def table(self, top: int = 25) -> str:
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f}ms, {self.running_samples} running on the loop, {self.samples - self.running_samples} waiting", ""]
+        lines.append(f"{'Own':>8} {'Own %':>6} {'Total':>8} {'Total %':>7}  Function")
+        for frame, count in own.most_common(top):
+            lines.append(f"{count * self.interval * 1000:>6.0f}ms {count / self.samples * 100:>5.1f}% {total[frame] * self.interval * 1000:>6.0f}ms {total[frame] / self.samples * 100:>6.1f}%  {frame}")
+        return "\n".join(lines) + "\n"
+
+class DeterministicProfiler:
+    def __init__(self):
+        self.profile_data = cProfile.Profile()
+        self.stats = None
+
+    async def profile(self, coro):
+        self.profile_data.enable()
+        try:
+            return await coro
+        finally:
+            self.profile_data.disable()
+            self.stats = pstats.Stats(self.profile_data)
+
+    # cProfile only records caller -> callee pairs, so each line is a two frame stack weighted in microseconds
+    def collapsed(self) -> str:
+        lines = []
+        for (file, line, name), (_, _, own, _, callers) in self.stats.stats.items():
+            callee = f"{name} ({os.path.basename(file)}:{line})".replace(";", ":")
+            if not callers:
+                lines.append(f"{callee} {int(own * 1e6)}")
+            for (caller_file, caller_line, caller_name), (_, _, caller_own, _) in callers.items():
+                caller = f"{caller_name} ({os.path.basename(caller_file)}:{caller_line})".replace(";", ":")
+                lines.append(f"{caller};{callee} {int(caller_own * 1e6)}")
+        return "\n".join(line for line in lines if not line.endswith(" 0")) + "\n"
+
+    def table(self, top: int = 25) -> str:
+        output = io.StringIO()
+        self.stats.stream = output
+        self.stats.sort_stats("cumulative").print_stats(top)
+        return output.getvalue()
+
+async def profile(coro, mode: str = "sample", interval: float = 0.005):
+    profiler = Sampler(interval) if mode == "sample" else DeterministicProfiler()
+    start = time.perf_counter()
+    await profiler.profile(coro)
+    return profiler, time.perf_counter() - start
@@ -0,0 +1,173 @@
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import logging
+import os
+import time
+from collections import Counter
+import bot_info
+import metrics
+
+# Shared limit on heavy subprocesses (ffmpeg, ImageMagick). Waiting jobs are started by priority
+# (slash commands, then prefix commands, then buttons), then by how many jobs their guild and user
+# already have running, then in arrival order, so one busy user or server can't starve everyone else.
+
+SLASH, COMMAND, BUTTON = 0, 1, 2
+PRIORITY_NAMES = {SLASH: "slash", COMMAND: "command", BUTTON: "button"}
+
+class Owner:
+    def __init__(self, user_id: int = None, guild_id: int = None, priority: int = COMMAND, notify=None):
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.priority = priority
+        # Coroutine function sending a message and returning it, used once to show the queue position
+        self.notify = notify
+        self.notified = False
+
+class Job:
+    def __init__(self, kind: str, owner: Owner, seq: int):
+        self.kind = kind
+        self.owner = owner
+        self.seq = seq
+        self.future = None
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+
+_owner = contextvars.ContextVar("scheduler_owner", default=None)
+# The task holding a slot. Tasks started inside a slot inherit the variable, they still need their own slot
+_holding = contextvars.ContextVar("scheduler_holding", default=None)
+
+def current_owner() -> Owner:
+    return _owner.get() or Owner()
+
+def set_owner_from_ctx(ctx):
+    current = _owner.get()
+    # Commands run from a button keep the button's priority
+    if current is not None and current.priority == BUTTON and current.user_id == ctx.author.id:
+        return
+    priority = SLASH if ctx.interaction is not None else COMMAND
+    _owner.set(Owner(ctx.author.id, ctx.guild.id if ctx.guild else None, priority, ctx.send))
+
+def set_owner_from_interaction(interaction):
+    async def notify(text: str):
+        return await interaction.followup.send(text, ephemeral=True, wait=True)
+    _owner.set(Owner(interaction.user.id, interaction.guild.id if interaction.guild else None, BUTTON, notify))
+
+class Scheduler:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = set()
+        self.waiting = []
+        self.user_running = Counter()
+        self.guild_running = Counter()
+        self.started = Counter()
+        self.wait_time = metrics.Histogram()
+        self._seq = itertools.count()
+
+    def _key(self, job: Job) -> tuple:
+        owner = job.owner
+        guild_load = self.guild_running[owner.guild_id] if owner.guild_id is not None else 0
+        return (owner.priority, guild_load, self.user_running[owner.user_id], job.seq)
+
+    def position(self, job: Job) -> int:
+        return sorted(self.waiting, key=self._key).index(job) + 1
+
+    def _start(self, job: Job):
+        job.started_at = time.perf_counter()
+        self.running.add(job)
+        self.user_running[job.owner.user_id] += 1
+        if job.owner.guild_id is not None:
+            self.guild_running[job.owner.guild_id] += 1
+        self.started[(job.kind, PRIORITY_NAMES[job.owner.priority])] += 1
+        self.wait_time.observe(job.started_at - job.queued_at)
+
+    def _finish(self, job: Job):
+        self.running.discard(job)
+        self.user_running[job.owner.user_id] -= 1
+        if self.user_running[job.owner.user_id] <= 0:
+            del self.user_running[job.owner.user_id]
+        if job.owner.guild_id is not None:
+            self.guild_running[job.owner.guild_id] -= 1
+            if self.guild_running[job.owner.guild_id] <= 0:
+                del self.guild_running[job.owner.guild_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.waiting and len(self.running) < self.limit:
+            job = min(self.waiting, key=self._key)
+            self.waiting.remove(job)
+            self._start(job)
+            if not job.future.done():
+                job.future.set_result(None)
+
+    async def _notify(self, job: Job):
+        owner = job.owner
+        if owner.notify is None or owner.notified:
+            return None
+        owner.notified = True
+        try:
+            return await owner.notify(f"Waiting for a free worker, you're #{self.position(job)} in the queue ({len(self.running)} jobs running).")
+        except Exception as e:
+            logging.getLogger().debug(f"Couldn't send queue position: {e}")
+            return None
+
+    # Holds one of the slots while the block runs, queueing if all are taken.
+    # Nested uses in the same task (a job calling another scheduled helper) don't take a second slot.
+    @contextlib.asynccontextmanager
+    async def slot(self, kind: str):
+        if _holding.get() is asyncio.current_task():
+            yield None
+            return
+        job = Job(kind, current_owner(), next(self._seq))
+        if not self.waiting and len(self.running) < self.limit:
+            self._start(job)
+        else:
+            job.future = asyncio.get_running_loop().create_future()
+            self.waiting.append(job)
+            notice = None
+            try:
+                notice = await self._notify(job)
+                await job.future
+            except asyncio.CancelledError:
+                if job in self.waiting:
+                    self.waiting.remove(job)
+                elif job in self.running:
+                    self._finish(job)
+                raise
+            finally:
+                if notice is not None:
+                    with contextlib.suppress(Exception):
+                        await notice.delete()
+            metrics.add_phase_time("queue", job.started_at - job.queued_at)
+        token = _holding.set(asyncio.current_task())
+        try:
+            yield job
+        finally:
+            _holding.reset(token)
+            self._finish(job)
+
+    def summary(self) -> str:
+        return f"{len(self.running)}/{self.limit} running, {len(self.waiting)} queued, wait avg {self.wait_time.sum / self.wait_time.count if self.wait_time.count else 0.0:.2f}s"
+
+    def prometheus_lines(self) -> list[str]:
+        lines = [
+            "# TYPE gman_jobs_running gauge",
+            f"gman_jobs_running {len(self.running)}",
+            "# TYPE gman_jobs_queued gauge",
+            f"gman_jobs_queued {len(self.waiting)}",
+            "# TYPE gman_jobs_limit gauge",
+            f"gman_jobs_limit {self.limit}",
+            "# TYPE gman_jobs_started_total counter"
+        ]
+        lines += [f'gman_jobs_started_total{{kind="{kind}",priority="{priority}"}} {count}' for (kind, priority), count in sorted(self.started.items())]
+        lines.append("# TYPE gman_jobs_wait_seconds histogram")
+        return lines + metrics.histogram_lines("gman_jobs_wait_seconds", self.wait_time)
+
+# Under launcher.py every cluster is its own process, so they share the limit equally
+_cluster_count = int(os.environ.get('GMAN_CLUSTER_COUNT', 1))
+jobs = Scheduler(max(1, (bot_info.data.get('jobs', {}).get('max_concurrent') or os.cpu_count() or 1) // _cluster_count))
+metrics.register_collector(jobs.prometheus_lines)
+
+def slot(kind: str):
+    return jobs.slot(kind)
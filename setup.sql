@@ -155,4 +155,26 @@ CREATE TABLE IF NOT EXISTS ai_conversations (
     conversation_key TEXT PRIMARY KEY,
     history JSONB NOT NULL,
     last_updated TIMESTAMPTZ NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS media_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    priority SMALLINT NOT NULL DEFAULT 1,
+    user_id BIGINT,
+    guild_id BIGINT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at TIMESTAMPTZ,
+    heartbeat_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+
+ALTER TABLE media_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_media_jobs_queued ON media_jobs (priority, id) WHERE status = 'queued';
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import time
+import tagscript
+
+# Runs nested tags through the formatter loop as it used to work (splitting the text into chunks again at
+# every nesting level, on every run) and through compiled programs from tagscript's cache, with a few
+# cheap functions so the difference is the parsing.
+# Usage: python tagbench.py [--depth 32] [--width 20] [--runs 500]
+
+FUNCTIONS = {"upper": str.upper, "lower": str.lower, "reverse": lambda text: text[::-1]}
+
+def split_chunks(content: str) -> list[str]:
+    chunks = []
+    pos = 0
+    depth = 0
+    start = 0
+    for i, c in enumerate(content):
+        if c == '{':
+            if depth == 0:
+                if pos < i:
+                    chunks.append(content[pos:i])
+                start = i
+            depth += 1
+        elif c == '}' and depth > 0:
+            depth -= 1
+            if depth == 0:
+                chunks.append(content[start:i+1])
+                pos = i + 1
+    if pos < len(content):
+        chunks.append(content[pos:])
+    return chunks
+
+async def call(name: str, args: str) -> str:
+    return FUNCTIONS[name](args)
+
+async def legacy_format(content: str) -> str:
+    parts = []
+    for chunk in split_chunks(content):
+        if chunk.startswith('{') and chunk.endswith('}'):
+            name, _, args = chunk[1:-1].strip().partition(":")
+            name = name.strip()
+            if name not in FUNCTIONS:
+                parts.append(chunk)
+                continue
+            parts.append(await call(name, (await legacy_format(args)).strip()))
+        else:
+            parts.append(chunk)
+    return "".join(parts)
+
+async def render(program: tagscript.Program) -> str:
+    parts = []
+    for node in program.nodes:
+        if isinstance(node, tagscript.Block):
+            if node.name not in FUNCTIONS:
+                parts.append(node.source)
+                continue
+            parts.append(await call(node.name, (await render(node.program)).strip()))
+        else:
+            parts.append(node)
+    return "".join(parts)
+
+async def compiled_format(content: str) -> str:
+    return await render(tagscript.cache.get(content))
+
+def nested(depth: int, seed: int = 0) -> str:
+    content = f"hello {{user}} {seed}"
+    names = list(FUNCTIONS)
+    for i in range(depth):
+        content = f"{{{names[i % len(names)]}:level {i} {content} end}}"
+    return content
+
+async def measure(format, content: str, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        await format(content)
+    return (time.perf_counter() - start) / runs
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare running nested tags with and without compiled programs.")
+    parser.add_argument("--depth", type=int, default=32)
+    parser.add_argument("--width", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=500)
+    args = parser.parse_args()
+
+    cases = {
+        f"nested x{args.depth}": nested(args.depth),
+        f"{args.width} blocks nested x{args.depth // 4}": " ".join(nested(args.depth // 4, i) for i in range(args.width)),
+        "flat text": "plain text without blocks " * 40
+    }
+    print(f"{'Case':<28} {'Chars':>6} {'Old':>10} {'Cold':>10} {'Compiled':>10} {'Speedup':>8}")
+    for name, content in cases.items():
+        if await legacy_format(content) != await compiled_format(content):
+            raise RuntimeError(f"Outputs differ for {name}")
+        tagscript.cache.evict(content)
+        start = time.perf_counter()
+        await compiled_format(content)
+        cold = time.perf_counter() - start
+        old = await measure(legacy_format, content, args.runs)
+        new = await measure(compiled_format, content, args.runs)
+        print(f"{name:<28} {len(content):>6} {old * 1e6:>8.0f}us {cold * 1e6:>8.0f}us {new * 1e6:>8.0f}us {old / new:>7.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
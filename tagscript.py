@@ -0,0 +1,240 @@
+import asyncio
+import contextvars
+import hashlib
+import re
+import time
+from collections import OrderedDict, defaultdict
+import bot_info
+import memory
+import metrics
+
+# TagScript compiler. Tag content is parsed once into a Program, a list of literal strings and Blocks
+# ({name:args}), and programs are kept in an LRU keyed by a hash of the content, so running a tag again
+# (or a nested block's arguments) doesn't scan the text again. A Block's arguments are only parsed the
+# first time they're rendered, text that functions read raw ({ignore}, {note}, components) never is.
+# For lazy functions ({if}, {and}, ...) the arguments are split on | first and each one is its own
+# Program, so the function can render only the ones it needs.
+
+_BRACES = re.compile(r"[{}]")
+
+class Block:
+    __slots__ = ("source", "name", "args", "_program", "_arg_programs", "schedule")
+
+    def __init__(self, source: str):
+        self.source = source
+        name, _, args = source[1:-1].strip().partition(":")
+        self.name = name.strip()
+        self.args = args
+        self._program = None
+        self._arg_programs = None
+        # Set by the formatter the first time the block runs, see TagFormatter._schedule
+        self.schedule = None
+
+    @property
+    def program(self) -> "Program":
+        if self._program is None:
+            self._program = parse(self.args)
+        return self._program
+
+    @property
+    def arg_programs(self) -> list["Program"]:
+        if self._arg_programs is None:
+            self._arg_programs = [parse(part) for part in split_args(self.args)]
+        return self._arg_programs
+
+class Program:
+    __slots__ = ("nodes",)
+
+    def __init__(self, nodes: list):
+        self.nodes = nodes
+
+    def blocks(self) -> int:
+        return sum(isinstance(node, Block) for node in self.nodes)
+
+# Top level {...} blocks become Blocks, everything else (including unbalanced braces) stays text
+def parse(content: str) -> Program:
+    nodes = []
+    pos = 0
+    depth = 0
+    start = 0
+    for match in _BRACES.finditer(content):
+        i = match.start()
+        if match.group() == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            if depth == 0:
+                if pos < start:
+                    nodes.append(content[pos:start])
+                nodes.append(Block(content[start:i + 1]))
+                pos = i + 1
+    if pos < len(content):
+        nodes.append(content[pos:])
+    return Program(nodes)
+
+# Splits argument text on sep outside of blocks, so a nested block keeps its own separators. With
+# unescape the parse_args rules apply to the text outside blocks (quotes group, a backslash escapes the
+# next character and is dropped), otherwise only an escaped separator is unescaped.
+def split_args(text: str, sep: str = "|", unescape: bool = True) -> list[str]:
+    parts = []
+    current = []
+    depth = 0
+    in_quotes = False
+    escape = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if escape:
+            escape = False
+        elif depth == 0 and char == "\\":
+            if unescape:
+                escape = True
+                i += 1
+                continue
+            if text.startswith(sep, i + 1):
+                current.append(sep)
+                i += len(sep) + 1
+                continue
+        elif depth == 0 and unescape and char == '"':
+            in_quotes = not in_quotes
+            i += 1
+            continue
+        elif depth == 0 and not in_quotes and text.startswith(sep, i):
+            parts.append("".join(current).strip())
+            current = []
+            i += len(sep)
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+        current.append(char)
+        i += 1
+    if current:
+        parts.append("".join(current).strip())
+    return parts
+
+class CompileCache:
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.programs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(content: str) -> bytes:
+        return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+    def get(self, content: str) -> Program:
+        key = self.key(content)
+        program = self.programs.get(key)
+        if program is not None:
+            self.programs.move_to_end(key)
+            self.hits += 1
+            return program
+        self.misses += 1
+        program = self.programs[key] = parse(content)
+        if len(self.programs) > self.max_entries:
+            self.programs.popitem(last=False)
+            self.evictions += 1
+        return program
+
+    # For tag edits and deletes, the old content won't be run again
+    def evict(self, content: str) -> bool:
+        return self.programs.pop(self.key(content), None) is not None
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        return f"{len(self.programs)}/{self.max_entries} programs, {self.hits / lookups * 100 if lookups else 0.0:.0f}% hit rate"
+
+    def prometheus_lines(self) -> list[str]:
+        return [
+            "# TYPE gman_tagscript_programs gauge",
+            f"gman_tagscript_programs {len(self.programs)}",
+            "# TYPE gman_tagscript_compile_cache_total counter",
+            f'gman_tagscript_compile_cache_total{{result="hit"}} {self.hits}',
+            f'gman_tagscript_compile_cache_total{{result="miss"}} {self.misses}',
+            "# TYPE gman_tagscript_compile_cache_evictions_total counter",
+            f"gman_tagscript_compile_cache_evictions_total {self.evictions}"
+        ]
+
+_config = bot_info.data.get('tagscript', {})
+cache = CompileCache(_config.get('cache_size', 1024))
+# How many I/O blocks ({text}, {python}, ...) of one tag run at the same time
+max_concurrency = _config.get('max_concurrency', 4)
+# What one run of a tag may use: blocks run (and loop iterations in functions like {dice}), wall time and output
+max_steps = _config.get('max_steps', 2000)
+max_seconds = _config.get('max_seconds', 30.0)
+max_output = _config.get('max_output_bytes', 100000)
+
+class BudgetExceeded(Exception):
+    pass
+
+class Budget:
+    def __init__(self, max_steps: int, max_seconds: float, max_output: int):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.max_output = max_output
+        self.steps = 0
+        self.output = 0
+        self.start = time.perf_counter()
+
+    def step(self, count: int = 1):
+        self.steps += count
+        if self.steps > self.max_steps:
+            raise BudgetExceeded(f"ran more than {self.max_steps} steps")
+        if time.perf_counter() - self.start > self.max_seconds:
+            raise BudgetExceeded(f"took longer than {self.max_seconds:g}s")
+
+    def check_output(self, size: int):
+        self.output = max(self.output, size)
+        if size > self.max_output:
+            raise BudgetExceeded(f"output is larger than {self.max_output} bytes")
+
+# Calls and time per tag function, times include the blocks nested in the arguments
+class Profile:
+    def __init__(self):
+        self.functions = defaultdict(lambda: [0, 0.0, 0.0])
+        self.budget = None
+
+    def record(self, name: str, elapsed: float):
+        stats = self.functions[name]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+    def table(self) -> str:
+        lines = [f"{'Function':<16} {'Calls':>6} {'Total':>10} {'Avg':>10} {'Max':>10}"]
+        for name, (calls, total, longest) in sorted(self.functions.items(), key=lambda item: item[1][1], reverse=True):
+            lines.append(f"{name[:16]:<16} {calls:>6} {total * 1000:>8.1f}ms {total / calls * 1000:>8.1f}ms {longest * 1000:>8.1f}ms")
+        return "\n".join(lines)
+
+# State shared by everything rendered for one top level run of a tag
+class Run:
+    def __init__(self, profile: Profile = None):
+        self.budget = Budget(max_steps, max_seconds, max_output)
+        self.io_limit = asyncio.Semaphore(max_concurrency) if max_concurrency > 1 else None
+        self.profile = profile
+        if profile is not None:
+            profile.budget = self.budget
+
+current_run = contextvars.ContextVar("tagscript_run", default=None)
+
+def output_size(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode())
+
+# For functions that loop or build large strings, so they stay within the run's budget
+def charge(steps: int):
+    run = current_run.get()
+    if run is not None:
+        run.budget.step(steps)
+
+def check_output(size: int):
+    run = current_run.get()
+    if run is not None:
+        run.budget.check_output(size)
+metrics.register_collector(cache.prometheus_lines)
+memory.register("tagscript.programs", cache, "programs")
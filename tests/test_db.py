@@ -0,0 +1,49 @@
+import asyncio
+import sys
+import types
+import pytest
+
+pytest.importorskip("asyncpg")
+# db reads its settings from bot_info.json, the defaults are enough here
+sys.modules.setdefault("bot_info", types.SimpleNamespace(data={}))
+import db
+
+class FakeStatement:
+    async def fetchval(self, *args):
+        return ["g-"]
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = {}
+        self.prepares = 0
+
+    async def prepare(self, query, name=None):
+        self.prepares += 1
+        return FakeStatement()
+
+def test_prepared_statements_are_counted():
+    conn = FakeConnection()
+
+    async def run():
+        for _ in range(3):
+            statement = await db.prepared(conn, "user_prefixes")
+            assert await statement.fetchval(1) == ["g-"]
+
+    before = db.stats.statements.get("user_prefixes")
+    count = before.count if before else 0
+    asyncio.run(run())
+    assert conn.prepares == 1
+    assert db.stats.statements["user_prefixes"].count == count + 3
+    assert "user_prefixes" in db.stats.report()
+
+def test_prepared_statements_count_as_db_time():
+    conn = FakeConnection()
+    invocation = db.metrics.Invocation("prefix")
+
+    async def run():
+        db.metrics._current.set(invocation)
+        await (await db.prepared(conn, "guild_prefixes")).fetchval(1)
+
+    asyncio.run(run())
+    assert invocation.phases["db"] > 0
+    assert invocation.queries == ["guild_prefixes"]
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+import asyncpg
+import bot_info
+import io_pool
+import job_queue
+import http_client
+import download_cache
+
+# Standalone media worker: runs GScript and media cog jobs from the media_jobs table in separate processes,
+# so media work scales with cores or extra machines. The scratch directory must be shared with the bot.
+# Usage: python worker.py [processes]
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(processName)s - %(message)s")
+logger = logging.getLogger("worker")
+
+def reset_processor(processor):
+    for path in list(processor.media_cache.values()) + list(processor.temp_files):
+        try:
+            if path and os.path.exists(path):
+                os.unlink(path)
+        except OSError:
+            pass
+    processor.media_cache.clear()
+    processor.temp_files.clear()
+
+async def run_gscript(processor, payload: dict) -> tuple[list, list]:
+    results = await processor.execute_media_script(payload["script"])
+    if results == ["Processing complete"]:
+        return [], []
+    files = [r for r in results if isinstance(r, str) and os.path.isfile(r)]
+    errors = [r for r in results if isinstance(r, str) and not r.startswith("media://") and not os.path.isfile(r)]
+    return files, errors
+
+async def run_media(processor, payload: dict) -> tuple[list, list]:
+    for media_key, url in payload["loads"].items():
+        await processor._load_media(url=url, media_key=media_key)
+    try:
+        output_path = await processor.run_command(payload["command"], payload["input_key"], payload["output_key"], **payload["kwargs"])
+    except ValueError as e:
+        return [], [str(e)]
+    return [str(output_path)], []
+
+HANDLERS = {"gscript": run_gscript, "media": run_media}
+
+async def run_job(processor, job: dict) -> dict:
+    files, errors = await HANDLERS[job["kind"]](processor, job["payload"])
+    job_dir = job_queue.scratch_dir() / str(job["id"])
+    job_dir.mkdir(parents=True, exist_ok=True)
+    names = []
+    for path in files:
+        name = os.path.basename(path)
+        await io_pool.move(path, job_dir / name)
+        names.append(name)
+    return {"files": names, "errors": errors}
+
+async def send_heartbeats(pool, job_id: int, name: str, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with pool.acquire() as conn:
+                await job_queue.heartbeat(conn, job_id, name)
+        except Exception as e:
+            logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+
+async def work(name: str, index: int):
+    # Imported here so the supervisor process stays small
+    from cogs.tags import MediaProcessor
+    config = job_queue.config()
+    pool = await asyncpg.create_pool(bot_info.data['database'], min_size=1, max_size=2)
+    wake = asyncio.Event()
+    listener = await asyncpg.connect(bot_info.data['database'])
+    await listener.add_listener(job_queue.CHANNEL, lambda *args: wake.set())
+    # Each worker process keeps its own download cache, a restarted process starts with an empty one
+    cache = download_cache.create(http_client.HTTPClient(), f"worker-{socket.gethostname()}-{index}")
+    await cache.sweep()
+    processor = MediaProcessor(cache)
+    last_recovery = 0.0
+    logger.info(f"{name} waiting for jobs")
+
+    while True:
+        if time.monotonic() - last_recovery > 60:
+            async with pool.acquire() as conn:
+                await job_queue.recover_stale(conn, config.get('stale_after', 600), config.get('max_attempts', 2))
+            last_recovery = time.monotonic()
+
+        wake.clear()
+        async with pool.acquire() as conn:
+            job = await job_queue.claim(conn, name)
+        if job is None:
+            # Polling as well as listening, so a missed notification only delays a job
+            try:
+                await asyncio.wait_for(wake.wait(), 5)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        start = time.perf_counter()
+        result, error = None, None
+        heartbeats = asyncio.create_task(send_heartbeats(pool, job["id"], name, config.get('heartbeat_interval', 30)))
+        try:
+            result = await run_job(processor, job)
+        except Exception as e:
+            logger.exception(f"Job {job['id']} ({job['kind']}) failed")
+            error = f"Worker error: {e}"
+        finally:
+            heartbeats.cancel()
+            reset_processor(processor)
+        async with pool.acquire() as conn:
+            if not await job_queue.finish(conn, job["id"], result, error):
+                # The bot stopped waiting for this one
+                await io_pool.rmtree(job_queue.scratch_dir() / str(job["id"]))
+        logger.info(f"Job {job['id']} ({job['kind']}) {'failed' if error else 'done'} in {time.perf_counter() - start:.2f}s")
+
+def run_process(index: int):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(work(f"{socket.gethostname()}-{os.getpid()}-{index}", index))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else job_queue.config().get('worker_processes') or os.cpu_count() or 1
+    job_queue.scratch_dir().mkdir(parents=True, exist_ok=True)
+    processes = {}
+
+    stopping = False
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    logger.info(f"Starting {count} media worker processes")
+    while not stopping:
+        for i in range(count):
+            process = processes.get(i)
+            if process is None or not process.is_alive():
+                if process is not None:
+                    logger.warning(f"Worker {i} exited with code {process.exitcode}, restarting")
+                processes[i] = multiprocessing.Process(target=run_process, args=(i,), name=f"worker-{i}", daemon=True)
+                processes[i].start()
+        time.sleep(1)
+
+    logger.info("Stopping media workers")
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        process.join(timeout=30)
+
+if __name__ == "__main__":
+    main()
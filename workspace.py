@@ -0,0 +1,168 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+import bot_info
+import io_pool
+import metrics
+
+# Every media job gets its own scratch directory, removed when the last reference to it is released.
+# Each live workspace counts as at least `reserve` bytes, even before anything is written to it, and new
+# workspaces wait while the live ones would go over the quota, so a burst of jobs can't fill the disk.
+# Under launcher.py the quota in bot_info.json is shared by all clusters, each gets an equal part.
+# Usage: workspace = await workspaces.acquire("caption"), then path = workspace.file(name), then await workspace.release()
+
+class WorkspaceFull(Exception):
+    pass
+
+class Workspace:
+    def __init__(self, manager, kind: str, path: Path):
+        self.manager = manager
+        self.kind = kind
+        self.path = path
+        self.refs = 1
+        self.created_at = time.monotonic()
+        self.measured = 0
+
+    # Path for a file inside the workspace, only the base name of the given name is used
+    def file(self, name: str) -> str:
+        return str(self.path / (os.path.basename(name) or "file"))
+
+    def retain(self):
+        self.refs += 1
+        return self
+
+    async def release(self):
+        self.refs -= 1
+        if self.refs == 0:
+            await self.manager._remove(self)
+
+    def size(self) -> int:
+        total = 0
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(directory, name))
+                except OSError:
+                    pass
+        return total
+
+class WorkspaceManager:
+    def __init__(self, root: Path, quota: int, wait_timeout: float, reserve: int = 0):
+        self.root = root.resolve()
+        self.quota = quota
+        self.reserve = reserve
+        self.wait_timeout = wait_timeout
+        self.active = {}
+        self.waiting = 0
+        self.rejected = 0
+        self.created = Counter()
+        self._freed = None
+        self._usage = 0
+        self._measured_at = 0.0
+
+    # Removes whatever a previous run of this process left behind
+    async def sweep(self):
+        await io_pool.rmtree(self.root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _measure(self):
+        for workspace in list(self.active.values()):
+            workspace.measured = workspace.size()
+
+    # Measured sizes are cached for max_age, workspaces created since count as their reservation
+    async def usage(self, max_age: float = 1.0) -> int:
+        if time.monotonic() - self._measured_at > max_age:
+            await io_pool.run(self._measure)
+            self._measured_at = time.monotonic()
+        self._usage = sum(max(workspace.measured, self.reserve) for workspace in self.active.values())
+        return self._usage
+
+    async def acquire(self, kind: str) -> Workspace:
+        deadline = time.monotonic() + self.wait_timeout
+        # A lone job always gets its workspace, even with a reservation larger than the quota
+        while self.active and await self.usage() + self.reserve > self.quota:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.rejected += 1
+                raise WorkspaceFull("The bot's scratch disk is full right now, try again in a bit.")
+            if self._freed is None:
+                self._freed = asyncio.Event()
+            self.waiting += 1
+            try:
+                # Files can also shrink or vanish without a release, so check again now and then
+                await asyncio.wait_for(self._freed.wait(), min(remaining, 5))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiting -= 1
+        path = self.root / f"{kind}-{uuid.uuid4().hex[:12]}"
+        path.mkdir(parents=True)
+        workspace = Workspace(self, kind, path)
+        self.active[path] = workspace
+        self.created[kind] += 1
+        return workspace
+
+    async def _remove(self, workspace: Workspace):
+        self.active.pop(workspace.path, None)
+        await io_pool.rmtree(workspace.path)
+        self._measured_at = 0.0
+        if self._freed is not None:
+            self._freed.set()
+            self._freed = None
+
+    async def report(self) -> dict:
+        by_kind = Counter()
+        bytes_by_kind = Counter()
+        sizes = await io_pool.run(lambda: [(workspace.kind, workspace.size()) for workspace in list(self.active.values())])
+        for kind, size in sizes:
+            by_kind[kind] += 1
+            bytes_by_kind[kind] += size
+        disk = shutil.disk_usage(self.root)
+        return {
+            "used": sum(bytes_by_kind.values()),
+            "quota": self.quota,
+            "workspaces": dict(by_kind),
+            "bytes": dict(bytes_by_kind),
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "disk_free": disk.free
+        }
+
+    async def summary(self) -> str:
+        report = await self.report()
+        kinds = ", ".join(f"{kind} {count}" for kind, count in sorted(report["workspaces"].items())) or "none"
+        return f"{report['used'] / 1024 ** 2:.1f}/{report['quota'] / 1024 ** 2:.0f} MB in {sum(report['workspaces'].values())} workspaces ({kinds}), {report['waiting']} waiting, {report['rejected']} rejected, {report['disk_free'] / 1024 ** 3:.1f} GB free"
+
+    def prometheus_lines(self) -> list[str]:
+        lines = [
+            "# TYPE gman_workspace_bytes gauge",
+            f"gman_workspace_bytes {self._usage}",
+            "# TYPE gman_workspace_quota_bytes gauge",
+            f"gman_workspace_quota_bytes {self.quota}",
+            "# TYPE gman_workspace_active gauge",
+            f"gman_workspace_active {len(self.active)}",
+            "# TYPE gman_workspace_waiting gauge",
+            f"gman_workspace_waiting {self.waiting}",
+            "# TYPE gman_workspace_rejected_total counter",
+            f"gman_workspace_rejected_total {self.rejected}",
+            "# TYPE gman_workspace_created_total counter"
+        ]
+        lines += [f'gman_workspace_created_total{{kind="{kind}"}} {count}' for kind, count in sorted(self.created.items())]
+        return lines
+
+_config = bot_info.data.get('workspaces', {})
+_cluster_id = os.environ.get('GMAN_CLUSTER_ID')
+_cluster_count = int(os.environ.get('GMAN_CLUSTER_COUNT', 1))
+# Each cluster gets its own root so sweeping at startup can't touch another cluster's jobs
+_root = Path(_config.get('root', 'vids/work')) / (f"cluster-{_cluster_id}" if _cluster_id is not None else "main")
+workspaces = WorkspaceManager(
+    _root,
+    int(_config.get('quota_mb', 2048) * 1024 ** 2 / _cluster_count),
+    _config.get('wait_timeout', 60),
+    int(_config.get('reserve_mb', 64) * 1024 ** 2)
+)
+metrics.register_collector(workspaces.prometheus_lines)